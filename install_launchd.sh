@@ -13,6 +13,14 @@ if [[ ! -f "$WORKDIR/config.json" ]]; then
   exit 1
 fi
 
+if [[ "${1:-}" == "--config-only" ]]; then
+  # The running watchdog polls its config and hot-reloads it; no restart needed.
+  mkdir -p "$RUNDIR"
+  cp "$WORKDIR/config.json" "$RUNDIR/config.json"
+  echo "Copied config.json to $RUNDIR (watchdog reloads it automatically)"
+  exit 0
+fi
+
 PYTHON_BIN="$(command -v python3 || true)"
 if [[ -z "$PYTHON_BIN" ]]; then
   echo "python3 not found"
@@ -23,6 +31,8 @@ mkdir -p "$HOME/Library/LaunchAgents"
 mkdir -p "$RUNDIR"
 
 cp "$WORKDIR/watchdog.py" "$RUNDIR/watchdog.py"
+mkdir -p "$RUNDIR/remote_km"
+cp "$WORKDIR/remote_km/common.py" "$RUNDIR/remote_km/common.py"
 cp "$WORKDIR/config.json" "$RUNDIR/config.json"
 
 sed \
@@ -1,7 +1,10 @@
+import argparse
 import hashlib
 import hmac
 import json
-from typing import Any, Dict
+import struct
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 
 def pack_message(message: Dict[str, Any], secret: str) -> bytes:
@@ -21,3 +24,204 @@ def unpack_message(packet_bytes: bytes, secret: str) -> Dict[str, Any]:
         raise ValueError("invalid signature")
     return msg
 
+
+# Binary input-event framing (version 1):
+#   header  magic:u8 version:u8 type:u8 reserved:u8 seq:u64 ts:f64   (network byte order)
+#   body    fixed fields per type, see BODIES
+#   tag     first TAG_LEN bytes of HMAC-SHA256(secret, header + body)
+# A batch (type 0) carries `reserved` = event count and, after the header, one type byte plus body
+# per event; event i has seq + i, all share ts. Legacy JSON packets always start with "{", so the
+# first byte tells the formats apart. Types 5-10 are the optional session layer (see session.py);
+# they never reach input injection. Session codecs send events as type 11 instead of 0 (also for a
+# single event): a batch whose header is followed by back:u32, the distance from the first event's
+# seq to the last key or button event sent before it (0 if unknown). Keys and buttons are the only
+# events a session retransmits, so any number after that one and missing on arrival is lost for good.
+MAGIC = 0xB7
+VERSION = 1
+TAG_LEN = 16
+HEADER = struct.Struct("!BBBBQd")
+
+BUTTONS = ("left", "right", "middle")
+BUTTON_CODES = {name: i for i, name in enumerate(BUTTONS)}
+
+# type code -> (message "t", body struct, body field names); "btn" travels as an index into BUTTONS.
+BODIES: Dict[int, Tuple[str, struct.Struct, Tuple[str, ...]]] = {
+    1: ("key", struct.Struct("!BHQ"), ("et", "keycode", "flags")),
+    2: ("move", struct.Struct("!ffQ"), ("nx", "ny", "flags")),
+    3: ("button", struct.Struct("!BBffQ"), ("et", "btn", "nx", "ny", "flags")),
+    4: ("scroll", struct.Struct("!iiQ"), ("dx", "dy", "flags")),
+    5: ("hello", struct.Struct("!16s"), ("nonce",)),
+    6: ("welcome", struct.Struct("!16s16s"), ("nonce", "server_nonce")),
+    7: ("ping", struct.Struct("!d"), ("sent_at",)),
+    8: ("pong", struct.Struct("!d"), ("sent_at",)),
+    9: ("ack", struct.Struct("!QQ"), ("ack", "mask")),
+    10: ("bye", struct.Struct("!B"), ("reason",)),
+}
+TYPE_CODES = {name: code for code, (name, _, _) in BODIES.items()}
+BATCH = 0
+HINTED_BATCH = 11
+BACK = struct.Struct("!I")
+MAX_BATCH = 255
+# Event types a session retransmits until acked.
+RELIABLE = frozenset(("key", "button"))
+RELIABLE_CODES = frozenset(TYPE_CODES[t] for t in RELIABLE)
+
+
+class Codec:
+    """Encodes input events in the binary framing and decodes both it and the legacy JSON format.
+
+    The HMAC key schedule is computed once; each packet only copies that state and hashes its bytes.
+    `secret` is the shared passphrase, or raw key bytes for a derived session key (binary only).
+    With `hints`, events carrying "rel" (see outbox.Outbox.emit) go out as HINTED_BATCH packets;
+    decoding sets "rel" on each event of such a packet.
+    """
+
+    def __init__(self, secret: Union[str, bytes], accept_legacy: bool = True, hints: bool = False):
+        self.secret = secret
+        self.accept_legacy = accept_legacy and isinstance(secret, str)
+        self.hints = hints
+        key = secret if isinstance(secret, bytes) else secret.encode("utf-8")
+        self.mac = hmac.new(key, digestmod=hashlib.sha256)
+
+    def tag(self, data: bytes) -> bytes:
+        mac = self.mac.copy()
+        mac.update(data)
+        return mac.digest()[:TAG_LEN]
+
+    @staticmethod
+    def body(msg: Dict[str, Any]) -> Tuple[int, bytes]:
+        code = TYPE_CODES[msg["t"]]
+        _, body, fields = BODIES[code]
+        values = [msg.get(name, 0) for name in fields]
+        if code == 3:
+            values[fields.index("btn")] = BUTTON_CODES.get(msg.get("btn", "left"), 0)
+        return code, body.pack(*values)
+
+    def encode(self, msg: Dict[str, Any]) -> bytes:
+        if self.hints and "rel" in msg:
+            return self.encode_batch([msg])
+        code, body = self.body(msg)
+        data = HEADER.pack(MAGIC, VERSION, code, 0, int(msg.get("seq", 0)), float(msg.get("ts", 0.0))) + body
+        return data + self.tag(data)
+
+    def encode_batch(self, msgs: List[Dict[str, Any]]) -> bytes:
+        """One datagram for several events; seq/ts come from the first event."""
+        if not 0 < len(msgs) <= MAX_BATCH:
+            raise ValueError(f"batch size must be 1..{MAX_BATCH}")
+        first = msgs[0]
+        hinted = self.hints and "rel" in first
+        if len(msgs) == 1 and not hinted:
+            return self.encode(first)
+        seq = int(first.get("seq", 0))
+        code = HINTED_BATCH if hinted else BATCH
+        parts = [HEADER.pack(MAGIC, VERSION, code, len(msgs), seq, float(first.get("ts", 0.0)))]
+        if hinted:
+            back = seq - int(first["rel"])
+            parts.append(BACK.pack(back if 0 < back <= 0xFFFFFFFF else 0))
+        for msg in msgs:
+            code, body = self.body(msg)
+            parts.append(bytes((code,)))
+            parts.append(body)
+        data = b"".join(parts)
+        return data + self.tag(data)
+
+    def decode(self, packet: bytes) -> Dict[str, Any]:
+        msgs = self.decode_many(packet)
+        if len(msgs) != 1:
+            raise ValueError("expected a single event")
+        return msgs[0]
+
+    def decode_many(self, packet: bytes) -> List[Dict[str, Any]]:
+        """Events in a packet: one for single-event or legacy JSON packets, several for a batch."""
+        if not packet:
+            raise ValueError("empty packet")
+        if packet[0] != MAGIC:
+            if self.accept_legacy and packet[:1] == b"{":
+                return [unpack_message(packet, self.secret)]
+            raise ValueError("unknown packet format")
+        if len(packet) < HEADER.size + TAG_LEN:
+            raise ValueError("short packet")
+        data, tag = packet[:-TAG_LEN], packet[-TAG_LEN:]
+        if not hmac.compare_digest(tag, self.tag(data)):
+            raise ValueError("invalid signature")
+        _, version, code, count, seq, ts = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f"unsupported version {version}")
+        if code != BATCH and code != HINTED_BATCH:
+            msg = self.read_body(data, HEADER.size, code, len(data))[0]
+            msg["seq"] = seq
+            msg["ts"] = ts
+            return [msg]
+        msgs: List[Dict[str, Any]] = []
+        offset = HEADER.size
+        rel: Optional[int] = None
+        if code == HINTED_BATCH:
+            if len(data) < offset + BACK.size:
+                raise ValueError("truncated batch")
+            back = BACK.unpack_from(data, offset)[0]
+            offset += BACK.size
+            rel = seq - back if back else None
+        for i in range(count):
+            if offset >= len(data):
+                raise ValueError("truncated batch")
+            event = data[offset]
+            msg, offset = self.read_body(data, offset + 1, event, None)
+            msg["seq"] = seq + i
+            msg["ts"] = ts
+            if code == HINTED_BATCH:
+                if rel is not None:
+                    msg["rel"] = rel
+                if event in RELIABLE_CODES:
+                    rel = seq + i
+            msgs.append(msg)
+        if offset != len(data):
+            raise ValueError("bad batch length")
+        return msgs
+
+    @staticmethod
+    def read_body(data: bytes, offset: int, code: int, end: Any) -> Tuple[Dict[str, Any], int]:
+        try:
+            name, body, fields = BODIES[code]
+        except KeyError:
+            raise ValueError(f"unknown event type {code}") from None
+        stop = offset + body.size
+        if stop > len(data) or (end is not None and stop != end):
+            raise ValueError("bad body length")
+        msg = dict(zip(fields, body.unpack_from(data, offset)))
+        if code == 3:
+            msg["btn"] = BUTTONS[msg["btn"]] if msg["btn"] < len(BUTTONS) else "left"
+        msg["t"] = name
+        return msg, stop
+
+
+def bench_codec(iterations: int) -> List[Tuple[str, float, int]]:
+    """(name, microseconds per packet, packet bytes) for legacy JSON vs binary, encode and decode."""
+    secret = "bench-secret-" + "x" * 32
+    codec = Codec(secret)
+    move = {"t": "move", "nx": 0.4183, "ny": 0.7712, "flags": 256, "seq": 123456, "ts": time.time()}
+    key = {"t": "key", "et": 10, "keycode": 15, "flags": 1048840, "seq": 123457, "ts": time.time()}
+    results: List[Tuple[str, float, int]] = []
+    for label, msg in (("move", move), ("key", key)):
+        legacy = pack_message(msg, secret)
+        binary = codec.encode(msg)
+        cases: List[Tuple[str, Callable[[], Any], int]] = [
+            (f"{label} legacy json encode", lambda: pack_message(msg, secret), len(legacy)),
+            (f"{label} legacy json decode", lambda: unpack_message(legacy, secret), len(legacy)),
+            (f"{label} binary encode", lambda: codec.encode(msg), len(binary)),
+            (f"{label} binary decode", lambda: codec.decode(binary), len(binary)),
+        ]
+        for name, fn, size in cases:
+            fn()
+            start = time.perf_counter()
+            for _ in range(iterations):
+                fn()
+            results.append((name, (time.perf_counter() - start) / iterations * 1e6, size))
+    return results
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="remote_km wire codec micro-benchmark")
+    p.add_argument("--iterations", type=int, default=50000)
+    args = p.parse_args()
+    for name, usec, size in bench_codec(args.iterations):
+        print(f"{name}: {usec:.2f} us/packet, {size} bytes")
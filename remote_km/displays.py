@@ -0,0 +1,160 @@
+"""Display geometry shared by sender and receiver, free of Quartz so it runs anywhere.
+
+A normalized point is not a position in the bounding rectangle of all displays, which has dead
+areas whenever displays differ in size or are offset. Along the axis the displays are laid out
+on (left-to-right for side-by-side screens), the coordinate spans the whole arrangement. Across
+it, the coordinate spans only the displays at that position. A point on a short display beside a
+tall one therefore uses the short display's full height, and denormalize() always lands on a
+real screen.
+"""
+import argparse
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+Rect = Tuple[float, float, float, float]  # x, y, width, height in global display coordinates
+
+
+def clamp(v: float, lo: float, hi: float) -> float:
+    return lo if v < lo else hi if v > hi else v
+
+
+class DisplayLayout:
+    def __init__(self, rects: Sequence[Rect]):
+        rects = [r for r in rects if r[2] > 0 and r[3] > 0] or [(0.0, 0.0, 1.0, 1.0)]
+        self.rects: List[Rect] = list(rects)
+        self.single: Optional[Rect] = self.rects[0] if len(self.rects) == 1 else None
+        x0 = min(r[0] for r in rects)
+        y0 = min(r[1] for r in rects)
+        x1 = max(r[0] + r[2] for r in rects)
+        y1 = max(r[1] + r[3] for r in rects)
+        # Lay out along whichever axis the displays spread across more (in display widths/heights).
+        self.horizontal = (x1 - x0) / max(r[2] for r in rects) >= (y1 - y0) / max(r[3] for r in rects)
+        if self.horizontal:
+            # (start, end) along the layout axis, (start, end) across it.
+            self.spans = [((r[0], r[0] + r[2]), (r[1], r[1] + r[3])) for r in rects]
+            self.lo, self.size = x0, x1 - x0
+        else:
+            self.spans = [((r[1], r[1] + r[3]), (r[0], r[0] + r[2])) for r in rects]
+            self.lo, self.size = y0, y1 - y0
+
+    def band(self, a: float) -> Tuple[float, float, List[int]]:
+        """Extent across the layout axis of the displays at position `a`, and their indexes."""
+        hit = [i for i, (along, _) in enumerate(self.spans) if along[0] <= a < along[1]]
+        if not hit:
+            # In a gap between displays, or on the far edge: use the nearest display.
+            nearest = min(
+                range(len(self.spans)),
+                key=lambda i: min(abs(a - self.spans[i][0][0]), abs(a - self.spans[i][0][1])),
+            )
+            hit = [nearest]
+        return min(self.spans[i][1][0] for i in hit), max(self.spans[i][1][1] for i in hit), hit
+
+    def normalize(self, x: float, y: float) -> Tuple[float, float]:
+        if self.single is not None:
+            rx, ry, w, h = self.single
+            return clamp((x - rx) / w, 0.0, 1.0), clamp((y - ry) / h, 0.0, 1.0)
+        a, b = (x, y) if self.horizontal else (y, x)
+        a = clamp(a, self.lo, self.lo + self.size)
+        lo, hi, _ = self.band(a)
+        na = (a - self.lo) / self.size
+        nb = (clamp(b, lo, hi) - lo) / max(1.0, hi - lo)
+        return (na, nb) if self.horizontal else (nb, na)
+
+    def denormalize(self, nx: float, ny: float) -> Tuple[float, float]:
+        if self.single is not None:
+            rx, ry, w, h = self.single
+            return rx + clamp(nx, 0.0, 1.0) * w, ry + clamp(ny, 0.0, 1.0) * h
+        na, nb = (nx, ny) if self.horizontal else (ny, nx)
+        na = clamp(na, 0.0, 1.0)
+        nb = clamp(nb, 0.0, 1.0)
+        a = self.lo + na * self.size
+        lo, hi, hit = self.band(a)
+        b = lo + nb * (hi - lo)
+        # Snap into the closest display of the band: stacked displays of different sizes leave holes.
+        best = None
+        for i in hit:
+            along, across = self.spans[i]
+            pa = clamp(a, along[0], along[1] - 1.0)
+            pb = clamp(b, across[0], across[1] - 1.0)
+            d = abs(pa - a) + abs(pb - b)
+            if best is None or d < best[0]:
+                best = (d, pa, pb)
+        _, a, b = best
+        return (a, b) if self.horizontal else (b, a)
+
+
+class DisplayCache:
+    """Keeps the current DisplayLayout off the per-event path.
+
+    `query` returns the active display rects. It runs again after invalidate() (wired to
+    the display reconfiguration callback where a run loop delivers it) or once `max_age_sec`
+    has passed, which catches changes on processes without a run loop.
+    """
+
+    def __init__(self, query: Callable[[], Sequence[Rect]], max_age_sec: float = 2.0, clock: Callable[[], float] = time.monotonic):
+        self.query = query
+        self.max_age_sec = max_age_sec
+        self.clock = clock
+        self.current: Optional[DisplayLayout] = None
+        self.expires_at = 0.0
+        self.refreshes = 0
+
+    def invalidate(self, *_args) -> None:
+        self.current = None
+
+    def layout(self) -> DisplayLayout:
+        now = self.clock()
+        if self.current is None or now >= self.expires_at:
+            rects = tuple(self.query())
+            if self.current is None or rects != tuple(self.current.rects):
+                self.current = DisplayLayout(rects)
+            self.expires_at = now + self.max_age_sec
+            self.refreshes += 1
+        return self.current
+
+
+def quartz_display_rects() -> List[Rect]:
+    """Active display bounds from CoreGraphics (macOS only; imported here so this module stays portable)."""
+    import Quartz
+
+    err, display_ids, _ = Quartz.CGGetActiveDisplayList(16, None, None)
+    if err != Quartz.kCGErrorSuccess or not display_ids:
+        display_ids = [Quartz.CGMainDisplayID()]
+    rects = []
+    for d in display_ids:
+        b = Quartz.CGDisplayBounds(d)
+        rects.append((b.origin.x, b.origin.y, b.size.width, b.size.height))
+    return rects
+
+
+def parse_layout(text: str) -> List[Rect]:
+    """Parses "x,y,w,h;x,y,w,h" as given to --layout."""
+    rects = []
+    for part in text.split(";"):
+        x, y, w, h = (float(v) for v in part.split(","))
+        rects.append((x, y, w, h))
+    return rects
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Show and time normalized-point mapping for a display layout")
+    p.add_argument("--layout", default="0,0,1512,982;1512,-458,2560,1440", help="x,y,w,h;... in points")
+    p.add_argument("--iterations", type=int, default=200000)
+    args = p.parse_args()
+
+    layout = DisplayLayout(parse_layout(args.layout))
+    print(f"axis={'horizontal' if layout.horizontal else 'vertical'} rects={layout.rects}")
+    for nx, ny in ((0.0, 0.0), (0.25, 0.5), (0.5, 0.0), (0.75, 1.0), (1.0, 1.0)):
+        x, y = layout.denormalize(nx, ny)
+        bx, by = layout.normalize(x, y)
+        print(f"({nx:.2f}, {ny:.2f}) -> ({x:.0f}, {y:.0f}) -> ({bx:.3f}, {by:.3f})")
+
+    cache = DisplayCache(lambda: layout.rects)
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        cache.layout().denormalize((i % 1000) / 1000, 0.5)
+    print(f"cached denormalize: {(time.perf_counter() - start) / args.iterations * 1e6:.2f} us/point")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+"""Receiver-side event pipeline, free of Quartz so it runs (and can be exercised) anywhere.
+
+Every event carries the sender's sequence number (see outbox.Outbox.emit). Moves are absolute
+positions, so a late one is simply dropped. Key, button and scroll events are delivered in
+sequence order, waiting at most `reorder_sec` for a missing number before skipping it. Old or
+repeated numbers are rejected, and keys or buttons still held when the sender goes quiet are
+released. Injection itself sits behind Backend.
+"""
+import abc
+import argparse
+import heapq
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from outbox import fake_events
+
+# Quartz CGEventType values used by the key/button messages.
+KEY_DOWN = 10
+KEY_UP = 11
+FLAGS_CHANGED = 12
+BUTTON_UP_FOR_DOWN = {1: 2, 3: 4, 25: 26}
+BUTTON_DOWNS = frozenset(BUTTON_UP_FOR_DOWN)
+BUTTON_UPS = frozenset(BUTTON_UP_FOR_DOWN.values())
+
+# Modifier keycode -> kCGEventFlagMask* bit. Caps Lock is a toggle and is left out on purpose.
+MODIFIER_MASKS = {
+    55: 1 << 20,  # command
+    54: 1 << 20,
+    56: 1 << 17,  # shift
+    60: 1 << 17,
+    58: 1 << 19,  # option
+    61: 1 << 19,
+    59: 1 << 18,  # control
+    62: 1 << 18,
+}
+
+# A forward jump this large (about one second of sender uptime in outbox seq units) is a new stream.
+MAX_SEQ_JUMP = 1 << 16
+
+
+class Backend(abc.ABC):
+    """Posts decoded events to the OS. One method per message type; all four are required."""
+
+    @abc.abstractmethod
+    def key(self, msg: Dict[str, Any]) -> None:
+        """Key down/up or a modifier change (flags-changed)."""
+
+    @abc.abstractmethod
+    def move(self, msg: Dict[str, Any]) -> None:
+        """Pointer move to a normalized position."""
+
+    @abc.abstractmethod
+    def button(self, msg: Dict[str, Any]) -> None:
+        """Mouse button down/up or drag."""
+
+    @abc.abstractmethod
+    def scroll(self, msg: Dict[str, Any]) -> None:
+        """Scroll wheel deltas."""
+
+
+class RecordingBackend(Backend):
+    """Stand-in that keeps every injected message, for benchmarks and checks off macOS."""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+
+    def key(self, msg: Dict[str, Any]) -> None:
+        self.events.append(msg)
+
+    move = button = scroll = key
+
+
+def is_release(msg: Dict[str, Any]) -> bool:
+    """A key, modifier or button release, whose press may have been sent before it."""
+    et = int(msg.get("et", 0))
+    if msg.get("t") == "button":
+        return et in BUTTON_UPS
+    if msg.get("t") != "key":
+        return False
+    if et == FLAGS_CHANGED:
+        mask = MODIFIER_MASKS.get(int(msg.get("keycode", 0)))
+        return mask is not None and not int(msg.get("flags", 0)) & mask
+    return et == KEY_UP
+
+
+class Inbox:
+    def __init__(
+        self,
+        backend: Backend,
+        reorder_sec: float = 0.02,
+        max_pending: int = 64,
+        hold_timeout_sec: float = 5.0,
+        replay_window: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+        on_error: Optional[Callable[[Dict[str, Any], Exception], None]] = None,
+    ):
+        self.backend = backend
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {
+            "key": backend.key,
+            "move": backend.move,
+            "button": backend.button,
+            "scroll": backend.scroll,
+        }
+        self.reorder_sec = reorder_sec
+        self.max_pending = max_pending
+        self.hold_timeout_sec = hold_timeout_sec
+        self.replay_window = replay_window
+        self.clock = clock
+        self.on_error = on_error
+        # Sequence state: everything below `expect` is delivered or given up on.
+        self.expect: Optional[int] = None
+        self.highest = -1
+        self.newest_ts = 0.0
+        self.seen: Set[int] = set()
+        # seq -> message waiting for its turn; None marks a move already injected out of band.
+        self.slots: Dict[int, Optional[Dict[str, Any]]] = {}
+        # seq -> arrival time of each slot: a gap is timed from when the packets after it showed up.
+        self.arrivals: Dict[int, float] = {}
+        self.gap_since: Optional[float] = None
+        self.stream_start = 0
+        self.last_move_seq = -1
+        self.last_move: Optional[Dict[str, Any]] = None
+        self.held_keys: Dict[int, Dict[str, Any]] = {}
+        self.held_buttons: Dict[str, Dict[str, Any]] = {}
+        # ("key", keycode) / ("button", name) -> seq of the last release, to spot downs arriving after it.
+        self.up_seqs: Dict[Tuple[str, Any], int] = {}
+        self.last_packet_at = 0.0
+        self.stats: Dict[str, int] = {
+            "delivered": 0,
+            "stale_moves": 0,
+            "replayed": 0,
+            "reordered": 0,
+            "skipped": 0,
+            "released": 0,
+            "stale_downs": 0,
+            "streams": 0,
+            "errors": 0,
+        }
+
+    def receive(self, msgs: List[Dict[str, Any]]) -> None:
+        """Events from one datagram, in the order the codec returned them."""
+        now = self.clock()
+        self.last_packet_at = now
+        for msg in msgs:
+            self.accept(msg)
+        self.advance(now)
+
+    def accept(self, msg: Dict[str, Any]) -> None:
+        if "seq" not in msg:
+            self.deliver(msg)
+            return
+        seq = int(msg["seq"])
+        ts = float(msg.get("ts", 0.0))
+        if self.expect is None or self.restarted(seq, ts):
+            self.reset(seq, msg)
+        elif seq <= self.highest - self.replay_window or seq in self.seen:
+            self.stats["replayed"] += 1
+            return
+        self.remember(seq, ts)
+        if msg.get("rel") is not None:
+            self.give_up_unreliable(int(msg["rel"]), seq)
+
+        if msg.get("t") == "move":
+            if seq > self.last_move_seq:
+                self.last_move_seq = seq
+                self.last_move = msg
+                self.deliver(msg)
+            else:
+                self.stats["stale_moves"] += 1
+            if seq >= self.expect:
+                self.slots[seq] = None
+                self.arrivals[seq] = self.last_packet_at
+        elif seq < self.expect:
+            # Its gap was already skipped; a late up still matters, a late down only if nothing released
+            # that key since (see track_key/track_button).
+            self.stats["reordered"] += 1
+            self.deliver(msg)
+        else:
+            if seq != self.expect:
+                self.stats["reordered"] += 1
+            self.slots[seq] = msg
+            self.arrivals[seq] = self.last_packet_at
+
+    def restarted(self, seq: int, ts: float) -> bool:
+        """A sender restart moves seq far away but always carries a newer timestamp; a replay cannot."""
+        if ts <= self.newest_ts:
+            return False
+        return seq > self.highest + MAX_SEQ_JUMP or seq <= self.highest - self.replay_window
+
+    def reset(self, seq: int, first: Dict[str, Any]) -> None:
+        if self.expect is not None:
+            self.flush()
+            self.release_all()
+        self.stats["streams"] += 1
+        self.expect = seq
+        if is_release(first):
+            # Its press may still be on the way (lost and retransmitted by a session, or plain jitter):
+            # give up to max_pending earlier numbers one reorder window to show up.
+            self.expect = max(seq - self.max_pending, 0)
+        self.stream_start = seq
+        self.highest = seq - 1
+        self.seen.clear()
+        self.up_seqs.clear()
+        self.last_move_seq = -1
+
+    def give_up_unreliable(self, rel: int, seq: int) -> None:
+        """Numbers after `rel`, the sender's last key or button, were moves and scrolls: nobody resends them."""
+        for missing in range(max(rel + 1, self.expect, seq - self.max_pending), seq):
+            if missing not in self.slots:
+                self.slots[missing] = None
+                self.arrivals[missing] = self.last_packet_at
+
+    def remember(self, seq: int, ts: float) -> None:
+        self.seen.add(seq)
+        if seq > self.highest:
+            self.highest = seq
+        if ts > self.newest_ts:
+            self.newest_ts = ts
+        if len(self.seen) > 2 * self.replay_window:
+            floor = self.highest - self.replay_window
+            self.seen = {s for s in self.seen if s > floor}
+
+    def advance(self, now: float) -> None:
+        assert self.expect is not None or not self.slots
+        while True:
+            while self.expect in self.slots:
+                msg = self.slots.pop(self.expect)
+                del self.arrivals[self.expect]
+                self.expect += 1
+                if msg is not None:
+                    self.deliver(msg)
+            if not self.slots:
+                self.gap_since = None
+                return
+            if self.gap_since is None:
+                # Not `now`: after a skip the next gap may have been waiting all along behind the first.
+                self.gap_since = self.arrivals[min(self.slots)]
+            if now < self.gap_since + self.reorder_sec and len(self.slots) < self.max_pending:
+                return
+            # The missing numbers are lost (or very late): move on to what did arrive.
+            first = min(self.slots)
+            self.stats["skipped"] += first - max(self.expect, min(self.stream_start, first))
+            self.expect = first
+            self.gap_since = None
+
+    def flush(self) -> None:
+        for seq in sorted(self.slots):
+            msg = self.slots[seq]
+            if msg is not None:
+                self.deliver(msg)
+        self.slots.clear()
+        self.arrivals.clear()
+        self.gap_since = None
+
+    def tick(self) -> None:
+        """Call when no packet arrived before deadline(): skips expired gaps, releases held input."""
+        now = self.clock()
+        if self.slots:
+            self.advance(now)
+        if (self.held_keys or self.held_buttons) and now >= self.last_packet_at + self.hold_timeout_sec:
+            self.release_all()
+
+    def deadline(self) -> Optional[float]:
+        """Clock time at which tick() has work to do, or None to wait for the next packet."""
+        deadlines = []
+        if self.gap_since is not None:
+            deadlines.append(self.gap_since + self.reorder_sec)
+        if self.held_keys or self.held_buttons:
+            deadlines.append(self.last_packet_at + self.hold_timeout_sec)
+        return min(deadlines) if deadlines else None
+
+    def deliver(self, msg: Dict[str, Any]) -> None:
+        t = msg.get("t")
+        if t == "key":
+            if not self.track_key(msg):
+                return
+        elif t == "button":
+            if not self.track_button(msg):
+                return
+        handler = self.handlers.get(t)
+        if handler is None:
+            return
+        try:
+            handler(msg)
+            self.stats["delivered"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            if self.on_error is not None:
+                self.on_error(msg, e)
+
+    def stale_down(self, key: Tuple[str, Any], msg: Dict[str, Any]) -> bool:
+        """True for a press older than the last release of the same key/button: injecting it would stick."""
+        seq = msg.get("seq")
+        if seq is not None and int(seq) < self.up_seqs.get(key, -1):
+            self.stats["stale_downs"] += 1
+            return True
+        return False
+
+    def note_up(self, key: Tuple[str, Any], msg: Dict[str, Any]) -> None:
+        seq = msg.get("seq")
+        if seq is not None and int(seq) > self.up_seqs.get(key, -1):
+            self.up_seqs[key] = int(seq)
+
+    def track_key(self, msg: Dict[str, Any]) -> bool:
+        """Update held keys; False if the message must not be injected."""
+        keycode = int(msg.get("keycode", 0))
+        et = int(msg.get("et", 0))
+        key = ("key", keycode)
+        if et == FLAGS_CHANGED:
+            mask = MODIFIER_MASKS.get(keycode)
+            down = mask is not None and bool(int(msg.get("flags", 0)) & mask)
+        elif et in (KEY_DOWN, KEY_UP):
+            down = et == KEY_DOWN
+        else:
+            return True
+        if down:
+            if self.stale_down(key, msg):
+                return False
+            self.held_keys[keycode] = msg
+        else:
+            self.note_up(key, msg)
+            self.held_keys.pop(keycode, None)
+        return True
+
+    def track_button(self, msg: Dict[str, Any]) -> bool:
+        """Update held buttons; False if the message must not be injected."""
+        et = int(msg.get("et", 0))
+        btn = msg.get("btn", "left")
+        key = ("button", btn)
+        if et in BUTTON_DOWNS:
+            if self.stale_down(key, msg):
+                return False
+            self.held_buttons[btn] = msg
+        elif et in BUTTON_UPS:
+            self.note_up(key, msg)
+            self.held_buttons.pop(btn, None)
+        return True
+
+    def release_all(self) -> None:
+        """Synthesize key-ups and button-ups for anything still held, e.g. after the sender vanished."""
+        for keycode, down in list(self.held_keys.items()):
+            et = FLAGS_CHANGED if int(down.get("et", 0)) == FLAGS_CHANGED else KEY_UP
+            self.deliver({"t": "key", "et": et, "keycode": keycode, "flags": 0})
+            self.stats["released"] += 1
+        where = self.last_move
+        for btn, down in list(self.held_buttons.items()):
+            pos = where if where is not None else down
+            self.deliver(
+                {
+                    "t": "button",
+                    "et": BUTTON_UP_FOR_DOWN[int(down["et"])],
+                    "btn": btn,
+                    "nx": pos.get("nx", 0.0),
+                    "ny": pos.get("ny", 0.0),
+                    "flags": 0,
+                }
+            )
+            self.stats["released"] += 1
+        self.held_keys.clear()
+        self.held_buttons.clear()
+
+
+class ManualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def jittery_arrivals(
+    seconds: float, input_hz: float, keys_per_sec: float, jitter_ms: float, loss: float, seed: int
+) -> List[Tuple[float, Dict[str, Any]]]:
+    """Fake sender stream (one event per datagram) after a lossy link with exponential jitter."""
+    rng = random.Random(seed)
+    arrivals: List[Tuple[float, Dict[str, Any]]] = []
+    seq = 1 << 40
+    for offset, msg in fake_events(seconds, input_hz, keys_per_sec):
+        seq += 1
+        msg = dict(msg, seq=seq, ts=1000.0 + offset)
+        if rng.random() < loss:
+            continue
+        delay = 0.002 + (rng.expovariate(1000.0 / jitter_ms) if jitter_ms > 0 else 0.0)
+        arrivals.append((offset + delay, msg))
+    arrivals.sort(key=lambda item: item[0])
+    return arrivals
+
+
+def score(events: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Backward cursor jumps, key events out of order and keys left down, from an injection log."""
+    backwards = out_of_order = 0
+    last_move = last_key = -1
+    down: Set[int] = set()
+    for msg in events:
+        seq = int(msg.get("seq", -1))
+        if msg["t"] == "move":
+            if seq < last_move:
+                backwards += 1
+            last_move = max(last_move, seq)
+        elif msg["t"] == "key":
+            if 0 <= seq < last_key:
+                out_of_order += 1
+            last_key = max(last_key, seq)
+            if msg["et"] == KEY_DOWN:
+                down.add(msg["keycode"])
+            elif msg["et"] == KEY_UP:
+                down.discard(msg["keycode"])
+    return {"backward_moves": backwards, "keys_out_of_order": out_of_order, "stuck_keys": len(down)}
+
+
+def simulate(arrivals: List[Tuple[float, Dict[str, Any]]], replays: int, **inbox_args: Any) -> Tuple[Dict[str, int], Inbox, List[float]]:
+    """Feeds arrivals (plus `replays` re-sent old packets) through an Inbox on a manual clock."""
+    clock = ManualClock()
+    backend = RecordingBackend()
+    inbox = Inbox(backend, clock=clock, **inbox_args)
+    if arrivals:
+        end = arrivals[-1][0]
+        arrivals = arrivals + [(end + 0.01 * (i + 1), dict(msg)) for i, (_, msg) in enumerate(arrivals[:replays])]
+    queue = [(at, i, msg) for i, (at, msg) in enumerate(arrivals)]
+    heapq.heapify(queue)
+    durations: List[float] = []
+    while queue:
+        at, _, msg = heapq.heappop(queue)
+        deadline = inbox.deadline()
+        while deadline is not None and deadline < at:
+            clock.now = deadline
+            inbox.tick()
+            deadline = inbox.deadline()
+        clock.now = at
+        t0 = time.perf_counter()
+        inbox.receive([msg])
+        durations.append(time.perf_counter() - t0)
+    clock.now += inbox.hold_timeout_sec
+    inbox.tick()
+    return score(backend.events), inbox, durations
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Run the receiver pipeline over a simulated jittery link (no Quartz)")
+    p.add_argument("--seconds", type=float, default=10.0)
+    p.add_argument("--input-hz", type=float, default=240.0)
+    p.add_argument("--keys-per-sec", type=float, default=10.0)
+    p.add_argument("--jitter-ms", type=float, default=8.0, help="mean extra delay (exponential)")
+    p.add_argument("--loss", type=float, default=0.01, help="packet loss probability")
+    p.add_argument("--replays", type=int, default=100, help="old packets re-sent at the end")
+    p.add_argument("--reorder-ms", type=float, default=20.0)
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+
+    arrivals = jittery_arrivals(args.seconds, args.input_hz, args.keys_per_sec, args.jitter_ms, args.loss, args.seed)
+    replayed = [dict(msg) for _, msg in arrivals[: args.replays]]
+    direct = score([msg for _, msg in arrivals] + replayed)
+    result, inbox, durations = simulate(arrivals, args.replays, reorder_sec=args.reorder_ms / 1000.0)
+    print(f"{len(arrivals)} datagrams, jitter={args.jitter_ms}ms loss={args.loss:.1%}, {args.replays} replayed")
+    print(f"inject on arrival: {direct}")
+    print(f"inbox pipeline:    {result}")
+    print(f"inbox stats: {inbox.stats}")
+    durations.sort()
+    print(
+        f"receive(): mean={sum(durations) / len(durations) * 1e6:.2f}us "
+        f"p99={durations[int(len(durations) * 0.99)] * 1e6:.2f}us"
+    )
+
+
+if __name__ == "__main__":
+    main()
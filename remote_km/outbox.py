@@ -0,0 +1,207 @@
+"""Sender-side event pipeline, free of Quartz so it runs (and can be exercised) anywhere.
+
+The event-tap callback only calls Outbox.submit(): an append to a deque, or for moves a
+single attribute store, plus a wakeup. Claiming the pending move for the wire takes a short lock,
+since both threads may do it. A background thread assigns sequence numbers,
+coalesces consecutive moves to the latest position per frame and packs discrete events into batches.
+"""
+import argparse
+import collections
+import socket
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from common import MAX_BATCH, RELIABLE, Codec, pack_message
+
+
+class Outbox:
+    def __init__(
+        self,
+        send: Callable[[bytes], Any],
+        codec: Optional[Codec] = None,
+        secret: str = "",
+        move_hz: float = 120.0,
+        max_batch: int = 32,
+    ):
+        """`send` writes one datagram. Without a codec, events go out one per legacy JSON packet."""
+        self.send_packet = send
+        self.codec = codec
+        self.secret = secret
+        self.frame_sec = 1.0 / move_hz if move_hz > 0 else 0.0
+        self.max_batch = min(max_batch, MAX_BATCH) if codec is not None else 1
+        # deque.append/popleft are atomic under the GIL; the callback never takes a lock for them.
+        self.queue: Deque[Dict[str, Any]] = collections.deque()
+        # Latest move from the tap and the last one sent; never reset, so no update can be lost.
+        self.latest_move: Optional[Dict[str, Any]] = None
+        self.sent_move: Optional[Dict[str, Any]] = None
+        # Held while checking and claiming latest_move, so only one thread queues a given move.
+        self.move_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.seq = int(time.time() * 1000) << 16
+        # Seq of the last key/button sent; nothing this stream sent before counts.
+        self.reliable_seq = self.seq
+        self.next_move_at = 0.0
+        self.closed = False
+        self.thread: Optional[threading.Thread] = None
+        # Called on the outbox thread with each batch after it was sent (session.SessionClient).
+        self.sent_hook: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+        self.stats: Dict[str, int] = {"events": 0, "moves": 0, "moves_sent": 0, "packets": 0, "errors": 0}
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="km-outbox", daemon=True)
+        self.thread.start()
+
+    def close(self, timeout: float = 1.0) -> None:
+        """Stop after flushing what is queued."""
+        self.closed = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def submit(self, msg: Dict[str, Any]) -> None:
+        """Called from the event tap: O(1), no encoding, no syscalls."""
+        msg["ts"] = time.time()
+        if msg["t"] == "move":
+            # Only the first move of a frame wakes the thread; later ones just replace it.
+            idle = self.latest_move is self.sent_move
+            self.latest_move = msg
+            self.stats["moves"] += 1
+            if not idle:
+                return
+        else:
+            with self.move_lock:
+                move = self.latest_move
+                if move is not self.sent_move:
+                    # The pointer got there first (a drag before button-up): keep that order on the wire.
+                    self.sent_move = move
+                    self.queue.append(move)
+                    self.stats["moves_sent"] += 1
+            self.queue.append(msg)
+            self.stats["events"] += 1
+        if not self.wake.is_set():
+            self.wake.set()
+
+    def run(self) -> None:
+        while True:
+            timeout = None
+            if self.latest_move is not self.sent_move:
+                timeout = max(self.next_move_at - time.monotonic(), 0.0)
+            self.wake.wait(timeout)
+            self.wake.clear()
+            self.flush()
+            if self.closed and not self.queue and self.latest_move is self.sent_move:
+                return
+
+    def flush(self) -> None:
+        batch: List[Dict[str, Any]] = []
+        while self.queue:
+            batch.append(self.queue.popleft())
+            if len(batch) >= self.max_batch:
+                self.emit(batch)
+                batch = []
+        now = time.monotonic()
+        # Moves submitted before a queued event went ahead of it, so this one is newer than all of them.
+        with self.move_lock:
+            move = self.latest_move
+            if move is self.sent_move or (now < self.next_move_at and not self.closed):
+                move = None
+            else:
+                self.sent_move = move
+                self.stats["moves_sent"] += 1
+        if move is not None:
+            batch.append(move)
+            self.next_move_at = now + self.frame_sec
+        if batch:
+            self.emit(batch)
+
+    def emit(self, batch: List[Dict[str, Any]]) -> None:
+        # Read once: a session may swap the codec from another thread.
+        codec = self.codec
+        if codec is not None:
+            for msg in batch:
+                self.seq += 1
+                msg["seq"] = self.seq
+                # A session codec sends this along (see common.HINTED_BATCH), so the receiver need not
+                # wait for lost numbers after it: moves and scrolls are never retransmitted.
+                msg["rel"] = self.reliable_seq
+                if msg["t"] in RELIABLE:
+                    self.reliable_seq = self.seq
+            packets = [codec.encode_batch(batch)]
+        else:
+            packets = []
+            for msg in batch:
+                self.seq += 1
+                msg["seq"] = self.seq
+                packets.append(pack_message(msg, self.secret))
+        for data in packets:
+            try:
+                self.send_packet(data)
+                self.stats["packets"] += 1
+            except OSError:
+                self.stats["errors"] += 1
+        if self.sent_hook is not None:
+            self.sent_hook(batch)
+
+
+def fake_events(duration: float, move_hz: float, keys_per_sec: float) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    """(offset seconds, event) stream resembling a trackpad at move_hz with periodic key taps."""
+    t = 0.0
+    step = 1.0 / move_hz
+    next_key = 0.0
+    i = 0
+    while t < duration:
+        yield t, {"t": "move", "nx": (i % 1000) / 1000, "ny": 0.5, "flags": 0}
+        if keys_per_sec > 0 and t >= next_key:
+            yield t, {"t": "key", "et": 10, "keycode": 0, "flags": 0}
+            yield t, {"t": "key", "et": 11, "keycode": 0, "flags": 0}
+            next_key += 1.0 / keys_per_sec
+        i += 1
+        t += step
+
+
+def replay(outbox: Outbox, events: Iterator[Tuple[float, Dict[str, Any]]]) -> List[float]:
+    """Feed events in real time, as the event tap would; returns submit() durations in seconds."""
+    durations: List[float] = []
+    start = time.monotonic()
+    for offset, msg in events:
+        delay = start + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        t0 = time.perf_counter()
+        outbox.submit(msg)
+        durations.append(time.perf_counter() - t0)
+    return durations
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Drive the sender pipeline with a fake event source (no Quartz)")
+    p.add_argument("--target", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=5005)
+    p.add_argument("--secret", default="fake-source-secret")
+    p.add_argument("--wire", choices=["binary", "json"], default="binary")
+    p.add_argument("--seconds", type=float, default=3.0)
+    p.add_argument("--input-hz", type=float, default=240.0, help="fake trackpad event rate")
+    p.add_argument("--move-hz", type=float, default=120.0, help="max move packets per second")
+    p.add_argument("--keys-per-sec", type=float, default=10.0)
+    args = p.parse_args()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    codec = Codec(args.secret) if args.wire == "binary" else None
+    outbox = Outbox(
+        lambda data: sock.sendto(data, (args.target, args.port)), codec, args.secret, move_hz=args.move_hz
+    )
+    outbox.start()
+    durations = replay(outbox, fake_events(args.seconds, args.input_hz, args.keys_per_sec))
+    outbox.close()
+    durations.sort()
+    st = outbox.stats
+    print(f"events: {st['moves']} moves + {st['events']} other -> {st['packets']} packets ({st['moves_sent']} moves sent)")
+    print(
+        f"submit(): mean={sum(durations) / len(durations) * 1e6:.2f}us "
+        f"p99={durations[int(len(durations) * 0.99)] * 1e6:.2f}us max={durations[-1] * 1e6:.2f}us"
+    )
+
+
+if __name__ == "__main__":
+    main()
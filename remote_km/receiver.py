@@ -5,7 +5,9 @@ from typing import Tuple
 
 import Quartz
 
-from common import unpack_message
+from displays import DisplayCache, quartz_display_rects
+from inbox import Backend, Inbox
+from session import SessionServer, serve
 
 
 MODIFIER_MASK_FOR_KEYCODE = {
@@ -21,31 +23,13 @@ MODIFIER_MASK_FOR_KEYCODE = {
 }
 
 
-def get_display_union_bounds() -> Tuple[float, float, float, float]:
-    max_displays = 16
-    err, display_ids, _ = Quartz.CGGetActiveDisplayList(max_displays, None, None)
-    if err != Quartz.kCGErrorSuccess or not display_ids:
-        b = Quartz.CGDisplayBounds(Quartz.CGMainDisplayID())
-        return b.origin.x, b.origin.y, b.size.width, b.size.height
-
-    min_x = float("inf")
-    min_y = float("inf")
-    max_x = float("-inf")
-    max_y = float("-inf")
-    for d in display_ids:
-        b = Quartz.CGDisplayBounds(d)
-        min_x = min(min_x, b.origin.x)
-        min_y = min(min_y, b.origin.y)
-        max_x = max(max_x, b.origin.x + b.size.width)
-        max_y = max(max_y, b.origin.y + b.size.height)
-    return min_x, min_y, max_x - min_x, max_y - min_y
+# The receiver blocks in recvfrom without a run loop, so reconfiguration callbacks would never be
+# delivered here; the cache re-queries the display list at most once per max_age_sec instead.
+DISPLAYS = DisplayCache(quartz_display_rects, max_age_sec=1.0)
 
 
 def denormalize(nx: float, ny: float) -> Tuple[float, float]:
-    x0, y0, w, h = get_display_union_bounds()
-    nx = max(0.0, min(1.0, nx))
-    ny = max(0.0, min(1.0, ny))
-    return x0 + nx * w, y0 + ny * h
+    return DISPLAYS.layout().denormalize(nx, ny)
 
 
 def post_event(ev):
@@ -103,30 +87,47 @@ def inject_scroll(msg):
     post_event(ev)
 
 
-def run_receiver(bind: str, port: int, secret: str):
+class QuartzBackend(Backend):
+    def key(self, msg):
+        inject_key(msg)
+
+    def move(self, msg):
+        inject_move(msg)
+
+    def button(self, msg):
+        inject_button(msg)
+
+    def scroll(self, msg):
+        inject_scroll(msg)
+
+
+def run_receiver(
+    bind: str,
+    port: int,
+    secret: str,
+    reorder_ms: float = 20.0,
+    hold_timeout_sec: float = 5.0,
+    require_session: bool = False,
+):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind((bind, port))
     print(f"[receiver] listening on {bind}:{port}")
-
-    while True:
-        data, addr = sock.recvfrom(65535)
-        try:
-            msg = unpack_message(data, secret)
-        except Exception:
-            continue
-
-        t = msg.get("t")
-        try:
-            if t == "key":
-                inject_key(msg)
-            elif t == "move":
-                inject_move(msg)
-            elif t == "button":
-                inject_button(msg)
-            elif t == "scroll":
-                inject_scroll(msg)
-        except Exception as e:
-            print(f"[receiver] inject error from {addr}: {e}")
+    inbox = Inbox(
+        QuartzBackend(),
+        reorder_sec=reorder_ms / 1000.0,
+        hold_timeout_sec=hold_timeout_sec,
+        on_error=lambda msg, e: print(f"[receiver] inject error ({msg.get('t')}): {e}"),
+    )
+    # Accepts sessions and, unless required, packets signed with the shared secret directly
+    # (binary format and, from older senders, the JSON one).
+    server = SessionServer(
+        sock.sendto,
+        secret,
+        inbox,
+        require_session=require_session,
+        log=lambda m: print(f"[receiver] {m}"),
+    )
+    serve(sock, server, inbox)
 
 
 def parse_args():
@@ -134,10 +135,27 @@ def parse_args():
     p.add_argument("--bind", default="0.0.0.0", help="Bind IP")
     p.add_argument("--port", type=int, default=5005, help="UDP port")
     p.add_argument("--secret", required=True, help="Shared secret")
+    p.add_argument(
+        "--reorder-ms",
+        type=float,
+        default=20.0,
+        help="How long key/button events wait for a missing earlier packet",
+    )
+    p.add_argument(
+        "--hold-timeout",
+        type=float,
+        default=5.0,
+        help="Release keys/buttons still held after this many seconds without packets",
+    )
+    p.add_argument(
+        "--require-session",
+        action="store_true",
+        help="Only accept input from senders started with --session",
+    )
     return p.parse_args()
 
 
 if __name__ == "__main__":
     args = parse_args()
-    run_receiver(args.bind, args.port, args.secret)
+    run_receiver(args.bind, args.port, args.secret, args.reorder_ms, args.hold_timeout, args.require_session)
 
@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 import argparse
 import socket
-import time
 from typing import Optional
 
 import Quartz
 
-from common import pack_message
+from common import Codec
+from displays import DisplayCache, quartz_display_rects
+from outbox import Outbox
+from session import SessionClient
 
 
 TOGGLE_KEYCODE_R = 15
@@ -18,31 +20,48 @@ TOGGLE_MASK = (
 
 
 class SenderState:
-    def __init__(self, target: str, port: int, secret: str):
+    def __init__(
+        self,
+        target: str,
+        port: int,
+        secret: str,
+        wire: str = "binary",
+        move_hz: float = 120.0,
+        session: bool = False,
+    ):
         self.target = target
         self.port = port
         self.secret = secret
+        self.codec = Codec(secret) if wire == "binary" else None
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.enabled = False
-        self.seq = 0
-        self.main_bounds = Quartz.CGDisplayBounds(Quartz.CGMainDisplayID())
+        # Refreshed by the reconfiguration callback (delivered on the event tap's run loop) and,
+        # as a backstop, every few seconds.
+        self.displays = DisplayCache(quartz_display_rects, max_age_sec=5.0)
+        # Encoding and sendto run on the outbox thread; the event tap only enqueues.
+        self.outbox = Outbox(self.send_packet, self.codec, secret, move_hz=move_hz)
+        self.outbox.start()
+        self.session: Optional[SessionClient] = None
+        if session:
+            # Acks, pongs and the handshake reply come back to this socket.
+            self.sock.bind(("0.0.0.0", 0))
+            self.session = SessionClient(self.send_packet, secret, self.outbox, log=lambda m: print(f"[sender] {m}"))
+            self.session.start(self.sock)
+
+    def send_packet(self, data: bytes):
+        self.sock.sendto(data, (self.target, self.port))
 
     def send(self, msg):
-        self.seq += 1
-        msg["seq"] = self.seq
-        msg["ts"] = time.time()
-        data = pack_message(msg, self.secret)
-        self.sock.sendto(data, (self.target, self.port))
+        self.outbox.submit(msg)
 
     def normalize_point(self, x: float, y: float):
-        b = self.main_bounds
-        w = max(1.0, b.size.width)
-        h = max(1.0, b.size.height)
-        nx = (x - b.origin.x) / w
-        ny = (y - b.origin.y) / h
-        nx = max(0.0, min(1.0, nx))
-        ny = max(0.0, min(1.0, ny))
-        return nx, ny
+        return self.displays.layout().normalize(x, y)
+
+
+def on_display_reconfigured(display, flags, user_info):
+    # Called once before and once after a change; only the final state matters.
+    if STATE is not None and not flags & Quartz.kCGDisplayBeginConfigurationFlag:
+        STATE.displays.invalidate()
 
 
 STATE: Optional[SenderState] = None
@@ -129,12 +148,15 @@ def event_callback(proxy, event_type, event, refcon):
     return event
 
 
-def run_sender(target: str, port: int, secret: str):
+def run_sender(
+    target: str, port: int, secret: str, wire: str = "binary", move_hz: float = 120.0, session: bool = False
+):
     global STATE
-    STATE = SenderState(target=target, port=port, secret=secret)
+    STATE = SenderState(target=target, port=port, secret=secret, wire=wire, move_hz=move_hz, session=session)
     print("[sender] ready")
     print("[sender] toggle hotkey: Control+Option+Command+R")
     print(f"[sender] target={target}:{port}")
+    Quartz.CGDisplayRegisterReconfigurationCallback(on_display_reconfigured, None)
 
     mask = (
         Quartz.CGEventMaskBit(Quartz.kCGEventKeyDown)
@@ -175,10 +197,30 @@ def parse_args():
     p.add_argument("--target", required=True, help="Mac mini IP")
     p.add_argument("--port", type=int, default=5005, help="UDP port")
     p.add_argument("--secret", required=True, help="Shared secret")
-    return p.parse_args()
+    p.add_argument(
+        "--wire",
+        choices=["binary", "json"],
+        default="binary",
+        help="Packet format (json for receivers older than the binary format)",
+    )
+    p.add_argument(
+        "--move-hz",
+        type=float,
+        default=120.0,
+        help="Max mouse-move packets per second; moves in between are coalesced to the latest position",
+    )
+    p.add_argument(
+        "--session",
+        action="store_true",
+        help="Handshake per-session keys, retransmit lost key/button events, send heartbeats",
+    )
+    args = p.parse_args()
+    if args.session and args.wire != "binary":
+        p.error("--session needs --wire binary")
+    return args
 
 
 if __name__ == "__main__":
     args = parse_args()
-    run_sender(args.target, args.port, args.secret)
+    run_sender(args.target, args.port, args.secret, args.wire, args.move_hz, args.session)
 
@@ -0,0 +1,532 @@
+"""Optional session layer over the binary framing, free of Quartz so it runs (and can be exercised) anywhere.
+
+Handshake: the sender sends `hello` with a random nonce, and the receiver answers `welcome` with its
+own. Both are tagged with the shared secret. Each side derives the session key as
+HMAC-SHA256(secret, label + client nonce + server nonce), and every later packet is tagged with
+that key. The receiver only switches to a new session once a packet under its key arrives, so a
+replayed hello cannot take over a live session.
+
+Within a session:
+- Key and button events are acknowledged (selective acks: the highest seq plus a 64-bit mask)
+  and retransmitted until acked. Moves and scrolls never are.
+- The sender pings every `heartbeat_sec` and measures RTT from the handshake and the pongs.
+- If either side hears nothing for `dead_after_sec`, the session is over. The receiver then
+  releases every key and button still held.
+- While a session is up, the inbox waits `session_reorder_sec` for a missing number, long
+  enough for a lost key or button to be retransmitted a few times, instead of skipping it and
+  then dropping the retransmitted press as stale.
+"""
+import argparse
+import hashlib
+import hmac
+import os
+import random
+import select
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from common import RELIABLE, Codec
+from inbox import KEY_DOWN, KEY_UP, Inbox, RecordingBackend
+from outbox import Outbox, fake_events, replay
+
+SESSION_LABEL = b"remote_km session v1"
+CONTROL = frozenset(("hello", "welcome", "ping", "pong", "ack", "bye"))
+ACK_BITS = 64
+
+Address = Tuple[str, int]
+
+
+def derive_key(secret: str, client_nonce: bytes, server_nonce: bytes) -> bytes:
+    return hmac.new(secret.encode("utf-8"), SESSION_LABEL + client_nonce + server_nonce, hashlib.sha256).digest()
+
+
+def control(t: str, **fields: Any) -> Dict[str, Any]:
+    return dict(fields, t=t, seq=0, ts=time.time())
+
+
+def acked_seqs(ack: int, mask: int) -> Iterator[int]:
+    yield ack
+    for i in range(ACK_BITS):
+        if mask >> i & 1:
+            yield ack - 1 - i
+
+
+class AckWindow:
+    """Reliable seqs seen recently, encoded as (highest, mask of the ACK_BITS below it)."""
+
+    def __init__(self):
+        self.seen: set = set()
+        self.top = -1
+
+    def add(self, seq: int) -> None:
+        self.seen.add(seq)
+        if seq > self.top:
+            self.top = seq
+        if len(self.seen) > 2 * ACK_BITS:
+            self.seen = {s for s in self.seen if s >= self.top - ACK_BITS}
+
+    def encode(self) -> Tuple[int, int]:
+        mask = 0
+        for s in self.seen:
+            d = self.top - 1 - s
+            if 0 <= d < ACK_BITS:
+                mask |= 1 << d
+        return self.top, mask
+
+
+class SessionClient:
+    """Sender side: owns the handshake, heartbeats and retransmission for an Outbox."""
+
+    def __init__(
+        self,
+        send: Callable[[bytes], Any],
+        secret: str,
+        outbox: Outbox,
+        heartbeat_sec: float = 0.25,
+        dead_after_sec: float = 1.0,
+        max_tries: int = 8,
+        clock: Callable[[], float] = time.monotonic,
+        log: Optional[Callable[[str], None]] = None,
+    ):
+        self.send_packet = send
+        self.secret = secret
+        self.auth = Codec(secret, accept_legacy=False)
+        self.outbox = outbox
+        self.heartbeat_sec = heartbeat_sec
+        self.dead_after_sec = dead_after_sec
+        self.max_tries = max_tries
+        self.clock = clock
+        self.log = log
+        self.codec: Optional[Codec] = None
+        self.nonce = b""
+        self.hello_at = float("-inf")
+        self.last_heard = 0.0
+        self.next_ping_at = 0.0
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        # seq -> [message, last sent at, tries]; guarded by lock (outbox thread adds, session thread acks).
+        self.unacked: Dict[int, List[Any]] = {}
+        self.lock = threading.Lock()
+        self.established = threading.Event()
+        # The outbox thread writes here when the first unacked event makes the session deadline earlier.
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.closed = False
+        self.thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, int] = {"handshakes": 0, "lost": 0, "retransmits": 0, "gave_up": 0, "acked": 0}
+        outbox.sent_hook = self.on_sent
+
+    def start(self, sock: socket.socket) -> None:
+        self.thread = threading.Thread(target=self.run, args=(sock,), name="km-session", daemon=True)
+        self.thread.start()
+
+    def close(self, bye: bool = True) -> None:
+        """Stop; with bye=False the receiver only notices through missing heartbeats."""
+        if bye and self.codec is not None:
+            self.send(self.codec, control("bye", reason=0))
+        self.closed = True
+        self.wake()
+        if self.thread is not None:
+            self.thread.join(1.0)
+        self.wake_r.close()
+        self.wake_w.close()
+
+    def wake(self) -> None:
+        try:
+            self.wake_w.send(b"\0")
+        except OSError:
+            pass  # already full (a wake-up is pending) or closed
+
+    def run(self, sock: socket.socket) -> None:
+        while not self.closed:
+            try:
+                ready, _, _ = select.select([sock, self.wake_r], [], [], max(self.deadline() - self.clock(), 0.001))
+                if self.wake_r in ready:
+                    self.wake_r.recv(4096)
+                data = sock.recvfrom(65535)[0] if sock in ready else b""
+            except (OSError, ValueError):
+                if self.closed:
+                    return
+                raise
+            if data:
+                self.receive(data)
+            self.tick()
+
+    def send(self, codec: Codec, msg: Dict[str, Any]) -> None:
+        try:
+            self.send_packet(codec.encode(msg))
+        except OSError:
+            pass
+
+    def rto(self) -> float:
+        if self.srtt is None:
+            return 0.05
+        return min(max(self.srtt + 4 * self.rttvar, 0.01), 0.5)
+
+    def on_sent(self, batch: List[Dict[str, Any]]) -> None:
+        if self.codec is None:
+            return
+        now = self.clock()
+        reliable = [msg for msg in batch if msg["t"] in RELIABLE]
+        if reliable:
+            with self.lock:
+                idle = not self.unacked
+                for msg in reliable:
+                    self.unacked[msg["seq"]] = [msg, now, 1]
+            if idle:
+                # The session thread may be asleep until the next ping; the retransmit timer starts now.
+                self.wake()
+
+    def receive(self, data: bytes) -> None:
+        now = self.clock()
+        codec = self.codec
+        try:
+            msgs = codec.decode_many(data) if codec is not None else []
+        except ValueError:
+            msgs = []
+        if msgs:
+            self.last_heard = now
+            for msg in msgs:
+                if msg["t"] == "pong":
+                    self.rtt_sample(now - msg["sent_at"])
+                elif msg["t"] == "ack":
+                    with self.lock:
+                        for seq in acked_seqs(msg["ack"], msg["mask"]):
+                            if self.unacked.pop(seq, None) is not None:
+                                self.stats["acked"] += 1
+            return
+        try:
+            msgs = self.auth.decode_many(data)
+        except ValueError:
+            return
+        msg = msgs[0]
+        if msg["t"] == "welcome" and self.nonce and hmac.compare_digest(msg["nonce"], self.nonce):
+            key = derive_key(self.secret, self.nonce, msg["server_nonce"])
+            self.codec = Codec(key, accept_legacy=False, hints=True)
+            self.nonce = b""
+            self.last_heard = now
+            # The handshake is the first RTT sample, so early retransmits need not wait for a pong.
+            self.rtt_sample(now - self.hello_at)
+            self.outbox.codec = self.codec
+            self.stats["handshakes"] += 1
+            # The first ping also proves to the receiver that we hold the session key.
+            self.next_ping_at = now
+            self.established.set()
+            if self.log is not None:
+                self.log("session established")
+
+    def rtt_sample(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def tick(self) -> None:
+        now = self.clock()
+        codec = self.codec
+        if codec is None:
+            if now >= self.hello_at + 0.5:
+                self.nonce = os.urandom(16)
+                self.hello_at = now
+                self.send(self.auth, control("hello", nonce=self.nonce))
+            return
+        if now - self.last_heard > self.dead_after_sec:
+            self.lost()
+            return
+        if now >= self.next_ping_at:
+            self.send(codec, control("ping", sent_at=now))
+            self.next_ping_at = now + self.heartbeat_sec
+        rto = self.rto()
+        resend = []
+        with self.lock:
+            for seq, entry in list(self.unacked.items()):
+                if now - entry[1] < rto:
+                    continue
+                if entry[2] >= self.max_tries:
+                    del self.unacked[seq]
+                    self.stats["gave_up"] += 1
+                    continue
+                entry[1] = now
+                entry[2] += 1
+                resend.append(entry[0])
+        for msg in resend:
+            self.send(codec, msg)
+            self.stats["retransmits"] += 1
+
+    def lost(self) -> None:
+        # The receiver releases held input on its side; stale key events must not be replayed later.
+        self.codec = None
+        self.outbox.codec = self.auth
+        self.established.clear()
+        with self.lock:
+            self.unacked.clear()
+        self.stats["lost"] += 1
+        self.hello_at = float("-inf")
+        if self.log is not None:
+            self.log("session lost, reconnecting")
+
+    def deadline(self) -> float:
+        if self.codec is None:
+            return self.hello_at + 0.5
+        deadlines = [self.next_ping_at, self.last_heard + self.dead_after_sec]
+        with self.lock:
+            if self.unacked:
+                deadlines.append(min(entry[1] for entry in self.unacked.values()) + self.rto())
+        return min(deadlines)
+
+
+class Session:
+    def __init__(self, addr: Address, key: bytes, now: float):
+        self.addr = addr
+        self.codec = Codec(key, accept_legacy=False)
+        self.last_heard = now
+        self.acks = AckWindow()
+
+
+class SessionServer:
+    """Receiver side: authenticates packets and turns them into input events for an Inbox.
+
+    Without a session, packets tagged with the shared secret (binary or legacy JSON) are
+    accepted unless `require_session` is set.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[bytes, Address], Any],
+        secret: str,
+        inbox: Inbox,
+        require_session: bool = False,
+        dead_after_sec: float = 1.0,
+        session_reorder_sec: float = 0.1,
+        clock: Callable[[], float] = time.monotonic,
+        log: Optional[Callable[[str], None]] = None,
+    ):
+        self.send_packet = send
+        self.secret = secret
+        self.auth = Codec(secret)
+        self.inbox = inbox
+        self.require_session = require_session
+        self.dead_after_sec = dead_after_sec
+        self.plain_reorder_sec = inbox.reorder_sec
+        self.session_reorder_sec = max(session_reorder_sec, inbox.reorder_sec)
+        self.clock = clock
+        self.log = log
+        self.current: Optional[Session] = None
+        self.pending: Optional[Session] = None
+        self.stats: Dict[str, int] = {"sessions": 0, "lost": 0, "rejected": 0}
+
+    def send(self, session: Session, msg: Dict[str, Any]) -> None:
+        try:
+            self.send_packet(session.codec.encode(msg), session.addr)
+        except OSError:
+            pass
+
+    def receive(self, data: bytes, addr: Address) -> List[Dict[str, Any]]:
+        """Input events in the datagram, after answering any session traffic it carries."""
+        now = self.clock()
+        for session in (self.current, self.pending):
+            if session is None or session.addr != addr:
+                continue
+            try:
+                msgs = session.codec.decode_many(data)
+            except Exception:
+                continue
+            if session is self.pending:
+                self.promote(session)
+            session.last_heard = now
+            return self.handle(session, msgs)
+
+        try:
+            msgs = self.auth.decode_many(data)
+        except Exception:
+            # Malformed legacy JSON raises more than ValueError; none of it may stop the receiver.
+            self.stats["rejected"] += 1
+            return []
+        if msgs[0].get("t") == "hello":
+            server_nonce = os.urandom(16)
+            self.pending = Session(addr, derive_key(self.secret, msgs[0]["nonce"], server_nonce), now)
+            self.send_packet(
+                self.auth.encode(control("welcome", nonce=msgs[0]["nonce"], server_nonce=server_nonce)), addr
+            )
+            return []
+        if self.require_session:
+            self.stats["rejected"] += 1
+            return []
+        return [msg for msg in msgs if msg.get("t") not in CONTROL]
+
+    def promote(self, session: Session) -> None:
+        if self.current is not None:
+            # A new session replaces the old one; whatever it held is stale now.
+            self.inbox.release_all()
+        self.current, self.pending = session, None
+        self.inbox.reorder_sec = self.session_reorder_sec
+        self.stats["sessions"] += 1
+        if self.log is not None:
+            self.log(f"session from {session.addr[0]}:{session.addr[1]}")
+
+    def handle(self, session: Session, msgs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        events = []
+        reliable = False
+        for msg in msgs:
+            t = msg["t"]
+            if t == "ping":
+                self.send(session, control("pong", sent_at=msg["sent_at"]))
+            elif t == "bye":
+                self.end(session, "session closed by sender")
+            elif t not in CONTROL:
+                events.append(msg)
+                if t in RELIABLE:
+                    session.acks.add(msg["seq"])
+                    reliable = True
+        if reliable:
+            # Retransmits are acked again, even when the inbox then drops them as duplicates.
+            ack, mask = session.acks.encode()
+            self.send(session, control("ack", ack=ack, mask=mask))
+        return events
+
+    def end(self, session: Session, why: str) -> None:
+        if session is self.current:
+            self.current = None
+            self.inbox.reorder_sec = self.plain_reorder_sec
+            self.inbox.release_all()
+            if self.log is not None:
+                self.log(why)
+
+    def tick(self) -> None:
+        session = self.current
+        if session is not None and self.clock() - session.last_heard > self.dead_after_sec:
+            self.stats["lost"] += 1
+            self.end(session, "session lost, released held input")
+
+    def deadline(self) -> Optional[float]:
+        if self.current is None:
+            return None
+        return self.current.last_heard + self.dead_after_sec
+
+
+def serve(sock: socket.socket, server: SessionServer, inbox: Inbox, running: Callable[[], bool] = lambda: True) -> None:
+    """The receiver loop: wakes for packets and for reorder, hold and session deadlines."""
+    while running():
+        deadlines = [d for d in (inbox.deadline(), server.deadline()) if d is not None]
+        sock.settimeout(max(min(deadlines) - inbox.clock(), 0.001) if deadlines else None)
+        try:
+            data, addr = sock.recvfrom(65535)
+        except socket.timeout:
+            server.tick()
+            inbox.tick()
+            continue
+        msgs = server.receive(data, addr)
+        if msgs:
+            inbox.receive(msgs)
+        server.tick()
+
+
+def lossy(send: Callable[..., Any], loss: float, rng: random.Random) -> Callable[..., Any]:
+    """Wraps a send function so it silently drops a fraction of datagrams."""
+
+    def send_some(*args: Any) -> Any:
+        if rng.random() >= loss:
+            return send(*args)
+        return None
+
+    return send_some
+
+
+def key_counts(events: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """(key events delivered, keys left down) from an injection log."""
+    down: set = set()
+    delivered = 0
+    for msg in events:
+        if msg["t"] != "key":
+            continue
+        delivered += 1
+        if msg["et"] == KEY_DOWN:
+            down.add(msg["keycode"])
+        elif msg["et"] == KEY_UP:
+            down.discard(msg["keycode"])
+    return delivered, len(down)
+
+
+def loopback_run(
+    use_session: bool, seconds: float, loss: float, keys_per_sec: float, seed: int, hold_timeout_sec: float
+) -> Dict[str, Any]:
+    """One sender and one receiver on 127.0.0.1 with `loss` applied to every datagram, both ways."""
+    secret = "loopback-secret"
+    rng = random.Random(seed)
+    rsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rsock.bind(("127.0.0.1", 0))
+    ssock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    ssock.bind(("127.0.0.1", 0))
+    raddr = rsock.getsockname()
+
+    backend = RecordingBackend()
+    inbox = Inbox(backend, hold_timeout_sec=hold_timeout_sec)
+    server = SessionServer(lossy(rsock.sendto, loss, rng), secret, inbox, require_session=use_session)
+    stop = threading.Event()
+    receiver = threading.Thread(target=serve, args=(rsock, server, inbox, lambda: not stop.is_set()), daemon=True)
+    receiver.start()
+
+    send = lossy(lambda data: ssock.sendto(data, raddr), loss, rng)
+    outbox = Outbox(send, Codec(secret), secret)
+    outbox.start()
+    client = None
+    if use_session:
+        client = SessionClient(send, secret, outbox)
+        client.start(ssock)
+        client.established.wait(5.0)
+
+    replay(outbox, fake_events(seconds, 120.0, keys_per_sec))
+    time.sleep(0.3)
+    # Count once the receiver has settled: retransmits answered and no gap still waiting.
+    settle_by = time.monotonic() + 2.0
+    while (inbox.slots or (client is not None and client.unacked)) and time.monotonic() < settle_by:
+        time.sleep(0.01)
+    delivered, stuck = key_counts(backend.events)
+    result: Dict[str, Any] = {"key_events_sent": outbox.stats["events"], "delivered": delivered, "stuck": stuck}
+
+    # Hold a key, then let the sender vanish without a bye: how long until the receiver lets go?
+    outbox.submit({"t": "key", "et": KEY_DOWN, "keycode": 56, "flags": 0})
+    time.sleep(0.2)
+    held = len(inbox.held_keys)
+    vanished_at = time.monotonic()
+    if client is not None:
+        client.close(bye=False)
+    outbox.close()
+    released_after = None
+    while time.monotonic() - vanished_at < hold_timeout_sec + 2.0:
+        if not inbox.held_keys:
+            released_after = time.monotonic() - vanished_at
+            break
+        time.sleep(0.01)
+    result["held_then_released_after_sec"] = None if not held else released_after
+
+    if client is not None:
+        result["rtt_ms"] = None if client.srtt is None else round(client.srtt * 1000, 3)
+        result.update(client.stats)
+    stop.set()
+    receiver.join(2.0)
+    rsock.close()
+    ssock.close()
+    return result
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Sender and receiver over loopback with simulated loss (no Quartz)")
+    p.add_argument("--seconds", type=float, default=3.0)
+    p.add_argument("--loss", type=float, default=0.1, help="drop probability for every datagram, both ways")
+    p.add_argument("--keys-per-sec", type=float, default=20.0)
+    p.add_argument("--hold-timeout", type=float, default=5.0, help="receiver release timeout without a session")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+
+    for use_session in (False, True):
+        result = loopback_run(use_session, args.seconds, args.loss, args.keys_per_sec, args.seed, args.hold_timeout)
+        print(f"{'session' if use_session else 'plain  '} loss={args.loss:.0%}: {result}")
+
+
+if __name__ == "__main__":
+    main()
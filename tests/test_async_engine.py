@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "memory_threshold_percent": 90,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "restart": {"command": ["true"]},
+    "notification": {"queue": {"enabled": False}},
+}
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = watchdog.Watchdog(CONFIG)
+    wd.lines = []
+    wd.log = lambda msg, **fields: wd.lines.append(msg)
+    engine = watchdog.AsyncEngine(wd)
+    yield engine
+    for pool in (engine.memory_pool, engine.health_pool, engine.recovery_pool, engine.notify_pool):
+        pool.shutdown(wait=True)
+    wd.close()
+
+
+def test_hung_memory_sampler_is_not_queued_again(engine):
+    release = threading.Event()
+    engine.wd.memory_usage_percent = lambda: release.wait(30) and 50.0
+
+    async def run_for(seconds):
+        engine.loop = asyncio.get_running_loop()
+        task = asyncio.create_task(engine.memory_task())
+        await asyncio.sleep(seconds)
+        task.cancel()
+
+    try:
+        asyncio.run(run_for(3.5))
+        assert engine.pending_memory is not None and not engine.pending_memory.done()
+        assert engine.memory_pool._work_queue.qsize() == 0
+        assert any("still busy" in line for line in engine.wd.lines)
+    finally:
+        release.set()
+
+
+def test_skipped_recoveries_are_logged_once_per_recovery(engine):
+    gate = threading.Event()
+    recoveries = []
+    engine.wd.recover = lambda reason, mem=None: recoveries.append(reason) or gate.wait(5)
+
+    async def scenario():
+        engine.loop = asyncio.get_running_loop()
+        for reason in ("memory_overload", "health_check_failed"):
+            gate.clear()
+            assert engine.start_recovery(reason)
+            for _ in range(5):
+                assert not engine.start_recovery("memory_trend", 88.0)
+            gate.set()
+            await engine.recovery_task
+
+    asyncio.run(scenario())
+    skips = [line for line in engine.wd.lines if line.startswith("recovery already running")]
+    assert skips == ["recovery already running, skip until it ends. reason=memory_trend"] * 2
+    assert recoveries == ["memory_overload", "health_check_failed"]
@@ -0,0 +1,59 @@
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "cooldown_sec": 0,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "profiles": [{"name": "rich", "models": ["big", "small"]}, {"name": "lean", "models": ["small"]}],
+    "switch": {"command": ["switch", "{profile}", "{models_spaced}"]},
+    "restart": {"command": ["restart"]},
+}
+TICKS = 100
+
+
+def simulator():
+    trace = watchdog.Trace(start_ts=1_700_000_000.0, memory=[(float(i), 40.0) for i in range(TICKS + 1)])
+    return watchdog.Simulator(CONFIG, trace, restart_sec=0, switch_sec=0, load_sec=0, ready_sec=0, total_gb=16.0)
+
+
+def test_memory_action(benchmark):
+    sim = simulator()
+    try:
+        assert benchmark(sim.wd.memory_action, 40.0) is None
+    finally:
+        sim.wd.close()
+
+
+def test_health_check_in_process(benchmark):
+    sim = simulator()
+    try:
+        assert benchmark(sim.wd.health_ok, True)
+    finally:
+        sim.wd.close()
+
+
+def test_switch_command_render(benchmark):
+    sim = simulator()
+    values = sim.wd.current_profile().template_values()
+    try:
+        assert benchmark(sim.wd.command, "switch", values) == ["switch", "rich", "big small"]
+    finally:
+        sim.wd.close()
+
+
+def test_control_loop_ticks(benchmark):
+    sim = simulator()
+
+    def run_ticks():
+        sim.clock.now = 0.0
+        try:
+            sim.wd.loop()
+        except watchdog.SimulationDone:
+            pass
+
+    try:
+        benchmark(run_ticks)
+        assert sim.clock.now >= TICKS
+        assert not sim.recoveries
+    finally:
+        sim.wd.close()
@@ -0,0 +1,59 @@
+import pytest
+
+from common import MAX_BATCH, Codec, pack_message
+
+EVENTS = [
+    {"t": "key", "et": 10, "keycode": 4, "flags": 0x100, "seq": 7, "ts": 1000.25},
+    {"t": "move", "nx": 0.25, "ny": 0.75, "flags": 0, "seq": 8, "ts": 1000.25},
+    {"t": "button", "et": 1, "btn": "right", "nx": 0.5, "ny": 0.125, "flags": 0, "seq": 9, "ts": 1000.25},
+    {"t": "scroll", "dx": -3, "dy": 12, "flags": 0, "seq": 10, "ts": 1000.25},
+]
+
+
+@pytest.mark.parametrize("msg", EVENTS, ids=[m["t"] for m in EVENTS])
+def test_single_event_round_trip(msg):
+    codec = Codec("secret")
+    assert codec.decode(codec.encode(msg)) == msg
+
+
+def test_batch_round_trip():
+    codec = Codec("secret")
+    assert codec.decode_many(codec.encode_batch(EVENTS)) == EVENTS
+    with pytest.raises(ValueError):
+        codec.encode_batch([EVENTS[0]] * (MAX_BATCH + 1))
+
+
+def test_session_codec_carries_the_last_reliable_seq():
+    codec = Codec("secret", hints=True)
+    hinted = [{**msg, "rel": rel} for msg, rel in zip(EVENTS, (3, 7, 7, 9))]
+    assert codec.decode_many(codec.encode_batch(hinted)) == hinted
+    assert codec.decode_many(codec.encode(hinted[1])) == [hinted[1]]
+    # Without a hint (or from a plain codec) the receiver learns nothing and waits as before.
+    assert codec.decode_many(codec.encode_batch(EVENTS)) == EVENTS
+    assert Codec("secret").decode_many(Codec("secret").encode_batch(hinted)) == EVENTS
+
+
+def test_legacy_json_is_accepted_only_with_a_string_secret():
+    msg = {"t": "key", "et": 10, "keycode": 4, "flags": 0}
+    assert Codec("secret").decode_many(pack_message(msg, "secret")) == [msg]
+    with pytest.raises(ValueError):
+        Codec("secret", accept_legacy=False).decode_many(pack_message(msg, "secret"))
+
+
+def test_tampered_or_foreign_packets_are_rejected():
+    codec = Codec("secret")
+    packet = bytearray(codec.encode(EVENTS[0]))
+    packet[-1] ^= 1
+    for data in (bytes(packet), Codec("other").encode(EVENTS[0]), pack_message(EVENTS[0], "other"), b""):
+        with pytest.raises(ValueError):
+            codec.decode_many(data)
+
+
+def test_encode_batch_speed(benchmark):
+    codec = Codec("secret")
+    benchmark(codec.encode_batch, EVENTS)
+
+
+def test_decode_batch_speed(benchmark):
+    codec = Codec("secret")
+    assert len(benchmark(codec.decode_many, codec.encode_batch(EVENTS))) == len(EVENTS)
@@ -0,0 +1,53 @@
+import json
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "memory_threshold_percent": 90,
+    "cooldown_sec": 60,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "notification": {"queue": {"enabled": False}},
+}
+
+
+def write_config(path, **overrides):
+    path.write_text(json.dumps(dict(CONFIG, **overrides)))
+
+
+def test_reload_rebuilds_objects_derived_from_the_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "config.json"
+    write_config(path, proxy={"max_inflight": 4, "port": 0})
+    wd = watchdog.Watchdog(watchdog.load_config(str(path)))
+    wd.config_path = str(path)
+    wd.proxy = watchdog.RequestProxy(wd, wd.config["proxy"])
+    wd.rss_collector = watchdog.ProcessRSSCollector(["ollama"], [m.name for m in wd.models])
+    try:
+        assert not wd.maybe_reload_config()
+        models = [{"name": "big", "ram_gb": 8.0}, {"name": "tiny", "ram_gb": 1.0}]
+        write_config(path, models=models, proxy={"max_inflight": 2, "queue_limit": 5, "port": 0})
+        wd.next_config_check = 0.0
+        assert wd.maybe_reload_config()
+        assert [m.name for m in wd.models] == ["big", "tiny"]
+        assert wd.rss_collector is None
+        assert (wd.proxy.max_inflight, wd.proxy.queue_limit) == (2, 5)
+    finally:
+        wd.proxy.server.server_close()  # never started, so nothing to shut down
+        wd.close()
+
+
+def test_rejected_reload_keeps_every_setting(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "config.json"
+    write_config(path)
+    wd = watchdog.Watchdog(watchdog.load_config(str(path)))
+    wd.config_path = str(path)
+    try:
+        assert not wd.maybe_reload_config()
+        write_config(path, cooldown_sec=5, memory_threshold_percent=150)
+        wd.next_config_check = 0.0
+        assert not wd.maybe_reload_config()
+        assert (wd.cooldown_sec, wd.memory_threshold_percent) == (60, 90.0)
+    finally:
+        wd.close()
@@ -0,0 +1,80 @@
+import itertools
+
+import pytest
+
+from displays import DisplayCache, DisplayLayout, parse_layout
+
+LAPTOP_AND_TALL = [(0.0, 0.0, 1512.0, 982.0), (1512.0, -458.0, 2560.0, 1440.0)]
+LAYOUTS = {
+    "side_by_side": LAPTOP_AND_TALL,
+    "stacked": [(0.0, 0.0, 1920.0, 1080.0), (200.0, 1080.0, 1512.0, 982.0)],
+    "gap": [(0.0, 0.0, 1000.0, 800.0), (1200.0, 100.0, 1000.0, 800.0)],
+    "three": [(-1920.0, 0.0, 1920.0, 1080.0), (0.0, 0.0, 1512.0, 982.0), (1512.0, -458.0, 2560.0, 1440.0)],
+}
+GRID = [i / 10 for i in range(11)]
+
+
+def on_a_display(rects, x, y):
+    return any(rx <= x < rx + w and ry <= y < ry + h for rx, ry, w, h in rects)
+
+
+@pytest.mark.parametrize("name", sorted(LAYOUTS))
+def test_every_point_lands_on_a_real_screen(name):
+    layout = DisplayLayout(LAYOUTS[name])
+    for nx, ny in itertools.product(GRID, GRID):
+        assert on_a_display(layout.rects, *layout.denormalize(nx, ny)), (nx, ny)
+
+
+def test_the_short_display_uses_its_full_height():
+    layout = DisplayLayout(LAPTOP_AND_TALL)
+    assert layout.horizontal
+    assert layout.denormalize(0.25, 0.5) == (1018.0, 491.0)
+    assert layout.denormalize(0.75, 0.0) == (3054.0, -458.0)
+    assert layout.normalize(1018.0, 491.0) == pytest.approx((0.25, 0.5))
+
+
+def test_stacked_displays_lay_out_vertically():
+    layout = DisplayLayout(LAYOUTS["stacked"])
+    assert not layout.horizontal
+    x, y = layout.denormalize(0.5, 0.75)
+    assert y >= 1080.0 and 200.0 <= x < 1712.0
+
+
+@pytest.mark.parametrize("name", sorted(LAYOUTS))
+def test_points_on_a_screen_round_trip(name):
+    layout = DisplayLayout(LAYOUTS[name])
+    for nx, ny in itertools.product(GRID[1:-1], GRID[1:-1]):
+        x, y = layout.denormalize(nx, ny)
+        assert layout.denormalize(*layout.normalize(x, y)) == pytest.approx((x, y), abs=1.0)
+
+
+def test_single_display_clamps_to_its_bounds():
+    layout = DisplayLayout([(100.0, 50.0, 800.0, 600.0)])
+    assert layout.normalize(500.0, 350.0) == (0.5, 0.5)
+    assert layout.normalize(-10.0, 9999.0) == (0.0, 1.0)
+    assert layout.denormalize(1.5, -1.0) == (900.0, 50.0)
+    # Displays without area are ignored.
+    assert DisplayLayout([(0.0, 0.0, 0.0, 0.0)]).rects == [(0.0, 0.0, 1.0, 1.0)]
+
+
+def test_cache_queries_again_only_when_invalidated_or_stale():
+    now = [0.0]
+    rects = [LAPTOP_AND_TALL]
+    cache = DisplayCache(lambda: rects[0], max_age_sec=2.0, clock=lambda: now[0])
+    first = cache.layout()
+    assert cache.layout() is first and cache.refreshes == 1
+    now[0] = 2.0
+    assert cache.layout() is first and cache.refreshes == 2  # same displays: layout kept
+    rects[0] = LAPTOP_AND_TALL[:1]
+    cache.invalidate()
+    assert cache.layout().single == LAPTOP_AND_TALL[0]
+
+
+def test_parse_layout():
+    assert parse_layout("0,0,1512,982;1512,-458,2560,1440") == LAPTOP_AND_TALL
+
+
+def test_cached_denormalize_speed(benchmark):
+    cache = DisplayCache(lambda: LAPTOP_AND_TALL)
+    points = itertools.cycle(GRID)
+    benchmark(lambda: cache.layout().denormalize(next(points), 0.5))
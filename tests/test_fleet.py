@@ -0,0 +1,147 @@
+import asyncio
+import sys
+import time
+
+import pytest
+
+import watchdog
+
+SECRET = "fleet-test-secret"
+PROFILES = [
+    {"name": "rich", "models": ["big", "small"], "ram_gb": 12},
+    {"name": "safe", "models": ["small"], "ram_gb": 4},
+]
+
+
+BASE = {
+    "interval_sec": 1,
+    "memory_threshold_percent": 90,
+    "cooldown_sec": 60,
+    "logging": {"stdout": False},
+    "notification": {"queue": {"enabled": False}},
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "profiles": PROFILES,
+    "health_check": {"timeout_sec": 1},
+}
+
+
+def fleet_config(tmp_path, name, **overrides):
+    """One host of the fleet, with its own log and state file."""
+    config = dict(BASE, log_file=str(tmp_path / f"{name}.log"), state_file=str(tmp_path / f"{name}.state.json"))
+    config.update(overrides)
+    return config
+
+
+def make_agent(tmp_path, name, mem, health_sec=0.0, **agent_args):
+    wd = watchdog.Watchdog(fleet_config(tmp_path, name))
+    wd.memory_usage_percent = lambda: mem[name]
+
+    def health_ok(quiet=False):
+        time.sleep(health_sec)
+        return True
+
+    wd.health_ok = health_ok
+    agent = watchdog.FleetAgent(wd, SECRET, probe_interval_sec=0.1, **agent_args)
+
+    def run_apply(profile, reason, mem_percent):
+        names = [p.name for p in wd.profiles]
+        wd.state.current_profile_index = names.index(profile)
+        mem[name] = 50.0
+        return {"ok": True, "profile": profile}
+
+    agent.run_apply = run_apply
+    return agent
+
+
+async def start_agent(agent):
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(lambda: agent, local_addr=("127.0.0.1", 0))
+    return asyncio.create_task(agent.probe_task()), agent.transport.get_extra_info("sockname")[1]
+
+
+def test_supervisor_downgrades_only_the_overloaded_agent(tmp_path):
+    mem = {"a1": 95.0, "a2": 50.0}
+    # A health round (a hung probe) outlasts the poll timeout; polls are answered from the last round.
+    agents = [make_agent(tmp_path, name, mem, health_sec=2.0) for name in mem]
+
+    async def scenario():
+        tasks = []
+        hosts = []
+        for name, agent in zip(mem, agents):
+            task, port = await start_agent(agent)
+            tasks.append(task)
+            hosts.append({"name": name, "host": "127.0.0.1", "port": port})
+        sup_wd = watchdog.Watchdog(fleet_config(tmp_path, "sup", cooldown_sec=0))
+        supervisor = watchdog.FleetSupervisor(
+            sup_wd, {"secret": SECRET, "hosts": hosts, "poll_interval_sec": 0.1, "timeout_sec": 1.5, "stagger_sec": 0}
+        )
+        main = asyncio.create_task(supervisor.main())
+        try:
+            for _ in range(80):
+                await asyncio.sleep(0.1)
+                if supervisor.hosts[0].profile == "safe" and supervisor.hosts[0].state == "ok":
+                    break
+            return {h.name: (h.state, h.profile) for h in supervisor.hosts}
+        finally:
+            main.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(main, *tasks, return_exceptions=True)
+            for agent in agents:
+                agent.transport.close()
+            sup_wd.close()
+
+    try:
+        states = asyncio.run(scenario())
+    finally:
+        for agent in agents:
+            agent.probe_pool.shutdown(wait=True)
+            agent.wd.close()
+    assert states == {"a1": ("ok", "safe"), "a2": ("ok", "rich")}
+    assert [a.wd.current_profile().name for a in agents] == ["safe", "rich"]
+
+
+def test_poll_timeout_must_exceed_probe_timeout(tmp_path):
+    wd = watchdog.Watchdog(fleet_config(tmp_path, "sup", health_check={"timeout_sec": 5}))
+    try:
+        hosts = [{"host": "127.0.0.1"}]
+        with pytest.raises(ValueError, match="timeout_sec"):
+            watchdog.FleetSupervisor(wd, {"secret": SECRET, "hosts": hosts, "timeout_sec": 2})
+        assert watchdog.FleetSupervisor(wd, {"secret": SECRET, "hosts": hosts}).timeout_sec > 5
+    finally:
+        wd.close()
+
+
+def test_agent_falls_back_to_local_rules_without_a_supervisor(tmp_path):
+    mem = {"solo": 95.0}
+    agent = make_agent(tmp_path, "solo", mem, fallback_after_sec=0.3)
+    recovered = []
+    agent.wd.recover = lambda reason, mem_percent=None: recovered.append(reason)
+
+    async def scenario():
+        task, _ = await start_agent(agent)
+        await asyncio.sleep(0.2)
+        before = list(recovered)
+        await asyncio.sleep(0.5)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        agent.transport.close()
+        return before
+
+    try:
+        before = asyncio.run(scenario())
+    finally:
+        agent.probe_pool.shutdown(wait=True)
+        agent.wd.close()
+    assert before == []
+    assert recovered and recovered[0] == "memory_overload"
+    assert agent.local_mode
+
+
+def test_framing_is_loaded_without_touching_sys_path():
+    before = list(sys.path)
+    pack, unpack = watchdog.load_fleet_framing()
+    assert sys.path == before
+    assert pack.__module__ == "remote_km_common"
+    assert watchdog.load_fleet_framing() == (pack, unpack)
+    assert unpack(pack({"t": "poll", "seq": 1}, SECRET), SECRET)["t"] == "poll"
@@ -0,0 +1,66 @@
+import collections
+import json
+import threading
+import time
+
+import watchdog
+
+
+def probe_config(count):
+    """A watchdog checking health with `count` concurrent HTTP probes."""
+    probes = [{"type": "http", "name": f"p{i}", "url": f"http://127.0.0.1:9/{i}", "timeout_sec": 3} for i in range(count)]
+    return {
+        "interval_sec": 1,
+        "models": [{"name": "big", "ram_gb": 8.0}],
+        "notification": {"queue": {"enabled": False}},
+        "health_checks": probes,
+    }
+
+
+def test_hedges_do_not_queue_behind_probes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = watchdog.Watchdog(probe_config(3))
+    calls = collections.Counter()
+    lock = threading.Lock()
+
+    def request(method, url, timeout, **_kwargs):
+        with lock:
+            calls[url] += 1
+            first = calls[url] == 1
+        time.sleep(1.5 if first else 0.01)
+        return watchdog.HTTPResult(200, b"", 0.0, 0.0, False)
+
+    wd.http.request = request
+    for probe in wd.health_probes:
+        wd.probe_latency[probe.name] = collections.deque([0.01] * 20, maxlen=wd.hedge_window)
+    try:
+        start = time.monotonic()
+        assert wd.health_checks_ok()
+        assert time.monotonic() - start < 1.0
+        assert wd.probe_pool._max_workers == 3
+        assert wd.hedge_pool._max_workers == 6
+    finally:
+        wd.close()
+
+
+def test_reload_resizes_probe_pools(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(probe_config(1)))
+    wd = watchdog.Watchdog(watchdog.load_config(str(path)))
+    wd.config_path = str(path)
+    wd.http.request = lambda method, url, timeout, **_kwargs: watchdog.HTTPResult(200, b"", 0.0, 0.0, False)
+    try:
+        assert wd.health_checks_ok()
+        old = wd.probe_pool
+        assert old._max_workers == 1
+        assert not wd.maybe_reload_config()  # first stat only primes the change check
+        path.write_text(json.dumps(probe_config(4)))
+        wd.next_config_check = 0.0
+        assert wd.maybe_reload_config()
+        assert wd.probe_pool is None and wd.probe_pool_size == 4
+        assert old._shutdown
+        assert wd.health_checks_ok()
+        assert wd.probe_pool._max_workers == 4
+    finally:
+        wd.close()
@@ -0,0 +1,102 @@
+import http.server
+import socket
+import threading
+
+import pytest
+
+import watchdog
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # noqa: N802
+        self.server.connections.append(self.connection)
+        self.server.peers.append(self.client_address[1])
+        body = b"ok"
+        self.send_response(200)
+        if self.path == "/close":
+            self.send_header("Connection", "close")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+
+@pytest.fixture
+def server():
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    srv.daemon_threads = True
+    srv.connections, srv.peers = [], []
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def url(server, path="/health"):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def test_second_request_reuses_the_connection(server):
+    telemetry = watchdog.Telemetry()
+    pool = watchdog.HTTPPool(telemetry)
+    try:
+        first = pool.request("GET", url(server))
+        second = pool.request("GET", url(server))
+    finally:
+        pool.close()
+    assert (first.status, first.body, first.reused) == (200, b"ok", False)
+    assert second.reused and second.connect_sec == 0.0
+    assert server.peers[0] == server.peers[1]
+    text = telemetry.render([])
+    assert 'openclaw_watchdog_http_connect_seconds_count{host="127.0.0.1"} 1' in text
+    assert 'openclaw_watchdog_http_response_seconds_count{host="127.0.0.1"} 2' in text
+
+
+def test_reconnects_once_when_the_server_dropped_an_idle_connection(server):
+    pool = watchdog.HTTPPool()
+    try:
+        pool.request("GET", url(server))
+        server.connections[0].shutdown(socket.SHUT_RDWR)
+        result = pool.request("GET", url(server))
+    finally:
+        pool.close()
+    assert result.status == 200 and not result.reused
+    assert server.peers[0] != server.peers[1]
+
+
+def test_connection_close_responses_are_not_pooled(server):
+    pool = watchdog.HTTPPool()
+    try:
+        pool.request("GET", url(server, "/close"))
+        assert not any(pool.idle.values())
+    finally:
+        pool.close()
+
+
+def test_idle_connections_are_capped_per_host():
+    pool = watchdog.HTTPPool(max_idle_per_host=2)
+    key = ("http", "127.0.0.1", 80)
+    conns = [pool.new_connection(key, 1.0) for _ in range(3)]
+    for conn in conns:
+        pool.release(key, conn)
+    assert pool.idle[key] == conns[:2]
+    assert pool.acquire(key, 1.0) == (conns[1], True)
+    pool.close()
+    assert not pool.idle
+
+
+def test_a_fresh_connection_failure_is_not_retried():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    pool = watchdog.HTTPPool()
+    with pytest.raises(ConnectionRefusedError):
+        pool.request("GET", f"http://127.0.0.1:{port}/", timeout=2)
+    with pytest.raises(ValueError):
+        pool.request("GET", "ftp://127.0.0.1/")
@@ -0,0 +1,145 @@
+import itertools
+
+import pytest
+
+from inbox import (
+    BUTTON_UP_FOR_DOWN,
+    KEY_DOWN,
+    KEY_UP,
+    Backend,
+    Inbox,
+    ManualClock,
+    RecordingBackend,
+    jittery_arrivals,
+    simulate,
+)
+
+
+def make_inbox():
+    clock = ManualClock()
+    backend = RecordingBackend()
+    return Inbox(backend, clock=clock, reorder_sec=0.02, hold_timeout_sec=5.0), clock, backend
+
+
+def key(et, seq):
+    return {"t": "key", "et": et, "keycode": 4, "flags": 0, "seq": seq, "ts": 1000.0}
+
+
+def move(seq):
+    return {"t": "move", "nx": 0.5, "ny": 0.5, "seq": seq, "ts": 1000.0}
+
+
+def test_late_down_after_its_up_is_dropped():
+    inbox, clock, backend = make_inbox()
+    inbox.receive([move(0)])
+    inbox.receive([key(KEY_UP, 3)])
+    clock.now += 0.05
+    inbox.receive([move(4)])
+    inbox.receive([key(KEY_DOWN, 1)])
+    # Moves keep refreshing last_packet_at, so a wrongly held key would never time out.
+    for seq in range(5, 1000):
+        clock.now += 0.01
+        inbox.receive([move(seq)])
+        inbox.tick()
+    assert not inbox.held_keys
+    assert [m["et"] for m in backend.events if m["t"] == "key"] == [KEY_UP]
+    assert inbox.stats["stale_downs"] == 1
+
+
+def test_late_button_down_after_its_up_is_dropped():
+    inbox, clock, backend = make_inbox()
+    down = 1  # left mouse down
+    up = BUTTON_UP_FOR_DOWN[down]
+    inbox.receive([move(0)])
+    inbox.receive([{"t": "button", "et": up, "btn": "left", "nx": 0.5, "ny": 0.5, "seq": 3, "ts": 1000.0}])
+    clock.now += 0.05
+    inbox.receive([move(4)])
+    inbox.receive([{"t": "button", "et": down, "btn": "left", "nx": 0.5, "ny": 0.5, "seq": 1, "ts": 1000.0}])
+    assert not inbox.held_buttons
+
+
+def test_consecutive_gaps_expire_together():
+    inbox, clock, backend = make_inbox()
+    inbox.receive([key(KEY_DOWN, 0)])
+    # 1 and 3 are lost; 2 and 4 arrive together and wait one reorder window, not one per gap.
+    inbox.receive([key(KEY_UP, 2), {**key(KEY_DOWN, 4), "keycode": 5}])
+    clock.now += 0.021
+    inbox.tick()
+    assert [m["seq"] for m in backend.events] == [0, 2, 4]
+    assert inbox.stats["skipped"] == 2
+
+
+def test_first_packet_waits_for_a_late_earlier_one():
+    inbox, clock, backend = make_inbox()
+    inbox.receive([key(KEY_UP, 11)])
+    inbox.receive([key(KEY_DOWN, 10)])
+    clock.now += 0.021
+    inbox.tick()
+    assert [(m["seq"], m["et"]) for m in backend.events] == [(10, KEY_DOWN), (11, KEY_UP)]
+    assert not inbox.held_keys
+    assert inbox.stats["skipped"] == 0
+
+
+def test_first_press_of_a_stream_is_not_held_back():
+    inbox, clock, backend = make_inbox()
+    inbox.receive([key(KEY_DOWN, 500)])
+    assert [m["seq"] for m in backend.events] == [500]
+    assert inbox.deadline() is not None  # only the hold timeout
+    assert not inbox.slots
+
+
+def session_inbox():
+    clock = ManualClock()
+    backend = RecordingBackend()
+    return Inbox(backend, clock=clock, reorder_sec=0.1, hold_timeout_sec=5.0), clock, backend
+
+
+def test_key_after_a_lost_move_is_not_held_back():
+    inbox, clock, backend = session_inbox()
+    inbox.receive([{**key(KEY_DOWN, 10), "rel": 9}])
+    # 11 was a move and is lost; the sender says its last key was 10, so nothing can fill the gap.
+    inbox.receive([{**move(12), "rel": 10}, {**key(KEY_UP, 13), "rel": 10}])
+    assert [m["seq"] for m in backend.events] == [10, 12, 13]
+    assert not inbox.slots
+
+
+def test_key_after_a_lost_key_still_waits():
+    inbox, clock, backend = session_inbox()
+    inbox.receive([{**key(KEY_DOWN, 10), "rel": 9}])
+    inbox.receive([{**move(12), "rel": 11}, {**key(KEY_UP, 13), "rel": 11}])
+    assert [m["seq"] for m in backend.events] == [10, 12]
+    inbox.receive([{**key(KEY_UP, 11), "keycode": 5, "rel": 10}])
+    assert [m["seq"] for m in backend.events] == [10, 12, 11, 13]
+
+
+def test_incomplete_backend_fails_when_created():
+    class NoScroll(Backend):
+        def key(self, msg):
+            pass
+
+        move = button = key
+
+    with pytest.raises(TypeError):
+        NoScroll()
+
+
+def test_simulated_link_has_no_stuck_keys_or_backward_moves():
+    for seed in range(1, 6):
+        arrivals = jittery_arrivals(5.0, 240.0, 10.0, 30.0, 0.05, seed)
+        result, inbox, _ = simulate(arrivals, 100, reorder_sec=0.02)
+        assert result["backward_moves"] == 0
+        assert result["stuck_keys"] == 0
+        assert not inbox.held_keys
+
+
+def test_receive_speed(benchmark):
+    clock = ManualClock()
+    inbox = Inbox(RecordingBackend(), clock=clock)
+    seqs = itertools.count(1)
+
+    def receive_next():
+        clock.now += 0.001
+        inbox.receive([move(next(seqs))])
+
+    benchmark(receive_next)
+    assert inbox.stats["skipped"] == 0
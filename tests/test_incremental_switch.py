@@ -0,0 +1,74 @@
+import subprocess
+
+import pytest
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "memory_threshold_percent": 90,
+    "cooldown_sec": 60,
+    "logging": {"stdout": False},
+    "notification": {"queue": {"enabled": False}},
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "profiles": [{"name": "both", "models": ["big", "small"]}, {"name": "small", "models": ["small"]}],
+    "health_check": {"api_url": "http://127.0.0.1:9"},
+    "incremental_switch": {"enabled": True},
+    "switch": {"command": ["switch", "{profile}"]},
+    "restart": {"command": ["restart"]},
+    "unload": {"command": ["unload", "{model}"]},
+    "load": {"command": ["load", "{model}"]},
+}
+
+
+@pytest.fixture
+def wd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = watchdog.Watchdog(CONFIG)
+    wd.ran = []
+    wd.failing = set()
+
+    def run(cmd, timeout, kind):
+        wd.ran.append(cmd)
+        return subprocess.CompletedProcess(cmd, 1 if cmd[0] in wd.failing else 0, "", "")
+
+    wd.command_runner = run
+    yield wd
+    wd.close()
+
+
+def profiles(wd):
+    return {p.name: p for p in wd.profiles}
+
+
+def test_models_outside_the_config_are_not_unloaded(wd):
+    wd.loaded_models = lambda timeout, *args, **kwargs: {"big", "small:latest", "someone-elses:7b"}
+    assert wd.apply_profile_delta(profiles(wd)["both"], profiles(wd)["small"])
+    assert wd.ran == [["unload", "big"]]
+
+
+def test_loads_without_rss_data_fall_back_to_a_full_switch(wd):
+    wd.loaded_models = lambda timeout, *args, **kwargs: {"small"}
+    assert wd.model_budget_gb() is None
+    assert not wd.apply_profile_delta(profiles(wd)["small"], profiles(wd)["both"])
+    assert wd.ran == []
+
+
+def test_memory_recovery_applies_only_the_delta(wd):
+    wd.loaded_models = lambda timeout, *args, **kwargs: {"big", "small"}
+    wd.recover("memory_overload", 95.0)
+    assert wd.ran == [["unload", "big"]]
+    assert wd.current_profile().name == "small"
+
+
+def test_failed_delta_falls_back_to_switch_and_restart(wd):
+    wd.loaded_models = lambda timeout, *args, **kwargs: {"big", "small"}
+    wd.failing.add("unload")
+    wd.recover("memory_overload", 95.0)
+    assert wd.ran == [["unload", "big"], ["switch", "small"], ["restart"]]
+    assert wd.current_profile().name == "small"
+
+
+def test_health_failures_always_restart(wd):
+    wd.recover("health_check_failed")
+    assert wd.ran == [["switch", "small"], ["restart"]]
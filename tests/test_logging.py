@@ -0,0 +1,47 @@
+import json
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "restart": {"command": ["true"]},
+    "notification": {"queue": {"enabled": False}},
+}
+
+
+def test_defaults_echo_and_log_memory_on_change(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = watchdog.Watchdog(CONFIG)
+    lines = []
+    wd.log = lambda msg, **fields: lines.append(msg)
+    try:
+        assert wd.log_writer.echo
+        assert wd.memory_log_mode == "change"
+        for mem in (50.0, 50.2, 50.4, 52.0):
+            wd.log_memory(mem)
+        assert lines == ["memory usage=50.00%", "memory usage=52.00%"]
+    finally:
+        wd.close()
+
+
+def test_json_lines_carry_the_fields_and_reach_disk_on_close(tmp_path):
+    writer = watchdog.LogWriter(str(tmp_path / "logs" / "watchdog.log"), fmt="json", echo=False, flush_interval_sec=60)
+    writer.write("memory usage=52.00%", {"event": "memory", "memory_percent": 52.0})
+    writer.write("recovery start")
+    writer.close()
+    records = [json.loads(line) for line in (tmp_path / "logs" / "watchdog.log").read_text().splitlines()]
+    assert [r["msg"] for r in records] == ["memory usage=52.00%", "recovery start"]
+    assert records[0]["event"] == "memory" and records[0]["memory_percent"] == 52.0
+
+
+def test_rotation_keeps_backup_count_files(tmp_path):
+    path = tmp_path / "watchdog.log"
+    writer = watchdog.LogWriter(str(path), echo=False, max_bytes=10, backup_count=2)
+    for i in range(4):
+        writer.write_batch([f"line {i}\n"])
+    writer.close()
+    assert path.read_text() == "line 3\n"
+    assert (tmp_path / "watchdog.log.1").read_text() == "line 2\n"
+    assert (tmp_path / "watchdog.log.2").read_text() == "line 1\n"
+    assert not (tmp_path / "watchdog.log.3").exists()
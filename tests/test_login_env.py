@@ -0,0 +1,40 @@
+import json
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "cooldown_sec": 60,
+    "models": [{"name": "big", "ram_gb": 8.0}],
+    "notification": {"queue": {"enabled": False}},
+}
+CACHED = dict(CONFIG, commands={"cache_login_env": True})
+
+
+def test_login_shell_runs_as_is_by_default(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = watchdog.Watchdog(CONFIG)
+    try:
+        cmd = ["bash", "-lc", "true"]
+        assert wd.unwrap_login_shell(cmd) == (cmd, None)
+        assert not wd.login_envs
+    finally:
+        wd.close()
+
+
+def test_reload_retakes_login_env(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(CACHED))
+    wd = watchdog.Watchdog(watchdog.load_config(str(path)))
+    wd.config_path = str(path)
+    wd.login_envs["bash"] = {"PATH": "/old"}
+    try:
+        assert wd.unwrap_login_shell(["bash", "-lc", "true"]) == (["bash", "-c", "true"], {"PATH": "/old"})
+        assert not wd.maybe_reload_config()
+        path.write_text(json.dumps(dict(CACHED, cooldown_sec=90)))
+        wd.next_config_check = 0.0
+        assert wd.maybe_reload_config()
+        assert "bash" not in wd.login_envs
+    finally:
+        wd.close()
@@ -0,0 +1,68 @@
+import pytest
+
+import watchdog
+
+
+def test_proc_meminfo_sampler_rereads_the_same_file(tmp_path):
+    meminfo = tmp_path / "meminfo"
+    meminfo.write_text("MemTotal:       1000 kB\nMemFree:         100 kB\nMemAvailable:    250 kB\n")
+    sampler = watchdog.ProcMeminfoSampler(str(meminfo))
+    try:
+        assert sampler.percent() == 75.0
+        meminfo.write_text("MemTotal:       1000 kB\nMemFree:         400 kB\nMemAvailable:    500 kB\n")
+        assert sampler.percent() == 50.0
+    finally:
+        sampler.close()
+
+
+def test_proc_meminfo_sampler_rejects_zero_total(tmp_path):
+    meminfo = tmp_path / "meminfo"
+    meminfo.write_text("MemTotal: 0 kB\nMemAvailable: 0 kB\n")
+    with pytest.raises(RuntimeError):
+        watchdog.ProcMeminfoSampler(str(meminfo))
+
+
+def test_cgroup_v2_sampler_leaves_out_inactive_page_cache(tmp_path):
+    (tmp_path / "memory.max").write_text("1000\n")
+    (tmp_path / "memory.current").write_text("600\n")
+    (tmp_path / "memory.stat").write_text("anon 400\nfile 200\nactive_file 100\ninactive_file 100\n")
+    sampler = watchdog.CgroupV2Sampler(str(tmp_path))
+    try:
+        assert sampler.limited
+        assert sampler.total_bytes() == 1000
+        assert sampler.percent() == 50.0
+    finally:
+        sampler.close()
+
+
+def test_unlimited_cgroup_is_measured_against_host_memory(tmp_path):
+    (tmp_path / "memory.max").write_text("max\n")
+    (tmp_path / "memory.current").write_text("0\n")
+    (tmp_path / "memory.stat").write_text("inactive_file 0\n")
+    sampler = watchdog.CgroupV2Sampler(str(tmp_path))
+    try:
+        assert not sampler.limited
+        assert sampler.total_bytes() == watchdog.host_memory_bytes()
+    finally:
+        sampler.close()
+
+
+def test_pread_file_grows_its_buffer(tmp_path):
+    path = tmp_path / "memory.stat"
+    path.write_text("x" * 100 + "\ninactive_file 42\n")
+    stat = watchdog.PreadFile(str(path), bufsize=16)
+    try:
+        size = stat.read()
+        assert watchdog.read_field_int(stat.buf, size, b"inactive_file ") == 42
+    finally:
+        stat.close()
+
+
+def test_sampler_without_percent_cannot_be_created():
+    class NoPercent(watchdog.MemorySampler):
+        name = "none"
+
+    with pytest.raises(TypeError):
+        NoPercent()
+    with pytest.raises(ValueError):
+        watchdog.create_memory_sampler("bogus")
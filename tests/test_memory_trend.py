@@ -0,0 +1,80 @@
+import pytest
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "memory_threshold_percent": 90,
+    "cooldown_sec": 60,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "restart": {"command": ["true"]},
+    "adaptive_sampling": {
+        "enabled": True,
+        "min_interval_sec": 0.25,
+        "max_interval_sec": 4,
+        "window_sec": 3,
+        "lead_time_sec": 4,
+    },
+}
+
+
+@pytest.fixture
+def wd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = watchdog.Watchdog(CONFIG)
+    wd.clock = watchdog.SimClock(1_700_000_000.0, 3600.0)
+    yield wd
+    wd.close()
+
+
+def test_slope_is_percent_per_second_inside_the_window():
+    trend = watchdog.MemoryTrend(size=8, window_sec=3.0)
+    assert trend.slope() == 0.0
+    trend.add(0.0, 90.0)  # outside the window once t=4 arrives
+    for t in range(1, 5):
+        trend.add(float(t), 50.0 + 2 * t)
+    assert trend.slope() == pytest.approx(2.0)
+    assert trend.time_to(70.0) == pytest.approx(6.0)
+    assert trend.time_to(50.0) == 0.0
+
+
+def test_ring_buffer_keeps_only_the_newest_samples():
+    trend = watchdog.MemoryTrend(size=4, window_sec=100.0)
+    for t in range(10):
+        trend.add(float(t), 80.0 - t)
+    assert trend.count == 4
+    assert trend.latest() == (9.0, 71.0)
+    assert trend.slope() == pytest.approx(-1.0)
+    assert trend.time_to(90.0) is None
+
+
+def test_fast_rise_triggers_recovery_before_the_threshold(wd):
+    actions = []
+    for mem in (70.0, 74.0, 78.0):
+        actions.append(wd.memory_action(mem))
+        wd.clock.sleep(1.0)
+    # Third sample: 4%/s from 78% reaches 90% in 3 s, inside the 4 s lead time.
+    assert actions == [None, None, "memory_trend"]
+    assert wd.memory_action(91.0) == "memory_overload"
+
+
+def test_trend_does_not_fire_during_cooldown(wd):
+    wd.state.last_action_ts = wd.clock.time()
+    for mem in (70.0, 74.0, 78.0):
+        assert wd.memory_action(mem) is None
+        wd.clock.sleep(1.0)
+
+
+def test_sample_interval_tightens_when_rising_and_backs_off_while_flat(wd):
+    for mem in (50.0, 52.0, 54.0):
+        wd.memory_action(mem)
+        wd.clock.sleep(1.0)
+    assert wd.next_sample_interval(54.0) == 0.25
+    # Near the threshold sampling stays fast even when flat.
+    assert wd.next_sample_interval(85.0) == 0.25
+    intervals = []
+    for _ in range(8):
+        wd.memory_action(54.0)
+        intervals.append(wd.next_sample_interval(54.0))
+        wd.clock.sleep(1.0)
+    assert intervals[-6:] == [0.5, 1.0, 2.0, 4.0, 4.0, 4.0]
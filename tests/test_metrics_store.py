@@ -0,0 +1,48 @@
+import time
+
+import watchdog
+
+
+def test_auto_resolution_uses_raw_on_young_store(tmp_path):
+    store = watchdog.MetricsStore(str(tmp_path / "m.metrics"), capacities=(100, 100, 100))
+    now = time.time()
+    for i in range(9):
+        store.append(now - 540 + i * 60, mem=50.0 + i)
+    try:
+        for since, records in ((60, 1), (3600, 9), (86400, 9)):
+            result = store.query(now - since, now + 1)
+            assert result["resolution"] == "raw"
+            assert result["records"] == records
+    finally:
+        store.close()
+
+
+def test_auto_resolution_moves_to_minutes_once_raw_wrapped(tmp_path):
+    store = watchdog.MetricsStore(str(tmp_path / "m.metrics"), capacities=(10, 1000, 100))
+    start = 1_700_000_000.0
+    for i in range(600):
+        store.append(start + i * 5, mem=40.0)
+    try:
+        result = store.query(start, start + 3000)
+        assert result["resolution"] == "1m"
+        assert result["memory_samples"] > 500
+    finally:
+        store.close()
+
+
+def test_bad_metrics_header_disables_metrics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "bad.metrics"
+    path.write_bytes(b"\0" * 128)
+    config = {
+        "interval_sec": 1,
+        "models": [{"name": "big", "ram_gb": 8.0}],
+        "notification": {"queue": {"enabled": False}},
+        "metrics": {"enabled": True, "file": str(path)},
+    }
+    wd = watchdog.Watchdog(config)
+    try:
+        assert wd.metrics is None
+    finally:
+        wd.close()
+    assert "metrics disabled" in (tmp_path / "watchdog.log").read_text()
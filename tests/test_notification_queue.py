@@ -0,0 +1,63 @@
+import threading
+import time
+
+import watchdog
+
+
+def test_overflow_during_retry_keeps_worker_alive(tmp_path):
+    calls = []
+    in_retry = threading.Event()
+    release = threading.Event()
+
+    def deliver(title, detail, channels):
+        calls.append(title)
+        if len(calls) == 1:
+            return ["webhook"]
+        if len(calls) == 2:
+            in_retry.set()
+            release.wait(5)
+        return []
+
+    queue = watchdog.NotificationQueue(
+        deliver,
+        lambda *a, **k: None,
+        spool_file=str(tmp_path / "spool.json"),
+        coalesce_sec=0.0,
+        max_pending=3,
+        retry_initial_sec=0.05,
+    )
+    try:
+        queue.put("first", "fails once")
+        assert in_retry.wait(5)
+        for i in range(5):
+            queue.put(f"later-{i}", "")
+        release.set()
+        deadline = time.time() + 5
+        while time.time() < deadline and (queue.items or len(calls) < 3):
+            time.sleep(0.01)
+        assert queue.thread.is_alive()
+        assert not queue.items
+        assert calls[:2] == ["first", "first"]
+    finally:
+        queue.close()
+
+
+def test_put_drops_the_new_item_when_everything_is_in_flight(tmp_path):
+    delivering = threading.Event()
+    release = threading.Event()
+
+    def deliver(title, detail, channels):
+        delivering.set()
+        release.wait(5)
+        return []
+
+    queue = watchdog.NotificationQueue(deliver, lambda *a, **k: None, coalesce_sec=0.0, max_pending=1)
+    try:
+        queue.put("first", "")
+        assert delivering.wait(5)
+        queue.put("second", "")
+        assert [item.title for item in queue.items] == ["first"]
+        assert queue.dropped == 1
+    finally:
+        release.set()
+        queue.close()
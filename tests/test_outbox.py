@@ -0,0 +1,104 @@
+import threading
+
+from common import Codec
+from outbox import Outbox, fake_events
+
+
+def decoded(packets, codec):
+    return [msg for data in packets for msg in codec.decode_many(data)]
+
+
+def button(et, nx):
+    return {"t": "button", "et": et, "btn": "left", "nx": nx, "ny": 0.5, "flags": 0}
+
+
+def move(nx):
+    return {"t": "move", "nx": nx, "ny": 0.5, "flags": 0}
+
+
+def test_drag_then_release_keeps_order():
+    codec = Codec("secret")
+    packets = []
+    outbox = Outbox(packets.append, codec=codec)
+    outbox.submit(button(1, 0.1))
+    for i in range(1, 5):
+        outbox.submit(move(0.1 + i / 10))
+    outbox.submit(button(2, 0.5))
+    outbox.flush()
+
+    msgs = decoded(packets, codec)
+    assert [m["t"] for m in msgs] == ["button", "move", "button"]
+    # The moves before the release coalesce to the last one, and it still precedes the release.
+    assert abs(msgs[1]["nx"] - 0.5) < 1e-3
+    assert [m["seq"] for m in msgs] == sorted(m["seq"] for m in msgs)
+
+
+def test_threaded_pipeline_preserves_submit_order():
+    codec = Codec("secret")
+    packets = []
+    outbox = Outbox(packets.append, codec=codec, move_hz=120.0)
+    outbox.start()
+    submitted = []
+    for _, msg in fake_events(0.5, 1000.0, 40.0):
+        submitted.append(msg)
+        outbox.submit(msg)
+    outbox.close()
+
+    msgs = decoded(packets, codec)
+    discrete = [m for m in submitted if m["t"] != "move"]
+    assert [m["seq"] for m in msgs] == sorted(m["seq"] for m in msgs)
+    assert [(m["et"], m["keycode"]) for m in msgs if m["t"] == "key"] == [(m["et"], m["keycode"]) for m in discrete]
+    # Whatever went out (every discrete event, some moves) went out in submit order.
+    position = {id(m): i for i, m in enumerate(submitted)}
+    sent = sorted((m for m in submitted if "seq" in m), key=lambda m: m["seq"])
+    assert [position[id(m)] for m in sent] == sorted(position[id(m)] for m in sent)
+    assert "seq" in [m for m in submitted if m["t"] == "move"][-1]
+
+
+class InterleavedOutbox(Outbox):
+    """Runs `between` on another thread the moment flush() claims the pending move."""
+
+    between = None
+
+    @property
+    def sent_move(self):
+        return self._sent_move
+
+    @sent_move.setter
+    def sent_move(self, move):
+        between, self.between = self.between, None
+        if between is not None:
+            thread = threading.Thread(target=between)
+            thread.start()
+            # With the claim under a lock the other thread blocks here; give it time to run anyway.
+            thread.join(0.2)
+            self.other = thread
+        self._sent_move = move
+
+
+def test_a_pending_move_is_claimed_by_one_thread_only():
+    codec = Codec("secret")
+    packets = []
+    outbox = InterleavedOutbox(packets.append, codec=codec, move_hz=0.0)
+    outbox.submit(move(0.3))
+    # The tap thread submits a key while the outbox thread is claiming the same move.
+    outbox.between = lambda: outbox.submit({"t": "key", "et": 10, "keycode": 4, "flags": 0})
+    outbox.flush()
+    outbox.other.join()
+    outbox.flush()
+
+    msgs = decoded(packets, codec)
+    assert [m["t"] for m in msgs] == ["move", "key"]
+    assert outbox.stats["moves_sent"] == 1
+
+
+def test_submit_and_flush_speed(benchmark):
+    outbox = Outbox(lambda data: None, codec=Codec("secret"))
+
+    def submit_and_flush():
+        outbox.submit(move(0.5))
+        outbox.submit({"t": "key", "et": 10, "keycode": 4, "flags": 0})
+        outbox.flush()
+
+    benchmark(submit_and_flush)
+    assert outbox.stats["errors"] == 0
@@ -0,0 +1,97 @@
+import pytest
+
+import watchdog
+
+GB = 1024 ** 3
+MODELS = [("gpt-oss:20b", 14.0, 3.0), ("deepseek-r1:8b", 6.0, 2.0), ("qwen3:4b", 3.0, 1.0)]
+CONFIG = {
+    "interval_sec": 1,
+    "memory_threshold_percent": 90,
+    "cooldown_sec": 60,
+    "models": [{"name": name, "ram_gb": ram, "priority": priority} for name, ram, priority in MODELS],
+    "profiles": [
+        {"name": "rich", "models": ["gpt-oss:20b", "deepseek-r1:8b", "qwen3:4b"]},
+        {"name": "lean", "models": ["qwen3:4b"]},
+    ],
+    "restart": {"command": ["true"]},
+    "notification": {"queue": {"enabled": False}},
+    "planner": {"enabled": True, "headroom_gb": 1, "upgrade_below_percent": 65, "upgrade_after_sec": 600},
+}
+
+
+class FixedSampler(watchdog.MemorySampler):
+    name = "fixed"
+
+    def percent(self):
+        return 0.0
+
+    def total_bytes(self):
+        return 32 * GB
+
+
+@pytest.fixture
+def wd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = watchdog.Watchdog(CONFIG)
+    wd.clock = watchdog.SimClock(1_700_000_000.0, 86400.0)
+    wd.memory_sampler = FixedSampler()
+    yield wd
+    wd.close()
+
+
+@pytest.mark.parametrize(
+    "budget, plan",
+    [
+        (20.0, {"gpt-oss:20b", "deepseek-r1:8b"}),
+        (18.0, {"gpt-oss:20b", "qwen3:4b"}),
+        (10.0, {"deepseek-r1:8b", "qwen3:4b"}),
+        (2.0, {"qwen3:4b"}),  # nothing fits: keep the smallest model
+    ],
+)
+def test_best_set_within_budget(budget, plan):
+    assert watchdog.ModelPlanner().best(budget, MODELS) == plan
+
+
+def test_equal_priority_prefers_the_set_using_more_ram():
+    models = [("a", 4.0, 1.0), ("b", 2.0, 1.0)]
+    assert watchdog.ModelPlanner().best(5.0, models) == {"a"}
+
+
+def test_plans_are_cached_per_budget_bucket():
+    planner = watchdog.ModelPlanner(bucket_gb=0.5)
+    planner.best(10.1, MODELS)
+    planner.best(10.4, MODELS)
+    planner.best(10.6, MODELS)
+    assert (planner.hits, planner.misses) == (1, 2)
+
+
+def test_overload_picks_the_planned_set_as_an_auto_profile(wd):
+    wd.memory_action(95.0)
+    # 32 GB at 95% with 23 GB of models loaded: 20.4 GB budget after headroom.
+    target = wd.pick_target_profile_index("memory_overload")
+    assert wd.profiles[target].name == "auto:gpt-oss:20b+deepseek-r1:8b"
+    assert wd.pick_target_profile_index("memory_overload") == target
+
+
+def test_upgrade_waits_for_memory_to_stay_low(wd):
+    wd.state.current_profile_index = 1  # lean: only qwen3:4b
+    actions = []
+    for sec in range(0, 1300, 100):
+        wd.clock.now = float(sec)
+        # One high reading at t=300 restarts the wait.
+        actions.append((sec, wd.memory_action(70.0 if sec == 300 else 40.0)))
+    upgrades = [sec for sec, reason in actions if reason == "memory_upgrade"]
+    assert upgrades and upgrades[0] == 1000
+
+
+def test_no_upgrade_during_cooldown_or_without_a_richer_plan(wd):
+    wd.state.current_profile_index = 1
+    wd.state.last_action_ts = wd.clock.time() + 1200
+    for sec in range(0, 1300, 100):
+        wd.clock.now = float(sec)
+        assert wd.memory_action(40.0) is None
+    # Everything is already loaded: nothing richer to upgrade to.
+    wd.state.last_action_ts = 0.0
+    wd.state.current_profile_index = 0
+    wd.clock.now += 1000
+    assert wd.memory_action(40.0) is None
@@ -0,0 +1,66 @@
+import pytest
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "cooldown_sec": 60,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "restart": {"command": ["true"]},
+    "notification": {"queue": {"enabled": False}},
+    "readiness": {"enabled": True, "initial_delay_sec": 0.25, "backoff": 2, "max_delay_sec": 1, "deadline_sec": 3},
+}
+
+
+class ScriptedWatchdog(watchdog.Watchdog):
+    """Health passes from the `ready_after`-th probe on; probe times are kept in `probes`."""
+
+    ready_after = 0
+
+    def health_ok(self, quiet=False):
+        self.probes.append(self.clock.monotonic())
+        return 0 < self.ready_after <= len(self.probes)
+
+    def log(self, msg, **fields):
+        self.__dict__.setdefault("logged", []).append(msg)
+
+
+@pytest.fixture
+def wd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = ScriptedWatchdog(CONFIG)
+    wd.clock = watchdog.SimClock(1_700_000_000.0, 3600.0)
+    wd.probes = []
+    yield wd
+    wd.close()
+
+
+def test_probes_back_off_exponentially_up_to_the_cap(wd):
+    wd.ready_after = 5
+    assert wd.wait_until_ready() == 2.75
+    assert wd.probes == [0.0, 0.25, 0.75, 1.75, 2.75]
+    assert "service ready after 2.75s (5 probes)" in wd.logged
+
+
+def test_missing_the_deadline_returns_none(wd):
+    assert wd.wait_until_ready() is None
+    # The last sleep is cut short so the final probe lands on the deadline.
+    assert wd.probes == [0.0, 0.25, 0.75, 1.75, 2.75, 3.0]
+
+
+def test_failures_while_warming_up_are_not_counted(wd):
+    wd.state.health_fail_count = 1
+    wd.warming_up = True
+    assert wd.record_health(False) is False
+    assert wd.state.health_fail_count == 1
+    wd.ready_after = 1
+    wd.wait_until_ready()
+    assert not wd.warming_up
+    assert wd.state.health_fail_count == 0
+
+
+def test_recovery_fails_when_the_service_never_gets_ready(wd):
+    wd.recover("health_fail")
+    assert "recovery error: service not ready before readiness deadline" in wd.logged
+    assert 'recoveries_total{reason="health_fail",result="failed"} 1' in wd.render_metrics()
+    assert not wd.warming_up
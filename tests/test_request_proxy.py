@@ -0,0 +1,155 @@
+import http.client
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "memory_threshold_percent": 90,
+    "cooldown_sec": 60,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "profiles": [{"name": "rich", "models": ["big", "small"]}, {"name": "lean", "models": ["small"]}],
+    "restart": {"command": ["true"]},
+    "notification": {"queue": {"enabled": False}},
+}
+
+
+class Upstream(http.server.BaseHTTPRequestHandler):
+    """Echoes the request body; /slow waits for the test to set `server.release`."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):  # noqa: N802
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.bodies.append(json.loads(body))
+        if self.path == "/slow":
+            self.server.started.set()
+            self.server.release.wait(5)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+
+@pytest.fixture
+def upstream():
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    srv.daemon_threads = True
+    srv.bodies, srv.started, srv.release = [], threading.Event(), threading.Event()
+    threading.Thread(target=srv.serve_forever, args=(0.05,), daemon=True).start()
+    yield srv
+    srv.release.set()
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def make_proxy(tmp_path, monkeypatch, upstream):
+    monkeypatch.chdir(tmp_path)
+    created = []
+
+    def make(**pcfg):
+        wd = watchdog.Watchdog(CONFIG)
+        proxy = watchdog.RequestProxy(
+            wd, dict({"port": 0, "upstream": f"http://127.0.0.1:{upstream.server_address[1]}"}, **pcfg)
+        )
+        wd.proxy = proxy
+        proxy.start()
+        created.append((wd, proxy))
+        return wd, proxy
+
+    yield make
+    for wd, proxy in created:
+        proxy.close()
+        wd.close()
+
+
+def post(proxy, path="/api/generate", model="big"):
+    conn = http.client.HTTPConnection("127.0.0.1", proxy.server.server_address[1], timeout=10)
+    try:
+        conn.request("POST", path, body=json.dumps({"model": model}), headers={"Content-Type": "application/json"})
+        resp = conn.getresponse()
+        return resp.status, resp.getheader("Retry-After"), json.loads(resp.read())
+    finally:
+        conn.close()
+
+
+def wait_for(check):
+    deadline = time.monotonic() + 5
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_requests_for_unloaded_models_go_to_a_loaded_one(make_proxy, upstream):
+    wd, proxy = make_proxy()
+    assert post(proxy, model="big")[2] == {"model": "big"}
+    wd.state.current_profile_index = 1
+    assert post(proxy, model="big")[2] == {"model": "small"}
+    assert 'proxy_substitutions_total{requested="big",served="small"} 1' in wd.render_metrics()
+
+    strict_wd, strict = make_proxy(substitute_missing=False)
+    strict_wd.state.current_profile_index = 1
+    status, _, body = post(strict, model="big")
+    assert status == 503 and "not loaded" in body["error"]
+
+
+def test_requests_are_shed_above_the_memory_threshold(make_proxy, upstream):
+    wd, proxy = make_proxy(retry_after_sec=7)
+    wd.last_mem_percent = 95.0
+    assert post(proxy) == (503, "7", {"error": "watchdog shed request (memory)"})
+    assert not upstream.bodies
+    assert 'proxy_requests_total{result="shed_memory"} 1' in wd.render_metrics()
+
+
+def test_drain_waits_for_in_flight_requests_and_holds_new_ones(make_proxy, upstream):
+    wd, proxy = make_proxy()
+    results = []
+    slow = threading.Thread(target=lambda: results.append(post(proxy, "/slow")))
+    slow.start()
+    assert upstream.started.wait(5)
+
+    drained = []
+    drainer = threading.Thread(target=lambda: drained.append(proxy.drain()))
+    drainer.start()
+    wait_for(lambda: proxy.draining)
+    held = threading.Thread(target=lambda: results.append(post(proxy, model="small")))
+    held.start()
+    wait_for(lambda: proxy.queued == 1)
+    assert not drained
+
+    upstream.release.set()
+    drainer.join(5)
+    assert drained == [True]
+    assert len(upstream.bodies) == 1  # the held request is still queued
+    proxy.resume()
+    held.join(5)
+    slow.join(5)
+    assert sorted(r[2]["model"] for r in results) == ["big", "small"]
+
+
+def test_drain_gives_up_after_its_timeout(make_proxy, upstream):
+    wd, proxy = make_proxy(drain_timeout_sec=0.05)
+    slow = threading.Thread(target=lambda: post(proxy, "/slow"))
+    slow.start()
+    assert upstream.started.wait(5)
+    assert proxy.drain() is False
+    proxy.resume()
+    upstream.release.set()
+    slow.join(5)
+
+
+def test_concurrency_drops_under_memory_pressure(make_proxy):
+    wd, proxy = make_proxy(max_inflight=4, pressure_max_inflight=1, queue_percent=80)
+    wd.last_mem_percent = 50.0
+    assert proxy.concurrency_limit() == 4
+    wd.last_mem_percent = 85.0
+    assert proxy.concurrency_limit() == 1
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+
+import pytest
+
+import watchdog
+
+GB = 1024 ** 3
+CONFIG = {
+    "interval_sec": 1,
+    "models": [{"name": "gpt-oss:20b", "ram_gb": 13.0}, {"name": "qwen3:4b", "ram_gb": 4.0}],
+    "profiles": [
+        {"name": "rich", "models": ["gpt-oss:20b", "qwen3:4b"]},
+        {"name": "lean", "models": ["qwen3:4b"]},
+    ],
+    "restart": {"command": ["true"]},
+    "rss_accounting": {"enabled": True, "ewma_alpha": 0.5, "settle_sec": 0},
+}
+
+
+class FakeProcessTable(watchdog.ProcessTable):
+    def __init__(self, procs):
+        # pid -> (ppid, comm, argv, rss)
+        self.procs = procs
+
+    def processes(self):
+        return [watchdog.ProcInfo(pid=pid, ppid=p[0], comm=p[1]) for pid, p in self.procs.items()]
+
+    def cmdline(self, pid):
+        return self.procs[pid][2] if pid in self.procs else []
+
+    def rss_bytes(self, pid):
+        return self.procs[pid][3] if pid in self.procs else 0
+
+
+def ollama_dir(tmp_path):
+    """An Ollama models dir whose manifest maps blob sha256-abc to qwen3:4b."""
+    manifest = tmp_path / "manifests" / "registry.ollama.ai" / "library" / "qwen3" / "4b"
+    manifest.parent.mkdir(parents=True)
+    manifest.write_text(
+        json.dumps({"layers": [{"mediaType": "application/vnd.ollama.image.model", "digest": "sha256:abc"}]})
+    )
+    return str(tmp_path)
+
+
+def ollama_tree(gpt_rss=8 * GB):
+    return {
+        1: (0, "launchd", [], 0),
+        10: (1, "ollama", ["ollama", "serve"], 1 * GB),
+        11: (10, "ollama_llama_server", ["runner", "--model", "/blobs/sha256-abc"], 3 * GB),
+        12: (10, "ollama_llama_server", ["runner", "gpt-oss:20b"], gpt_rss),
+        13: (12, "helper", ["helper"], 0),
+        20: (1, "python3", ["python3", "other.py"], 5 * GB),
+    }
+
+
+def test_collector_walks_the_tree_and_attributes_models(tmp_path):
+    collector = watchdog.ProcessRSSCollector(
+        ["ollama"], ["gpt-oss:20b", "qwen3:4b"], ollama_dir(tmp_path), FakeProcessTable(ollama_tree())
+    )
+    snap = collector.collect()
+    assert snap.pids == [10, 11, 12, 13]
+    assert snap.per_model == {"qwen3:4b": 3 * GB, "gpt-oss:20b": 8 * GB}
+    assert snap.unattributed_bytes == 1 * GB
+    assert snap.total_bytes == 12 * GB
+
+
+def test_collector_forgets_exited_pids(tmp_path):
+    table = FakeProcessTable(ollama_tree())
+    collector = watchdog.ProcessRSSCollector(["ollama"], ["gpt-oss:20b", "qwen3:4b"], ollama_dir(tmp_path), table)
+    collector.collect()
+    del table.procs[12], table.procs[13]
+    collector.collect()
+    # pid 12 is reused by an unrelated child of the server: its argv is read again.
+    table.procs[12] = (10, "sh", ["sh"], 1 * GB)
+    snap = collector.collect()
+    assert snap.per_model == {"qwen3:4b": 3 * GB}
+    assert snap.unattributed_bytes == 2 * GB
+
+
+def test_update_rss_folds_readings_into_averages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = watchdog.Watchdog(CONFIG)
+    try:
+        table = FakeProcessTable(ollama_tree(gpt_rss=8 * GB))
+        wd.rss_collector = watchdog.ProcessRSSCollector(
+            ["ollama"], [m.name for m in wd.models], ollama_dir(tmp_path), table
+        )
+        wd.update_rss(force=True)
+        table.procs[12] = table.procs[12][:3] + (10 * GB,)
+        wd.update_rss(force=True)
+        models = {m.name: m for m in wd.models}
+        assert models["gpt-oss:20b"].measured_ram_gb == pytest.approx(9.0)
+        assert models["qwen3:4b"].measured_ram_gb == pytest.approx(3.0)
+        assert wd.current_profile().measured_ram_gb == pytest.approx(13.0)
+    finally:
+        wd.close()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc")
+def test_linux_process_table_sees_this_process():
+    table = watchdog.LinuxProcessTable()
+    me = [p for p in table.processes() if p.pid == os.getpid()]
+    assert me and me[0].ppid == os.getppid()
+    assert table.cmdline(os.getpid())
+    assert table.rss_bytes(os.getpid()) > 0
+    assert table.rss_bytes(2 ** 22 + 1) == 0
+
+
+def test_process_table_is_abstract():
+    class NoRSS(watchdog.ProcessTable):
+        def processes(self):
+            return []
+
+        def cmdline(self, pid):
+            return []
+
+    with pytest.raises(TypeError):
+        NoRSS()
@@ -0,0 +1,14 @@
+import pytest
+
+import session
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_session_delivers_every_key_at_10_percent_loss(seed):
+    result = session.loopback_run(True, 2.0, 0.1, 10.0, seed, 5.0)
+    assert result["delivered"] == result["key_events_sent"] > 0
+    assert result["stuck"] == 0
+    assert result["gave_up"] == 0
+    # Released on the missing heartbeats (1 s), long before the 5 s hold timeout.
+    assert result["held_then_released_after_sec"] is not None
+    assert result["held_then_released_after_sec"] < 2.0
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+import watchdog
+
+START = datetime(2026, 1, 5, 9, 0, 0)
+CONFIG = {
+    "interval_sec": 1,
+    "memory_threshold_percent": 90,
+    "cooldown_sec": 60,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "profiles": [{"name": "rich", "models": ["big", "small"]}, {"name": "lean", "models": ["small"]}],
+    "switch": {"command": ["switch", "{profile}"]},
+    "restart": {"command": ["restart"]},
+}
+
+
+def write_log(path, memory):
+    """A watchdog.log with the recorded start profile and one memory line per (second, percent)."""
+    lines = [f"[{START.isoformat()}] profile mode enabled, start profile=rich"]
+    for sec, mem in memory:
+        lines.append(f"[{(START + timedelta(seconds=sec)).isoformat()}] memory usage={mem:.2f}%")
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def overload_trace(tmp_path):
+    # 50% for 10 s, 95% for 20 s, back to 50% until t=60.
+    memory = [(t, 95.0 if 10 <= t < 30 else 50.0) for t in range(61)]
+    return watchdog.parse_trace(write_log(tmp_path / "watchdog.log", memory))
+
+
+def test_parse_trace_reads_memory_and_profiles(tmp_path):
+    trace = overload_trace(tmp_path)
+    assert trace.duration == 60.0
+    assert len(trace.memory) == 61
+    assert trace.memory[10] == (10.0, 95.0)
+    assert trace.profiles == [(0.0, "rich")]
+    assert all(ok for _, ok in trace.health)
+
+
+def test_replay_reports_overload_restarts_and_downtime(tmp_path):
+    result = watchdog.Simulator(
+        CONFIG, overload_trace(tmp_path), restart_sec=5.0, switch_sec=1.0, ready_sec=0.0, total_gb=16.0
+    ).run()
+    assert result["recorded_overload_sec"] == 20.0
+    # Overload at t=10, switch (1 s) and restart (5 s); "lean" is 4 GB (25% of 16 GB) smaller.
+    assert result["recoveries"] == 1
+    assert result["recoveries_by_reason"] == {"memory_overload": 1}
+    assert result["restarts"] == 1
+    assert result["failed_recoveries"] == 0
+    assert result["downtime_sec"] == 6.0
+    assert result["overload_sec"] == 6.0
+    assert result["final"] == "lean"
+    assert result["time_per_profile_sec"] == {"rich": 16.0, "lean": 44.0}
+
+
+def test_trace_ending_during_readiness_is_not_a_failed_recovery(tmp_path):
+    cfg = dict(CONFIG, readiness={"enabled": True, "deadline_sec": 120})
+    trace = watchdog.parse_trace(write_log(tmp_path / "watchdog.log", [(t, 95.0 if t >= 10 else 50.0) for t in range(21)]))
+    result = watchdog.Simulator(cfg, trace, restart_sec=2.0, ready_sec=60.0, total_gb=16.0).run()
+    assert result["failed_recoveries"] == 0
+    assert result["recoveries"] == 0
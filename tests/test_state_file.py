@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "cooldown_sec": 60,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "profiles": [{"name": "rich", "models": ["big", "small"]}, {"name": "lean", "models": ["small"]}],
+    "restart": {"command": ["true"]},
+    "notification": {"queue": {"enabled": False}},
+}
+
+
+class RecordingWatchdog(watchdog.Watchdog):
+    def log(self, msg, **fields):
+        # load_state() logs from __init__, before any attribute set here exists.
+        self.__dict__.setdefault("logged", []).append(msg)
+
+
+@pytest.fixture
+def make_watchdog(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    created = []
+
+    def make(config=CONFIG):
+        wd = RecordingWatchdog(config)
+        created.append(wd)
+        return wd
+
+    yield make
+    for wd in created:
+        wd.close()
+
+
+def test_atomic_write_replaces_the_file_or_leaves_it_alone(tmp_path):
+    path = tmp_path / "state" / "watchdog.state.json"
+    watchdog.atomic_write_json(str(path), {"profile": "rich"})
+    assert json.loads(path.read_text()) == {"profile": "rich"}
+    with pytest.raises(TypeError):
+        watchdog.atomic_write_json(str(path), {"profile": object()})
+    assert json.loads(path.read_text()) == {"profile": "rich"}
+    assert [p.name for p in path.parent.iterdir()] == ["watchdog.state.json"]
+
+
+def test_restart_resumes_profile_cooldown_and_measurements(make_watchdog):
+    first = make_watchdog()
+    first.state.current_profile_index = 1
+    first.state.last_action_ts = first.clock.time() - 10
+    first.state.health_fail_count = 2
+    first.models[0].measured_ram_gb = 9.5
+    first.save_state()
+
+    second = make_watchdog()
+    assert second.current_profile().name == "lean"
+    assert second.state.health_fail_count == 2
+    assert second.models[0].measured_ram_gb == 9.5
+    assert second.should_cooldown()
+    assert any(msg.endswith("lean, cooldown 50s left") for msg in second.logged)
+
+
+def test_profiles_are_matched_by_name(make_watchdog):
+    first = make_watchdog()
+    first.state.current_profile_index = 1
+    first.save_state()
+    reordered = dict(CONFIG, profiles=list(reversed(CONFIG["profiles"])))
+    assert make_watchdog(reordered).current_profile().name == "lean"
+
+
+def test_unreadable_state_file_is_ignored(make_watchdog, tmp_path):
+    (tmp_path / "watchdog.state.json").write_text("{not json")
+    wd = make_watchdog()
+    assert wd.current_profile().name == "rich"
+    assert any(msg.startswith("ignore unreadable state file") for msg in wd.logged)
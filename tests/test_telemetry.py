@@ -0,0 +1,80 @@
+import types
+import urllib.error
+import urllib.request
+
+import pytest
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "cooldown_sec": 60,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "profiles": [{"name": "rich", "models": ["big", "small"]}, {"name": "lean", "models": ["small"]}],
+    "restart": {"command": ["true"]},
+    "notification": {"queue": {"enabled": False}},
+}
+
+
+def test_render_is_prometheus_text():
+    telemetry = watchdog.Telemetry()
+    telemetry.inc("recoveries_total", reason="memory_overload", result="ok")
+    telemetry.inc("recoveries_total", reason="memory_overload", result="ok")
+    telemetry.observe("time_to_ready_seconds", 0.01)  # on a bound: counted in that bucket (le)
+    telemetry.observe("time_to_ready_seconds", 90.0)  # past the last bound: only +Inf
+    text = telemetry.render([("memory_usage_percent", {}, 42.5)])
+    lines = text.splitlines()
+    assert lines[:6] == [
+        "# HELP openclaw_watchdog_memory_usage_percent Latest memory usage sample",
+        "# TYPE openclaw_watchdog_memory_usage_percent gauge",
+        "openclaw_watchdog_memory_usage_percent 42.5",
+        "# HELP openclaw_watchdog_recoveries_total Recovery attempts by reason and result",
+        "# TYPE openclaw_watchdog_recoveries_total counter",
+        'openclaw_watchdog_recoveries_total{reason="memory_overload",result="ok"} 2',
+    ]
+    assert "# TYPE openclaw_watchdog_time_to_ready_seconds histogram" in lines
+    assert 'openclaw_watchdog_time_to_ready_seconds_bucket{le="0.005"} 0' in lines
+    assert 'openclaw_watchdog_time_to_ready_seconds_bucket{le="0.01"} 1' in lines
+    assert 'openclaw_watchdog_time_to_ready_seconds_bucket{le="60"} 1' in lines
+    assert 'openclaw_watchdog_time_to_ready_seconds_bucket{le="+Inf"} 2' in lines
+    assert "openclaw_watchdog_time_to_ready_seconds_sum 90.01" in lines
+    assert "openclaw_watchdog_time_to_ready_seconds_count 2" in lines
+    assert text.endswith("\n")
+
+
+def test_label_values_are_escaped():
+    assert watchdog.prom_labels((("host", 'a"b\\c\nd'),)) == '{host="a\\"b\\\\c\\nd"}'
+    assert watchdog.prom_labels(()) == ""
+
+
+def test_watchdog_exposes_profile_and_recovery_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = watchdog.Watchdog(CONFIG)
+    try:
+        wd.memory_action(55.0)
+        wd.state.last_action_ts = wd.clock.time()
+        wd.recover("memory_overload", 95.0)  # refused: still in cooldown
+        lines = wd.render_metrics().splitlines()
+    finally:
+        wd.close()
+    assert "openclaw_watchdog_memory_usage_percent 55" in lines
+    assert 'openclaw_watchdog_active_profile{profile="rich"} 1' in lines
+    assert 'openclaw_watchdog_active_profile{profile="lean"} 0' in lines
+    assert "openclaw_watchdog_health_fail_count 0" in lines
+    assert 'openclaw_watchdog_recoveries_total{reason="memory_overload",result="cooldown"} 1' in lines
+
+
+def test_exporter_serves_metrics_over_http():
+    source = types.SimpleNamespace(render_metrics=lambda: "openclaw_watchdog_up 1\n")
+    exporter = watchdog.MetricsExporter(source, "127.0.0.1", 0)
+    exporter.start()
+    base = f"http://127.0.0.1:{exporter.server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{base}/metrics", timeout=5) as resp:
+            assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert resp.read() == b"openclaw_watchdog_up 1\n"
+        with pytest.raises(urllib.error.HTTPError) as err:
+            urllib.request.urlopen(f"{base}/other", timeout=5)
+        assert err.value.code == 404
+    finally:
+        exporter.close()
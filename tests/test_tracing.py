@@ -0,0 +1,73 @@
+import json
+import threading
+
+import pytest
+
+import watchdog
+
+CONFIG = {
+    "interval_sec": 1,
+    "cooldown_sec": 60,
+    "models": [{"name": "big", "ram_gb": 8.0}, {"name": "small", "ram_gb": 4.0}],
+    "profiles": [{"name": "rich", "models": ["big", "small"]}, {"name": "lean", "models": ["small"]}],
+    "switch": {"command": ["true", "{profile}"]},
+    "restart": {"command": ["false"]},
+    "notification": {"queue": {"enabled": False}},
+    "tracing": {"chrome_trace_dir": "traces", "slow_recovery_sec": 0},
+}
+
+
+class RecordingWatchdog(watchdog.Watchdog):
+    def log(self, msg, **fields):
+        self.__dict__.setdefault("logged", []).append(msg)
+
+
+def test_spans_nest_per_thread_and_record_errors():
+    tracer = watchdog.Tracer()
+    other = []
+    with tracer.span("recovery", reason="test") as root:
+        with tracer.span("switch"):
+            # Spans opened on another thread start their own tree.
+            thread = threading.Thread(target=lambda: other.append(tracer.span("elsewhere").__enter__()))
+            thread.start()
+            thread.join()
+        with pytest.raises(RuntimeError):
+            with tracer.span("restart"):
+                raise RuntimeError("boom")
+    assert [c.name for c in root.children] == ["switch", "restart"]
+    assert root.children[1].attrs == {"error": "boom"}
+    assert not root.children[0].children
+    assert other and other[0].tid != root.tid
+    assert root.duration >= sum(c.duration for c in root.children)
+
+
+def test_chrome_trace_has_one_complete_event_per_span():
+    tracer = watchdog.Tracer()
+    with tracer.span("recovery") as root:
+        with tracer.span("command:switch", rc=0):
+            pass
+    events = watchdog.chrome_trace(root)["traceEvents"]
+    assert [e["name"] for e in events] == ["recovery", "command:switch"]
+    assert {e["ph"] for e in events} == {"X"}
+    assert events[0]["ts"] == pytest.approx(root.wall_start * 1e6)
+    assert events[1]["ts"] >= events[0]["ts"]
+    assert events[1]["args"]["rc"] == 0
+
+
+def test_recovery_logs_phases_and_writes_a_slow_trace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wd = RecordingWatchdog(CONFIG)
+    try:
+        wd.recover("memory_overload", 95.0)
+    finally:
+        wd.close()
+    summary = [m for m in wd.logged if m.startswith("recovery trace:")]
+    assert len(summary) == 1
+    assert "reason=memory_overload" in summary[0]
+    assert "switch_profile=" in summary[0] and "(rc=0)" in summary[0]
+    assert "restart_service=" in summary[0] and "(rc=1)" in summary[0]
+    (path,) = (tmp_path / "traces").iterdir()
+    assert path.name.endswith("-memory_overload.trace.json")
+    names = [e["name"] for e in json.loads(path.read_text())["traceEvents"]]
+    assert names[0] == "recovery"
+    assert "command:restart" in names
@@ -1,19 +1,39 @@
 #!/usr/bin/env python3
+import abc
 import argparse
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import http.client
+import http.server
+import importlib.util
 import json
+import mmap
 import os
 import platform
 import re
+import resource
 import shlex
+import signal
+import socket
+import ssl
+import struct
 import subprocess
 import sys
+import threading
 import time
-import urllib.error
-import urllib.request
-from dataclasses import dataclass
+import urllib.parse
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+
+# Planner-built model sets that match no configured profile are named "auto:<model>+<model>".
+AUTO_PROFILE_PREFIX = "auto:"
+MEMORY_REASONS = ("memory_overload", "memory_trend", "memory_upgrade")
 
 
 @dataclass
@@ -28,6 +48,12 @@ class State:
 class ModelSpec:
     name: str
     ram_gb: Optional[float] = None
+    measured_ram_gb: Optional[float] = None
+    # Utility weight for the memory planner.
+    priority: float = 1.0
+
+    def effective_ram_gb(self) -> Optional[float]:
+        return self.measured_ram_gb if self.measured_ram_gb is not None else self.ram_gb
 
 
 @dataclass
@@ -35,124 +61,1059 @@ class ProfileSpec:
     name: str
     models: List[str]
     ram_gb: Optional[float] = None
+    measured_ram_gb: Optional[float] = None
+    placeholders: Optional["TemplateValues"] = field(default=None, repr=False, compare=False)
 
+    def template_values(self) -> "TemplateValues":
+        """{profile}/{models_csv}/{models_spaced}, joined once per profile."""
+        if self.placeholders is None:
+            self.placeholders = TemplateValues(
+                profile=self.name,
+                models_csv=",".join(self.models),
+                models_spaced=" ".join(shlex.quote(m) for m in self.models),
+            )
+        return self.placeholders
 
-class Watchdog:
-    def __init__(self, config: Dict[str, Any], dry_run: bool = False):
-        self.config = config
-        self.dry_run = dry_run
-        self.state = State(current_model_index=0)
 
-        models = self.config.get("models", [])
-        profiles = self.config.get("profiles", [])
-        if not models and not profiles:
-            raise ValueError("config.models must not be empty")
+@dataclass
+class HealthProbe:
+    name: str
+    kind: str  # command | http | tcp | inference | ps
+    timeout_sec: float
+    required: bool = False
+    hedge: bool = False
+    command: Optional[List[str]] = None
+    url: Optional[str] = None
+    method: str = "GET"
+    host: str = "127.0.0.1"
+    port: int = 0
+    prompt: str = "ping"
+    # Inference probes are expanded per model of the active profile at probe time.
+    model: Optional[str] = None
 
-        self.models: List[ModelSpec] = self.parse_models(models)
-        self.profiles: List[ProfileSpec] = self.parse_profiles(profiles)
-        self.interval_sec = int(self.config.get("interval_sec", 5))
-        self.memory_threshold_percent = float(self.config.get("memory_threshold_percent", 90))
-        self.consecutive_health_fail_limit = int(self.config.get("consecutive_health_fail_limit", 3))
-        self.cooldown_sec = int(self.config.get("cooldown_sec", 60))
-        self.log_file = self.config.get("log_file", "watchdog.log")
-        self.prefer_lower_memory_on_overload = bool(self.config.get("prefer_lower_memory_on_overload", True))
 
-        if self.profiles:
-            self.state.current_profile_index = self.find_initial_profile_index()
-            self.log(f"profile mode enabled, start profile={self.current_profile().name}")
+TEMPLATE_FIELDS = ("model", "message", "profile", "models_csv", "models_spaced")
+TEMPLATE_RE = re.compile(r"\{(" + "|".join(TEMPLATE_FIELDS) + r")\}")
+
+
+class TemplateValues(dict):
+    def __missing__(self, key: str) -> str:
+        return "{" + key + "}"
+
+
+class CommandTemplate:
+    """A command argv compiled once into str.format_map() templates for its `{placeholder}` slots.
+
+    Only TEMPLATE_FIELDS are placeholders; other braces (JSON bodies) are literal. Fields not
+    passed to render() are left as-is, like the old string replace chains.
+    """
+
+    def __init__(self, argv: Any, where: str):
+        if not isinstance(argv, list) or not argv or not all(isinstance(a, str) for a in argv):
+            raise ValueError(f"{where} must be a non-empty list of strings")
+        self.argv: List[str] = list(argv)
+        # (argument index, format string with non-placeholder braces escaped) for arguments with fields.
+        self.slots: List[Tuple[int, str]] = []
+        fields: Set[str] = set()
+        for i, arg in enumerate(self.argv):
+            pieces = TEMPLATE_RE.split(arg)
+            if len(pieces) > 1:
+                fields.update(pieces[1::2])
+                fmt = "".join(
+                    "{" + piece + "}" if j % 2 else piece.replace("{", "{{").replace("}", "}}")
+                    for j, piece in enumerate(pieces)
+                )
+                self.slots.append((i, fmt))
+        self.fields = tuple(sorted(fields))
+        # Rendered argv per tuple of field values: switch/load commands repeat the same few profiles/models.
+        self.rendered: Dict[Tuple[Optional[str], ...], List[str]] = {}
+
+    def render(self, values: Optional[Dict[str, str]] = None) -> List[str]:
+        if not self.slots:
+            return list(self.argv)
+        values = values or {}
+        key = tuple(values.get(f) for f in self.fields)
+        out = self.rendered.get(key)
+        if out is None:
+            mapping = values if isinstance(values, TemplateValues) else TemplateValues(values)
+            out = list(self.argv)
+            for i, fmt in self.slots:
+                out[i] = fmt.format_map(mapping)
+            if len(self.rendered) >= 64:
+                self.rendered.clear()
+            self.rendered[key] = out
+        return list(out)
+
+
+# Config paths whose command is precompiled at load; the key is what Watchdog.command() takes.
+COMMAND_PATHS = {
+    "switch": ("switch", "command"),
+    "restart": ("restart", "command"),
+    "notify": ("notification", "command"),
+    "unload": ("unload", "command"),
+    "load": ("load", "command"),
+    "emergency_fallback": ("emergency_fallback", "command"),
+    "emergency_restart": ("emergency_fallback", "restart_command"),
+}
+# Settings that only take effect on restart; a hot reload logs them instead of applying them.
+RESTART_ONLY_KEYS = (
+    "log_file",
+    "state_file",
+    "memory_sampler",
+    "cgroup_dir",
+    "engine",
+    "metrics",
+    "exporter",
+    "proxy.enabled",
+    "proxy.bind",
+    "proxy.port",
+    "fleet",
+    "async_engine",
+    "logging.format",
+    "logging.stdout",
+    "logging.flush_interval_sec",
+    "logging.max_bytes",
+    "logging.max_age_sec",
+    "logging.backup_count",
+    "notification.queue",
+    "adaptive_sampling.ring_size",
+    "adaptive_sampling.window_sec",
+)
+
+
+class LogWriter:
+    """Keeps the log file open and writes batched lines from a background flusher thread.
+
+    Lines become visible on disk within flush_interval_sec; the file rotates to
+    `<name>.1 .. <name>.N` once it exceeds max_bytes or has been open for max_age_sec.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fmt: str = "text",
+        echo: bool = True,
+        flush_interval_sec: float = 1.0,
+        max_bytes: int = 5 * 1024 * 1024,
+        max_age_sec: float = 0,
+        backup_count: int = 3,
+    ):
+        self.path = Path(path)
+        self.fmt = fmt
+        self.echo = echo
+        self.flush_interval_sec = flush_interval_sec
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.backup_count = backup_count
+        self.cond = threading.Condition()
+        self.pending: List[str] = []
+        self.file: Optional[Any] = None
+        self.size = 0
+        self.opened_at = 0.0
+        self.closed = False
+        self.thread: Optional[threading.Thread] = None
+
+    def write(self, msg: str, fields: Optional[Dict[str, Any]] = None) -> None:
+        now = datetime.now()
+        line = f"[{now.isoformat(timespec='seconds')}] {msg}"
+        if self.echo:
+            print(line, flush=True)
+        if self.fmt == "json":
+            record: Dict[str, Any] = {"ts": now.isoformat(timespec="milliseconds"), "msg": msg}
+            if fields:
+                record.update(fields)
+            line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self.cond:
+            if self.closed:
+                return
+            self.pending.append(line + "\n")
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="wd-log", daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            with self.cond:
+                if not self.closed:
+                    self.cond.wait(timeout=self.flush_interval_sec)
+                batch, self.pending = self.pending, []
+                closed = self.closed
+            if batch:
+                self.write_batch(batch)
+            if closed:
+                return
 
-    def log(self, msg: str) -> None:
-        line = f"[{datetime.now().isoformat(timespec='seconds')}] {msg}"
-        print(line, flush=True)
+    def open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+        self.opened_at = time.monotonic()
+
+    def rotate(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        for i in range(self.backup_count - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+        self.open()
+
+    def write_batch(self, batch: List[str]) -> None:
+        data = "".join(batch)
         try:
-            Path(self.log_file).parent.mkdir(parents=True, exist_ok=True)
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(line + "\n")
+            if self.file is None:
+                self.open()
+            assert self.file is not None
+            too_big = self.max_bytes > 0 and self.size + len(data) > self.max_bytes and self.size > 0
+            too_old = self.max_age_sec > 0 and time.monotonic() - self.opened_at > self.max_age_sec
+            if too_big or too_old:
+                self.rotate()
+                assert self.file is not None
+            self.file.write(data)
+            self.file.flush()
+            self.size += len(data)
         except OSError:
-            pass
+            # Same as before: a broken log file must never take the watchdog down.
+            self.file = None
 
-    def run_command(self, cmd: List[str], timeout: int = 30) -> subprocess.CompletedProcess:
-        pretty = " ".join(shlex.quote(c) for c in cmd)
-        if self.dry_run:
-            self.log(f"[DRY-RUN] command: {pretty}")
-            return subprocess.CompletedProcess(args=cmd, returncode=0, stdout="", stderr="")
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout=5)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        if idx < len(self.counts):
+            self.counts[idx] += 1
+        self.count += 1
+        self.sum += value
+
+
+def prom_labels(labels: Tuple[Tuple[str, str], ...], le: Optional[str] = None) -> str:
+    pairs = list(labels)
+    if le is not None:
+        pairs.append(("le", le))
+    if not pairs:
+        return ""
+    parts = []
+    for key, value in pairs:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Telemetry:
+    """In-process counters and histograms rendered as Prometheus text; recording never forks or blocks."""
+
+    PREFIX = "openclaw_watchdog_"
+    HELP = {
+        "memory_usage_percent": "Latest memory usage sample",
+        "active_profile": "Currently selected profile (1 for the active one)",
+        "active_model": "Currently selected model (1 for the active one)",
+        "health_fail_count": "Consecutive failed health checks",
+        "seconds_since_last_action": "Seconds since the last recovery action",
+        "health_check_duration_seconds": "health_ok() wall time",
+        "health_probe_duration_seconds": "Duration of each named health probe by result",
+        "command_duration_seconds": "Duration of switch/restart/notify/health commands",
+        "recoveries_total": "Recovery attempts by reason and result",
+        "time_to_ready_seconds": "Time from restart until the health check passes",
+        "http_connect_seconds": "TCP/TLS connect time for new pooled HTTP connections",
+        "http_response_seconds": "Request-to-response time on pooled HTTP connections",
+        "proxy_requests_total": "Requests handled by the local proxy, by result",
+        "proxy_queue_wait_seconds": "Time requests waited for admission in the proxy queue",
+        "proxy_substitutions_total": "Requests rewritten from an unloaded model to a loaded one",
+        "proxy_inflight": "Requests currently forwarded upstream by the proxy",
+        "proxy_queued": "Requests waiting in the proxy queue",
+        "fleet_changes_total": "Profile changes the fleet supervisor applied, by host and result",
+        "health_hedged_requests_total": "Health requests that sent a second (hedged) copy after the p95 delay",
+    }
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def render(self, gauges: List[Tuple[str, Dict[str, str], float]]) -> str:
+        lines: List[str] = []
+        typed: Set[str] = set()
+
+        def header(name: str, kind: str) -> None:
+            if name in typed:
+                return
+            typed.add(name)
+            lines.append(f"# HELP {self.PREFIX}{name} {self.HELP.get(name, name)}")
+            lines.append(f"# TYPE {self.PREFIX}{name} {kind}")
+
+        for name, labels, value in gauges:
+            header(name, "gauge")
+            lines.append(f"{self.PREFIX}{name}{prom_labels(tuple(sorted(labels.items())))} {value:g}")
+        with self.lock:
+            for (name, labels_t), value in sorted(self.counters.items()):
+                header(name, "counter")
+                lines.append(f"{self.PREFIX}{name}{prom_labels(labels_t)} {value:g}")
+            for (name, labels_t), hist in sorted(self.histograms.items()):
+                header(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(f"{self.PREFIX}{name}_bucket{prom_labels(labels_t, f'{bound:g}')} {cumulative}")
+                lines.append(f"{self.PREFIX}{name}_bucket{prom_labels(labels_t, '+Inf')} {hist.count}")
+                lines.append(f"{self.PREFIX}{name}_sum{prom_labels(labels_t)} {hist.sum:g}")
+                lines.append(f"{self.PREFIX}{name}_count{prom_labels(labels_t)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Serves /metrics from a daemon thread; scrapes only read in-memory values."""
+
+    def __init__(self, watchdog: "Watchdog", bind: str, port: int):
+        render = watchdog.render_metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((bind, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="wd-exporter", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+HOP_BY_HOP = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+    "content-length",
+}
+
+
+class RequestProxy:
+    """Local reverse proxy in front of the model server with admission control.
+
+    Requests name a model; ones for a model outside the active profile are rewritten to the
+    profile's first model (or rejected when substitute_missing is off). Near the memory threshold
+    concurrency drops to pressure_max_inflight and excess requests queue; above the threshold new
+    requests are shed with 503 + Retry-After. During a switch the proxy drains in-flight requests
+    and holds new ones in the queue, so recovery shows up as latency instead of failed requests.
+    """
+
+    def __init__(self, watchdog: "Watchdog", pcfg: Dict[str, Any]):
+        self.wd = watchdog
+        self.primary_upstream = ""
+        self.fallback_upstream: Optional[str] = None
+        self.upstream = ""
+        self.cond = threading.Condition()
+        self.inflight = 0
+        self.queued = 0
+        self.draining = False
+        self.configure(pcfg)
+
+        proxy = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:  # noqa: N802
+                proxy.handle(self)
+
+            do_POST = do_PUT = do_DELETE = do_HEAD = do_GET  # noqa: N815
+
+            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(
+            (pcfg.get("bind", "127.0.0.1"), int(pcfg.get("port", 11435))), Handler
+        )
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="wd-proxy", daemon=True)
+
+    def configure(self, pcfg: Dict[str, Any]) -> None:
+        """Upstreams and limits; applied again on config reload (bind/port need a restart)."""
+        with self.cond:
+            on_fallback = bool(self.upstream) and self.upstream != self.primary_upstream
+            self.primary_upstream = str(pcfg.get("upstream", "http://127.0.0.1:11434")).rstrip("/")
+            self.fallback_upstream = pcfg.get("fallback_upstream")
+            if on_fallback and self.fallback_upstream:
+                self.upstream = str(self.fallback_upstream).rstrip("/")
+            else:
+                self.upstream = self.primary_upstream
+            self.max_inflight = int(pcfg.get("max_inflight", 4))
+            self.pressure_max_inflight = int(pcfg.get("pressure_max_inflight", 1))
+            self.queue_percent = float(pcfg.get("queue_percent", self.wd.memory_threshold_percent - 5))
+            self.queue_limit = int(pcfg.get("queue_limit", 32))
+            self.queue_timeout_sec = float(pcfg.get("queue_timeout_sec", 60))
+            self.drain_timeout_sec = float(pcfg.get("drain_timeout_sec", 30))
+            self.upstream_timeout_sec = float(pcfg.get("upstream_timeout_sec", 600))
+            self.retry_after_sec = int(pcfg.get("retry_after_sec", max(self.wd.cooldown_sec // 2, 5)))
+            self.substitute_missing = bool(pcfg.get("substitute_missing", True))
+            # A raised limit may admit queued requests right away.
+            self.cond.notify_all()
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def loaded_models(self) -> List[str]:
+        if self.wd.profiles:
+            return self.wd.current_profile().models
+        return [self.wd.current_model().name]
+
+    def concurrency_limit(self) -> int:
+        mem = self.wd.last_mem_percent
+        if mem is not None and mem >= self.queue_percent:
+            return self.pressure_max_inflight
+        return self.max_inflight
+
+    def admit(self) -> Optional[str]:
+        """Block until the request may go upstream; returns why it was shed, or None when admitted."""
+        start = time.monotonic()
+        with self.cond:
+            mem = self.wd.last_mem_percent
+            if not self.draining and mem is not None and mem >= self.wd.memory_threshold_percent:
+                return "memory"
+            if self.queued >= self.queue_limit:
+                return "queue_full"
+            self.queued += 1
+            try:
+                while self.draining or self.inflight >= self.concurrency_limit():
+                    remaining = self.queue_timeout_sec - (time.monotonic() - start)
+                    if remaining <= 0:
+                        return "queue_timeout"
+                    # Re-check periodically: memory samples move without anyone notifying us.
+                    self.cond.wait(timeout=min(remaining, 0.5))
+            finally:
+                self.queued -= 1
+            self.inflight += 1
+        self.wd.telemetry.observe("proxy_queue_wait_seconds", time.monotonic() - start)
+        return None
+
+    def release(self) -> None:
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify_all()
+
+    def drain(self) -> bool:
+        """Hold new requests and wait for in-flight ones to finish; False if drain_timeout_sec ran out."""
+        deadline = time.monotonic() + self.drain_timeout_sec
+        with self.cond:
+            self.draining = True
+            while self.inflight > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.wd.log(f"proxy drain timed out with {self.inflight} request(s) in flight")
+                    return False
+                self.cond.wait(timeout=remaining)
+        return True
+
+    def resume(self) -> None:
+        with self.cond:
+            self.draining = False
+            self.cond.notify_all()
+
+    def use_fallback(self) -> None:
+        if self.fallback_upstream and self.upstream != self.fallback_upstream:
+            self.upstream = str(self.fallback_upstream).rstrip("/")
+            self.wd.log(f"proxy upstream -> fallback {self.upstream}")
+
+    def use_primary(self) -> None:
+        if self.upstream != self.primary_upstream:
+            self.upstream = self.primary_upstream
+            self.wd.log(f"proxy upstream -> primary {self.upstream}")
+
+    def route(self, body: bytes) -> Tuple[bytes, Optional[str]]:
+        """Rewrite the request's model to one of the loaded models; returns (body, error)."""
+        if self.upstream != self.primary_upstream or not body.lstrip().startswith(b"{"):
+            return body, None
         try:
-            return subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=timeout,
-                check=False,
-            )
-        except FileNotFoundError as e:
-            return subprocess.CompletedProcess(args=cmd, returncode=127, stdout="", stderr=str(e))
+            payload = json.loads(body)
+        except ValueError:
+            return body, None
+        model = payload.get("model") if isinstance(payload, dict) else None
+        loaded = self.loaded_models()
+        if not isinstance(model, str) or model in loaded or f"{model}:latest" in loaded:
+            return body, None
+        if not self.substitute_missing:
+            return body, f"model {model} is not loaded (profile models: {', '.join(loaded)})"
+        payload["model"] = loaded[0]
+        self.wd.telemetry.inc("proxy_substitutions_total", requested=model, served=loaded[0])
+        return json.dumps(payload).encode("utf-8"), None
 
-    def parse_models(self, raw_models: List[Any]) -> List[ModelSpec]:
-        parsed: List[ModelSpec] = []
-        for item in raw_models:
-            if isinstance(item, str):
-                parsed.append(ModelSpec(name=item, ram_gb=None))
-                continue
-            if isinstance(item, dict):
-                name = item.get("name")
-                if not name:
-                    raise ValueError("each model object requires name")
-                ram = item.get("ram_gb")
-                parsed.append(ModelSpec(name=name, ram_gb=float(ram) if ram is not None else None))
-                continue
-            raise ValueError("config.models entries must be string or object")
-        return parsed
+    def reply_error(self, handler: http.server.BaseHTTPRequestHandler, status: int, msg: str) -> None:
+        body = json.dumps({"error": msg}).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            handler.send_header("Retry-After", str(self.retry_after_sec))
+        handler.end_headers()
+        if handler.command != "HEAD":
+            handler.wfile.write(body)
 
-    def parse_profiles(self, raw_profiles: List[Any]) -> List[ProfileSpec]:
-        parsed: List[ProfileSpec] = []
-        for item in raw_profiles:
-            if not isinstance(item, dict):
-                raise ValueError("config.profiles entries must be object")
-            name = item.get("name")
-            models = item.get("models")
-            if not name or not isinstance(models, list) or not models:
-                raise ValueError("each profile requires name and non-empty models")
-            ram = item.get("ram_gb")
-            if ram is None:
-                ram = 0.0
-                for model_name in models:
-                    for m in self.models:
-                        if m.name == model_name and m.ram_gb is not None:
-                            ram += m.ram_gb
-                            break
-                if ram == 0.0:
-                    ram = None
-            parsed.append(ProfileSpec(name=name, models=models, ram_gb=float(ram) if ram is not None else None))
-        return parsed
+    def handle(self, handler: http.server.BaseHTTPRequestHandler) -> None:
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        shed = self.admit()
+        if shed is not None:
+            self.wd.telemetry.inc("proxy_requests_total", result=f"shed_{shed}")
+            self.reply_error(handler, 503, f"watchdog shed request ({shed})")
+            return
+        try:
+            # Route only once admitted: a request queued across a switch goes to the new profile.
+            body, route_error = self.route(body)
+            if route_error:
+                self.reply_error(handler, 503, route_error)
+                result = "unroutable"
+            else:
+                result = self.forward(handler, body)
+        finally:
+            self.release()
+        self.wd.telemetry.inc("proxy_requests_total", result=result)
+
+    def forward(self, handler: http.server.BaseHTTPRequestHandler, body: bytes) -> str:
+        parts = urllib.parse.urlsplit(self.upstream)
+        conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        conn = conn_cls(parts.hostname or "127.0.0.1", parts.port, timeout=self.upstream_timeout_sec)
+        headers = {k: v for k, v in handler.headers.items() if k.lower() not in HOP_BY_HOP}
+        try:
+            conn.request(handler.command, parts.path.rstrip("/") + handler.path, body=body or None, headers=headers)
+            resp = conn.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            self.reply_error(handler, 502, f"upstream error: {e}")
+            return "upstream_error"
+
+        try:
+            handler.send_response(resp.status, resp.reason)
+            for key, value in resp.getheaders():
+                if key.lower() not in HOP_BY_HOP:
+                    handler.send_header(key, value)
+            length = resp.getheader("Content-Length")
+            # Streamed (NDJSON/SSE) responses have no length; re-chunk them as they arrive.
+            chunked = length is None and handler.command != "HEAD"
+            if chunked:
+                handler.send_header("Transfer-Encoding", "chunked")
+            elif length is not None:
+                handler.send_header("Content-Length", length)
+            handler.end_headers()
+            while handler.command != "HEAD":
+                data = resp.read1(65536)
+                if not data:
+                    break
+                if chunked:
+                    handler.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                    handler.wfile.flush()
+                else:
+                    handler.wfile.write(data)
+            if chunked:
+                handler.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            # Client went away mid-stream; nothing left to tell it.
+            handler.close_connection = True
+            return "client_gone"
+        finally:
+            conn.close()
+        return "ok"
 
-    def find_initial_profile_index(self) -> int:
-        configured = self.config.get("initial_profile")
-        if configured:
-            for idx, p in enumerate(self.profiles):
-                if p.name == configured:
-                    return idx
-        return 0
 
-    def fill_cmd(self, cmd: List[str], model: Optional[str] = None, message: Optional[str] = None) -> List[str]:
-        out: List[str] = []
-        for part in cmd:
-            part = part.replace("{model}", model or "")
-            part = part.replace("{message}", message or "")
-            out.append(part)
+@dataclass
+class Span:
+    name: str
+    start: float
+    wall_start: float
+    tid: int
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    children: List["Span"] = field(default_factory=list)
+    end: float = 0.0
+    cpu_self: float = 0.0
+    cpu_children: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return max(self.end - self.start, 0.0)
+
+    @property
+    def cpu_total(self) -> float:
+        return self.cpu_self + self.cpu_children
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "name": self.name,
+            "wall_ms": round(self.duration * 1000, 2),
+            "cpu_ms": round(self.cpu_self * 1000, 2),
+            "child_cpu_ms": round(self.cpu_children * 1000, 2),
+        }
+        if self.attrs:
+            out["attrs"] = self.attrs
+        if self.children:
+            out["children"] = [c.to_dict() for c in self.children]
         return out
 
-    def fill_cmd_with_profile(self, cmd: List[str], profile: ProfileSpec) -> List[str]:
-        out: List[str] = []
-        models_csv = ",".join(profile.models)
-        models_spaced = " ".join(shlex.quote(m) for m in profile.models)
-        for part in cmd:
-            part = part.replace("{profile}", profile.name)
-            part = part.replace("{models_csv}", models_csv)
-            part = part.replace("{models_spaced}", models_spaced)
-            out.append(part)
+    def walk(self) -> List["Span"]:
+        out = [self]
+        for c in self.children:
+            out.extend(c.walk())
         return out
 
-    def memory_usage_percent(self) -> float:
+
+class Tracer:
+    """Nested timing spans per thread: monotonic wall time, thread CPU and waited-for child CPU."""
+
+    def __init__(self) -> None:
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Span]:
+        stack: List[Span] = getattr(self.local, "stack", None) or []
+        self.local.stack = stack
+        sp = Span(
+            name=name,
+            start=time.monotonic(),
+            wall_start=time.time(),
+            tid=threading.get_ident(),
+            attrs=dict(attrs),
+        )
+        if stack:
+            stack[-1].children.append(sp)
+        stack.append(sp)
+        cpu0 = time.thread_time()
+        ru0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield sp
+        except Exception as e:
+            sp.attrs["error"] = str(e)
+            raise
+        finally:
+            ru1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+            sp.end = time.monotonic()
+            sp.cpu_self = time.thread_time() - cpu0
+            # RUSAGE_CHILDREN is process-wide, so concurrent children in other threads can leak in.
+            sp.cpu_children = (ru1.ru_utime + ru1.ru_stime) - (ru0.ru_utime + ru0.ru_stime)
+            stack.pop()
+
+
+def chrome_trace(root: Span) -> Dict[str, Any]:
+    """Chrome trace-event JSON (chrome://tracing, Perfetto) with one complete event per span."""
+    events: List[Dict[str, Any]] = []
+    base_us = root.wall_start * 1e6
+    pid = os.getpid()
+    for sp in root.walk():
+        args = dict(sp.attrs)
+        args["cpu_ms"] = round(sp.cpu_self * 1000, 3)
+        args["child_cpu_ms"] = round(sp.cpu_children * 1000, 3)
+        events.append(
+            {
+                "name": sp.name,
+                "cat": "watchdog",
+                "ph": "X",
+                "ts": base_us + (sp.start - root.start) * 1e6,
+                "dur": sp.duration * 1e6,
+                "pid": pid,
+                "tid": sp.tid,
+                "args": args,
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+@dataclass
+class HTTPResult:
+    status: int
+    body: bytes
+    connect_sec: float
+    response_sec: float
+    reused: bool
+
+
+class HTTPPool:
+    """Keep-alive http.client connections pooled per (scheme, host, port).
+
+    Shared by the health URL probe and webhook delivery. Connect time and request/response
+    time are measured separately so handshakes don't inflate the reported health latency.
+    """
+
+    def __init__(self, telemetry: Optional["Telemetry"] = None, max_idle_per_host: int = 2):
+        self.telemetry = telemetry
+        self.max_idle_per_host = max_idle_per_host
+        self.lock = threading.Lock()
+        self.idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+        self.ssl_context: Optional[ssl.SSLContext] = None
+
+    def new_connection(self, key: Tuple[str, str, int], timeout: float) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if scheme == "https":
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def acquire(self, key: Tuple[str, str, int], timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop(), True
+        return self.new_connection(key, timeout), False
+
+    def release(self, key: Tuple[str, str, int], conn: http.client.HTTPConnection) -> None:
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle_per_host:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 10,
+    ) -> HTTPResult:
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"unsupported url: {url}")
+        key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        conn, reused = self.acquire(key, timeout)
+        while True:
+            try:
+                connect_sec = 0.0
+                if conn.sock is None:
+                    start = time.perf_counter()
+                    conn.timeout = timeout
+                    conn.connect()
+                    connect_sec = time.perf_counter() - start
+                    # Small request/response exchanges; don't let Nagle hold back the next request.
+                    conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                else:
+                    conn.sock.settimeout(timeout)
+                start = time.perf_counter()
+                conn.request(method, path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+                response_sec = time.perf_counter() - start
+            except (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionError) as e:
+                conn.close()
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection; reconnect once.
+                conn, reused = self.new_connection(key, timeout), False
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            break
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self.release(key, conn)
+        if self.telemetry is not None:
+            if connect_sec:
+                self.telemetry.observe("http_connect_seconds", connect_sec, host=key[1])
+            self.telemetry.observe("http_response_seconds", response_sec, host=key[1])
+        return HTTPResult(
+            status=resp.status, body=data, connect_sec=connect_sec, response_sec=response_sec, reused=reused
+        )
+
+    def close(self) -> None:
+        with self.lock:
+            conns = [c for group in self.idle.values() for c in group]
+            self.idle.clear()
+        for conn in conns:
+            conn.close()
+
+
+def atomic_write_json(path: str, payload: Any) -> None:
+    """Write a temp file next to `path`, fsync, then rename over it so readers never see a partial file."""
+    target = Path(path)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            tmp.unlink()
+        raise
+
+
+@dataclass
+class PendingNotification:
+    title: str
+    detail: str
+    created: float
+    attempts: int = 0
+    next_attempt: float = 0.0
+    # Channels still to deliver to after a partial failure; None means all configured channels.
+    channels: Optional[List[str]] = None
+    # Handed to the worker for delivery; put() must not evict it.
+    in_flight: bool = False
+
+
+class NotificationQueue:
+    """Bounded in-process notification queue served by a background worker.
+
+    New messages are coalesced into one digest per coalesce window, failed channels are
+    retried with exponential backoff, and pending messages are spooled to disk so they
+    survive a restart. put() never blocks on delivery.
+    """
+
+    def __init__(
+        self,
+        deliver: Callable[[str, str, Optional[List[str]]], List[str]],
+        log: Callable[..., None],
+        spool_file: Optional[str] = None,
+        coalesce_sec: float = 3.0,
+        max_pending: int = 100,
+        retry_initial_sec: float = 5.0,
+        retry_max_sec: float = 300.0,
+        max_attempts: int = 8,
+    ):
+        self.deliver = deliver
+        self.log = log
+        self.spool_file = spool_file
+        self.coalesce_sec = coalesce_sec
+        self.max_pending = max_pending
+        self.retry_initial_sec = retry_initial_sec
+        self.retry_max_sec = retry_max_sec
+        self.max_attempts = max_attempts
+        self.cond = threading.Condition()
+        self.items: List[PendingNotification] = []
+        self.closed = False
+        self.dirty = False
+        self.dropped = 0
+        self.load()
+        self.thread = threading.Thread(target=self.run, name="wd-notify", daemon=True)
+        self.thread.start()
+
+    def load(self) -> None:
+        if not self.spool_file:
+            return
+        try:
+            with open(self.spool_file, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            self.items = [PendingNotification(**item) for item in raw]
+            for item in self.items:
+                item.in_flight = False
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, TypeError) as e:
+            self.log(f"ignore unreadable notification spool {self.spool_file}: {e}")
+            return
+        if self.items:
+            self.log(f"restored {len(self.items)} pending notifications from {self.spool_file}")
+
+    def save(self) -> None:
+        # Caller holds self.cond.
+        if not self.spool_file:
+            return
+        try:
+            atomic_write_json(self.spool_file, [item.__dict__ for item in self.items])
+        except OSError as e:
+            self.log(f"save notification spool failed: {e}")
+
+    def put(self, title: str, detail: str) -> None:
+        # Only an append under the lock: spooling and delivery happen on the worker thread.
+        with self.cond:
+            if len(self.items) >= self.max_pending:
+                for i, item in enumerate(self.items):
+                    if item.attempts >= 0 and not item.in_flight:
+                        del self.items[i]
+                        self.dropped += 1
+                        break
+                else:
+                    # Everything queued is being delivered right now: the newcomer is the one to go.
+                    self.dropped += 1
+                    return
+            self.items.append(PendingNotification(title=title, detail=detail, created=time.time()))
+            self.dirty = True
+            self.cond.notify()
+
+    def coalesce(self, fresh: List[PendingNotification]) -> PendingNotification:
+        if len(fresh) == 1:
+            return fresh[0]
+        lines = [f"- {n.title}: {n.detail}" for n in fresh]
+        return PendingNotification(
+            title=f"[Watchdog] {len(fresh)} events",
+            detail="\n".join(lines),
+            created=fresh[0].created,
+        )
+
+    def next_batch(self) -> Optional[List[PendingNotification]]:
+        """Wait until something is due; returns None once closed and drained of due work."""
+        with self.cond:
+            while True:
+                if self.closed:
+                    return None
+                if self.dropped:
+                    self.log(f"notification queue full, dropped {self.dropped} oldest")
+                    self.dropped = 0
+                if self.dirty:
+                    self.save()
+                    self.dirty = False
+                now = time.time()
+                wait: Optional[float] = None
+                fresh = [n for n in self.items if n.attempts == 0]
+                if fresh:
+                    ready_at = fresh[0].created + self.coalesce_sec
+                    if now >= ready_at:
+                        digest = self.coalesce(fresh)
+                        self.items = [n for n in self.items if n.attempts > 0] + [digest]
+                        # attempts=-1 keeps later arrivals out of this digest's window.
+                        digest.attempts = -1
+                        digest.in_flight = True
+                        self.save()
+                        return [digest]
+                    wait = ready_at - now
+                due = [n for n in self.items if n.attempts > 0 and n.next_attempt <= now]
+                if due:
+                    for n in due:
+                        n.in_flight = True
+                    return due
+                retry_at = [n.next_attempt for n in self.items if n.attempts > 0]
+                if retry_at:
+                    wait = min(wait if wait is not None else float("inf"), min(retry_at) - now)
+                self.cond.wait(timeout=wait)
+
+    def run(self) -> None:
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            for item in batch:
+                try:
+                    failed = self.deliver(item.title, item.detail, item.channels)
+                except Exception as e:  # noqa: BLE001
+                    self.log(f"notification delivery error: {e}")
+                    failed = item.channels or ["*"]
+                with self.cond:
+                    item.in_flight = False
+                    item.attempts = max(item.attempts, 0) + 1
+                    if not failed:
+                        self.discard(item)
+                    elif item.attempts >= self.max_attempts:
+                        self.discard(item)
+                        self.log(f"notification dropped after {item.attempts} attempts: {item.title}")
+                    else:
+                        item.channels = None if failed == ["*"] else failed
+                        delay = min(self.retry_initial_sec * 2 ** (item.attempts - 1), self.retry_max_sec)
+                        item.next_attempt = time.time() + delay
+                        self.log(f"notification retry {item.attempts} in {delay:.0f}s via {','.join(failed)}")
+                    self.save()
+
+    def discard(self, item: PendingNotification) -> None:
+        # Caller holds self.cond. By identity: equal-looking notifications are distinct entries.
+        self.items = [n for n in self.items if n is not item]
+
+    def close(self, timeout: float = 5.0) -> None:
+        with self.cond:
+            self.closed = True
+            for item in self.items:
+                # An interrupted delivery is retried on the next start.
+                item.in_flight = False
+                if item.attempts < 0:
+                    item.attempts = 0
+            self.save()
+            self.cond.notify()
+        self.thread.join(timeout=timeout)
+
+
+def host_memory_bytes() -> int:
+    return int(os.sysconf("SC_PAGE_SIZE")) * int(os.sysconf("SC_PHYS_PAGES"))
+
+
+class MemorySampler(abc.ABC):
+    """Returns system (or cgroup) memory usage as a percentage; one instance is reused per tick."""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def percent(self) -> float:
+        """Memory in use, 0-100."""
+
+    def total_bytes(self) -> int:
+        return host_memory_bytes()
+
+    def close(self) -> None:
+        pass
+
+
+class LegacyMemorySampler(MemorySampler):
+    """Original implementation: re-parse /proc/meminfo or fork vm_stat on every call."""
+
+    name = "legacy"
+
+    def percent(self) -> float:
         # Linux path
         meminfo = Path("/proc/meminfo")
         if meminfo.exists():
@@ -194,129 +1155,2268 @@ class Watchdog:
 
         raise RuntimeError("Cannot determine memory usage on this system")
 
-    def health_ok(self) -> bool:
-        hc = self.config.get("health_check", {})
 
-        cmd = hc.get("command")
-        if cmd:
-            res = self.run_command(cmd, timeout=int(hc.get("timeout_sec", 15)))
-            if res.returncode != 0:
-                self.log(f"health command failed rc={res.returncode}, stderr={res.stderr.strip()}")
-                return False
+def read_field_int(buf: bytearray, size: int, key: bytes) -> int:
+    """Parse the integer after `key` in a meminfo/memory.stat style buffer without splitting lines."""
+    pos = buf.find(key, 0, size)
+    if pos < 0:
+        raise RuntimeError(f"field {key.decode()} not found")
+    pos += len(key)
+    while pos < size and buf[pos] in b" \t:":
+        pos += 1
+    value = 0
+    while pos < size and 48 <= buf[pos] <= 57:
+        value = value * 10 + buf[pos] - 48
+        pos += 1
+    return value
 
-        url = hc.get("url")
-        if url:
-            timeout = int(hc.get("timeout_sec", 15))
-            method = hc.get("method", "GET").upper()
-            req = urllib.request.Request(url=url, method=method)
-            try:
-                with urllib.request.urlopen(req, timeout=timeout) as resp:
-                    code = getattr(resp, "status", 200)
-                    if code >= 400:
-                        self.log(f"health url failed status={code}")
-                        return False
-            except Exception as e:  # noqa: BLE001
-                self.log(f"health url exception: {e}")
-                return False
 
-        return True
+class PreadFile:
+    """Keeps a procfs/sysfs file open and re-reads it from offset 0 into a reused buffer."""
 
-    def notify(self, title: str, detail: str) -> None:
-        message = f"{title}\n{detail}"
-        ncfg = self.config.get("notification", {})
+    def __init__(self, path: str, bufsize: int = 8192):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
 
-        webhook = ncfg.get("webhook_url")
-        if webhook:
-            data = json.dumps({"text": message}).encode("utf-8")
-            req = urllib.request.Request(
-                url=webhook,
-                data=data,
-                headers={"Content-Type": "application/json"},
-                method="POST",
-            )
-            try:
-                if self.dry_run:
-                    self.log(f"[DRY-RUN] webhook POST to {webhook}: {message}")
-                else:
-                    urllib.request.urlopen(req, timeout=10).read()
-            except urllib.error.URLError as e:
-                self.log(f"notify webhook failed: {e}")
+    def read(self) -> int:
+        # preadv fills the existing buffer; os.pread would allocate a new bytes object per call.
+        size = os.preadv(self.fd, [self.view], 0)
+        if size == len(self.buf):
+            # A bytearray cannot grow while a memoryview of it is alive.
+            self.view.release()
+            self.buf.extend(bytes(len(self.buf)))
+            self.view = memoryview(self.buf)
+            return self.read()
+        return size
 
-        cmd = ncfg.get("command")
-        if cmd:
-            formatted = self.fill_cmd(cmd, message=message)
-            res = self.run_command(formatted, timeout=20)
-            if res.returncode != 0:
-                self.log(f"notify command failed rc={res.returncode}, stderr={res.stderr.strip()}")
+    def close(self) -> None:
+        self.view.release()
+        os.close(self.fd)
 
-    def current_model(self) -> ModelSpec:
-        return self.models[self.state.current_model_index]
 
-    def current_profile(self) -> ProfileSpec:
-        return self.profiles[self.state.current_profile_index]
+class ProcMeminfoSampler(MemorySampler):
+    name = "proc_meminfo"
 
-    def pick_target_model_index(self, reason: str) -> int:
-        cur = self.state.current_model_index
+    def __init__(self, path: str = "/proc/meminfo"):
+        self.file = PreadFile(path)
+        size = self.file.read()
+        self.total_kb = read_field_int(self.file.buf, size, b"MemTotal:")
+        if self.total_kb <= 0:
+            raise RuntimeError("MemTotal is zero")
 
-        # On memory overload, prefer moving to the lightest model to quickly lower pressure.
-        if reason == "memory_overload" and self.prefer_lower_memory_on_overload:
-            with_ram: List[Tuple[int, float]] = []
-            for idx, model in enumerate(self.models):
-                if model.ram_gb is not None:
-                    with_ram.append((idx, model.ram_gb))
-            if with_ram:
-                lightest_idx, _ = sorted(with_ram, key=lambda p: p[1])[0]
-                if lightest_idx != cur:
-                    return lightest_idx
+    def percent(self) -> float:
+        size = self.file.read()
+        available = read_field_int(self.file.buf, size, b"MemAvailable:")
+        return (1 - available / self.total_kb) * 100
 
-        return (cur + 1) % len(self.models)
+    def close(self) -> None:
+        self.file.close()
 
-    def pick_target_profile_index(self, reason: str) -> int:
-        cur = self.state.current_profile_index
-        if reason == "memory_overload" and self.prefer_lower_memory_on_overload:
-            cur_ram = self.current_profile().ram_gb
-            if cur_ram is not None:
-                candidates: List[Tuple[int, float]] = []
+
+class CgroupV2Sampler(MemorySampler):
+    """memory.current minus reclaimable page cache, against memory.max (or host RAM when unlimited)."""
+
+    name = "cgroup_v2"
+
+    def __init__(self, cgroup_dir: Optional[str] = None):
+        base = Path(cgroup_dir) if cgroup_dir else self.detect_dir()
+        max_raw = (base / "memory.max").read_text(encoding="utf-8").strip()
+        if max_raw == "max":
+            self.limit_bytes = host_memory_bytes()
+        else:
+            self.limit_bytes = int(max_raw)
+        if self.limit_bytes <= 0:
+            raise RuntimeError("cgroup memory.max is zero")
+        self.limited = max_raw != "max"
+        self.current = PreadFile(str(base / "memory.current"), bufsize=64)
+        self.stat = PreadFile(str(base / "memory.stat"))
+
+    @staticmethod
+    def detect_dir() -> Path:
+        root = Path("/sys/fs/cgroup")
+        rel = ""
+        try:
+            for line in Path("/proc/self/cgroup").read_text(encoding="utf-8").splitlines():
+                if line.startswith("0::"):
+                    rel = line[3:].strip().lstrip("/")
+                    break
+        except OSError:
+            pass
+        for cand in (root / rel, root):
+            if (cand / "memory.current").exists() and (cand / "memory.max").exists():
+                return cand
+        raise RuntimeError("cgroup v2 memory controller not found")
+
+    def percent(self) -> float:
+        size = self.current.read()
+        usage = read_field_int(self.current.buf, size, b"")
+        size = self.stat.read()
+        inactive_file = read_field_int(self.stat.buf, size, b"inactive_file ")
+        return max(usage - inactive_file, 0) / self.limit_bytes * 100
+
+    def total_bytes(self) -> int:
+        return self.limit_bytes
+
+    def close(self) -> None:
+        self.current.close()
+        self.stat.close()
+
+
+class DarwinHostStatsSampler(MemorySampler):
+    """Calls host_statistics64(HOST_VM_INFO64) through ctypes instead of forking vm_stat."""
+
+    name = "darwin_host_statistics64"
+    HOST_VM_INFO64 = 4
+
+    def __init__(self) -> None:
+        import ctypes
+        import ctypes.util
+
+        class VMStatistics64(ctypes.Structure):
+            _fields_ = [
+                ("free_count", ctypes.c_uint32),
+                ("active_count", ctypes.c_uint32),
+                ("inactive_count", ctypes.c_uint32),
+                ("wire_count", ctypes.c_uint32),
+                ("zero_fill_count", ctypes.c_uint64),
+                ("reactivations", ctypes.c_uint64),
+                ("pageins", ctypes.c_uint64),
+                ("pageouts", ctypes.c_uint64),
+                ("faults", ctypes.c_uint64),
+                ("cow_faults", ctypes.c_uint64),
+                ("lookups", ctypes.c_uint64),
+                ("hits", ctypes.c_uint64),
+                ("purges", ctypes.c_uint64),
+                ("purgeable_count", ctypes.c_uint32),
+                ("speculative_count", ctypes.c_uint32),
+                ("decompressions", ctypes.c_uint64),
+                ("compressions", ctypes.c_uint64),
+                ("swapins", ctypes.c_uint64),
+                ("swapouts", ctypes.c_uint64),
+                ("compressor_page_count", ctypes.c_uint32),
+                ("throttled_count", ctypes.c_uint32),
+                ("external_page_count", ctypes.c_uint32),
+                ("internal_page_count", ctypes.c_uint32),
+                ("total_uncompressed_pages_in_compressor", ctypes.c_uint64),
+            ]
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "/usr/lib/libSystem.B.dylib")
+        libc.mach_host_self.restype = ctypes.c_uint32
+        libc.host_statistics64.argtypes = [
+            ctypes.c_uint32,
+            ctypes.c_int,
+            ctypes.POINTER(VMStatistics64),
+            ctypes.POINTER(ctypes.c_uint32),
+        ]
+        libc.host_statistics64.restype = ctypes.c_int
+        self.ctypes = ctypes
+        self.libc = libc
+        # mach_host_self() adds a port reference per call, so take it once.
+        self.host = libc.mach_host_self()
+        self.info = VMStatistics64()
+        self.info_ptr = ctypes.pointer(self.info)
+        self.count_full = ctypes.sizeof(VMStatistics64) // 4
+        self.count = ctypes.c_uint32(self.count_full)
+        self.count_ptr = ctypes.byref(self.count)
+        self.page_size = int(os.sysconf("SC_PAGE_SIZE"))
+        self.mem_total = int(os.sysconf("SC_PHYS_PAGES")) * self.page_size
+        self.percent()
+
+    def percent(self) -> float:
+        self.count.value = self.count_full
+        kr = self.libc.host_statistics64(self.host, self.HOST_VM_INFO64, self.info_ptr, self.count_ptr)
+        if kr != 0:
+            raise RuntimeError(f"host_statistics64 failed kr={kr}")
+        info = self.info
+        # vm_stat prints "Pages free" as free_count - speculative_count, so free+speculative+inactive
+        # from the legacy parser equals free_count + inactive_count here.
+        free_like = info.free_count + info.inactive_count
+        used = max(self.mem_total - free_like * self.page_size, 0)
+        return used / self.mem_total * 100
+
+
+def create_memory_sampler(kind: str = "auto", cgroup_dir: Optional[str] = None) -> MemorySampler:
+    kind = (kind or "auto").lower()
+    if kind == "legacy":
+        return LegacyMemorySampler()
+    if kind == "proc_meminfo":
+        return ProcMeminfoSampler()
+    if kind == "cgroup_v2":
+        return CgroupV2Sampler(cgroup_dir)
+    if kind == "darwin":
+        return DarwinHostStatsSampler()
+    if kind != "auto":
+        raise ValueError(f"unknown memory_sampler: {kind}")
+
+    if platform.system() == "Darwin":
+        try:
+            return DarwinHostStatsSampler()
+        except (OSError, AttributeError, RuntimeError):
+            return LegacyMemorySampler()
+    try:
+        sampler = CgroupV2Sampler()
+        # Only prefer the cgroup view when the container actually has a memory limit.
+        if sampler.limited:
+            return sampler
+        sampler.close()
+    except (OSError, RuntimeError, ValueError):
+        pass
+    try:
+        return ProcMeminfoSampler()
+    except (OSError, RuntimeError):
+        return LegacyMemorySampler()
+
+
+def bench_memory_samplers(kind: str, iterations: int, cgroup_dir: Optional[str] = None) -> List[Tuple[str, float]]:
+    """Mean microseconds per sample for the legacy path and the selected backend."""
+    results: List[Tuple[str, float]] = []
+    for sampler in (LegacyMemorySampler(), create_memory_sampler(kind, cgroup_dir)):
+        sampler.percent()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            sampler.percent()
+        results.append((sampler.name, (time.perf_counter() - start) / iterations * 1e6))
+        sampler.close()
+    return results
+
+
+@dataclass
+class ProcInfo:
+    pid: int
+    ppid: int
+    comm: str
+
+
+@dataclass
+class RSSSnapshot:
+    total_bytes: int = 0
+    per_model: Dict[str, int] = field(default_factory=dict)
+    unattributed_bytes: int = 0
+    pids: List[int] = field(default_factory=list)
+
+
+class ProcessTable(abc.ABC):
+    """Minimal process listing: (pid, ppid, comm), argv and resident bytes."""
+
+    @abc.abstractmethod
+    def processes(self) -> List[ProcInfo]:
+        """Every process visible to us."""
+
+    @abc.abstractmethod
+    def cmdline(self, pid: int) -> List[str]:
+        """argv of `pid`, or [] if it is gone or unreadable."""
+
+    @abc.abstractmethod
+    def rss_bytes(self, pid: int) -> int:
+        """Resident bytes of `pid`, or 0 if it is gone."""
+
+
+class LinuxProcessTable(ProcessTable):
+    def __init__(self) -> None:
+        self.page_size = int(os.sysconf("SC_PAGE_SIZE"))
+
+    def processes(self) -> List[ProcInfo]:
+        out: List[ProcInfo] = []
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "rb") as f:
+                    raw = f.read()
+            except OSError:
+                continue
+            # comm is parenthesised and may itself contain spaces or ')'.
+            lpar = raw.find(b"(")
+            rpar = raw.rfind(b")")
+            fields = raw[rpar + 2 :].split(b" ", 2)
+            out.append(
+                ProcInfo(pid=int(entry), ppid=int(fields[1]), comm=raw[lpar + 1 : rpar].decode("utf-8", "replace"))
+            )
+        return out
+
+    def cmdline(self, pid: int) -> List[str]:
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                raw = f.read()
+        except OSError:
+            return []
+        return [a.decode("utf-8", "replace") for a in raw.split(b"\0") if a]
+
+    def rss_bytes(self, pid: int) -> int:
+        try:
+            with open(f"/proc/{pid}/statm", "rb") as f:
+                return int(f.read().split()[1]) * self.page_size
+        except (OSError, IndexError, ValueError):
+            return 0
+
+
+class DarwinProcessTable(ProcessTable):
+    """libproc + sysctl(KERN_PROCARGS2) through ctypes, no ps fork."""
+
+    PROC_PIDTBSDINFO = 3
+    PROC_PIDTASKINFO = 4
+    CTL_KERN = 1
+    KERN_ARGMAX = 8
+    KERN_PROCARGS2 = 49
+
+    def __init__(self) -> None:
+        import ctypes
+        import ctypes.util
+
+        class ProcBSDInfo(ctypes.Structure):
+            _fields_ = [
+                ("pbi_flags", ctypes.c_uint32),
+                ("pbi_status", ctypes.c_uint32),
+                ("pbi_xstatus", ctypes.c_uint32),
+                ("pbi_pid", ctypes.c_uint32),
+                ("pbi_ppid", ctypes.c_uint32),
+                ("pbi_uid", ctypes.c_uint32),
+                ("pbi_gid", ctypes.c_uint32),
+                ("pbi_ruid", ctypes.c_uint32),
+                ("pbi_rgid", ctypes.c_uint32),
+                ("pbi_svuid", ctypes.c_uint32),
+                ("pbi_svgid", ctypes.c_uint32),
+                ("rfu_1", ctypes.c_uint32),
+                ("pbi_comm", ctypes.c_char * 16),
+                ("pbi_name", ctypes.c_char * 32),
+                ("pbi_nfiles", ctypes.c_uint32),
+                ("pbi_pgid", ctypes.c_uint32),
+                ("pbi_pjobc", ctypes.c_uint32),
+                ("e_tdev", ctypes.c_uint32),
+                ("e_tpgid", ctypes.c_uint32),
+                ("pbi_nice", ctypes.c_int32),
+                ("pbi_start_tvsec", ctypes.c_uint64),
+                ("pbi_start_tvusec", ctypes.c_uint64),
+            ]
+
+        class ProcTaskInfo(ctypes.Structure):
+            _fields_ = [
+                ("pti_virtual_size", ctypes.c_uint64),
+                ("pti_resident_size", ctypes.c_uint64),
+                ("pti_total_user", ctypes.c_uint64),
+                ("pti_total_system", ctypes.c_uint64),
+                ("pti_threads_user", ctypes.c_uint64),
+                ("pti_threads_system", ctypes.c_uint64),
+            ] + [
+                (name, ctypes.c_int32)
+                for name in (
+                    "pti_policy",
+                    "pti_faults",
+                    "pti_pageins",
+                    "pti_cow_faults",
+                    "pti_messages_sent",
+                    "pti_messages_received",
+                    "pti_syscalls_mach",
+                    "pti_syscalls_unix",
+                    "pti_csw",
+                    "pti_threadnum",
+                    "pti_numrunning",
+                    "pti_priority",
+                )
+            ]
+
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "/usr/lib/libSystem.B.dylib", use_errno=True)
+        self.bsdinfo = ProcBSDInfo()
+        self.taskinfo = ProcTaskInfo()
+        self.pid_buf = (ctypes.c_int * 4096)()
+        argmax = ctypes.c_int(0)
+        size = ctypes.c_size_t(ctypes.sizeof(argmax))
+        mib = (ctypes.c_int * 2)(self.CTL_KERN, self.KERN_ARGMAX)
+        if self.libc.sysctl(mib, 2, ctypes.byref(argmax), ctypes.byref(size), None, 0) != 0:
+            raise OSError(ctypes.get_errno(), "sysctl(KERN_ARGMAX) failed")
+        self.args_buf = ctypes.create_string_buffer(argmax.value)
+
+    def processes(self) -> List[ProcInfo]:
+        ctypes = self.ctypes
+        n = self.libc.proc_listallpids(self.pid_buf, ctypes.sizeof(self.pid_buf))
+        if n >= len(self.pid_buf):
+            self.pid_buf = (ctypes.c_int * (n * 2))()
+            return self.processes()
+        out: List[ProcInfo] = []
+        size = ctypes.sizeof(self.bsdinfo)
+        for i in range(max(n, 0)):
+            pid = self.pid_buf[i]
+            if pid <= 0:
+                continue
+            if self.libc.proc_pidinfo(pid, self.PROC_PIDTBSDINFO, 0, ctypes.byref(self.bsdinfo), size) != size:
+                continue
+            info = self.bsdinfo
+            comm = (info.pbi_name or info.pbi_comm).decode("utf-8", "replace")
+            out.append(ProcInfo(pid=pid, ppid=int(info.pbi_ppid), comm=comm))
+        return out
+
+    def cmdline(self, pid: int) -> List[str]:
+        ctypes = self.ctypes
+        mib = (ctypes.c_int * 3)(self.CTL_KERN, self.KERN_PROCARGS2, pid)
+        size = ctypes.c_size_t(len(self.args_buf))
+        if self.libc.sysctl(mib, 3, self.args_buf, ctypes.byref(size), None, 0) != 0:
+            return []
+        raw = self.args_buf.raw[: size.value]
+        argc = int.from_bytes(raw[:4], sys.byteorder)
+        # Layout: argc, exec path, NUL padding, then argc NUL-terminated argv strings.
+        parts = [p for p in raw[4:].split(b"\0") if p]
+        return [p.decode("utf-8", "replace") for p in parts[1 : 1 + argc]]
+
+    def rss_bytes(self, pid: int) -> int:
+        ctypes = self.ctypes
+        size = ctypes.sizeof(self.taskinfo)
+        if self.libc.proc_pidinfo(pid, self.PROC_PIDTASKINFO, 0, ctypes.byref(self.taskinfo), size) != size:
+            return 0
+        return int(self.taskinfo.pti_resident_size)
+
+
+def ollama_blob_models(models_dir: Path) -> Dict[str, str]:
+    """Map ollama blob file names (sha256-<hex>) to model names like 'qwen3-vl:4b' from manifests."""
+    out: Dict[str, str] = {}
+    root = models_dir / "manifests"
+    if not root.is_dir():
+        return out
+    for manifest in root.glob("*/*/*/*"):
+        if not manifest.is_file():
+            continue
+        registry, namespace, repo, tag = manifest.parts[-4:]
+        name = f"{repo}:{tag}" if namespace == "library" else f"{namespace}/{repo}:{tag}"
+        try:
+            doc = json.loads(manifest.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        for layer in doc.get("layers", []):
+            if layer.get("mediaType") == "application/vnd.ollama.image.model":
+                out[layer.get("digest", "").replace(":", "-")] = name
+    return out
+
+
+class ProcessRSSCollector:
+    """Finds OpenClaw/Ollama processes and their descendants and attributes resident memory to models."""
+
+    def __init__(
+        self,
+        process_names: List[str],
+        model_names: List[str],
+        ollama_models_dir: Optional[str] = None,
+        table: Optional[ProcessTable] = None,
+    ):
+        self.process_names = [n.lower() for n in process_names]
+        self.model_names = model_names
+        self.table = table or (DarwinProcessTable() if platform.system() == "Darwin" else LinuxProcessTable())
+        models_dir = ollama_models_dir or os.environ.get("OLLAMA_MODELS") or str(Path.home() / ".ollama" / "models")
+        self.ollama_models_dir = Path(models_dir).expanduser()
+        self.blob_models: Dict[str, str] = {}
+        self.blob_models_mtime = -1.0
+        self.cmdline_cache: Dict[int, Optional[str]] = {}
+
+    def refresh_blob_models(self) -> None:
+        try:
+            mtime = (self.ollama_models_dir / "manifests").stat().st_mtime
+        except OSError:
+            return
+        if mtime != self.blob_models_mtime:
+            self.blob_models = ollama_blob_models(self.ollama_models_dir)
+            self.blob_models_mtime = mtime
+
+    def attribute(self, pid: int) -> Optional[str]:
+        if pid in self.cmdline_cache:
+            return self.cmdline_cache[pid]
+        argv = self.table.cmdline(pid)
+        model: Optional[str] = None
+        joined = " ".join(argv)
+        for name in self.model_names:
+            if name in joined:
+                model = name
+                break
+        if model is None:
+            for i, arg in enumerate(argv):
+                if arg == "--model" and i + 1 < len(argv):
+                    model = self.blob_models.get(Path(argv[i + 1]).name)
+                    break
+        self.cmdline_cache[pid] = model
+        return model
+
+    def collect(self) -> RSSSnapshot:
+        self.refresh_blob_models()
+        procs = self.table.processes()
+        children: Dict[int, List[int]] = {}
+        roots: List[int] = []
+        for p in procs:
+            children.setdefault(p.ppid, []).append(p.pid)
+            if any(name in p.comm.lower() for name in self.process_names):
+                roots.append(p.pid)
+
+        seen: Set[int] = set()
+        stack = list(roots)
+        while stack:
+            pid = stack.pop()
+            if pid in seen:
+                continue
+            seen.add(pid)
+            stack.extend(children.get(pid, []))
+
+        # Drop cached attributions for pids that exited so reused pids get re-read.
+        for pid in list(self.cmdline_cache):
+            if pid not in seen:
+                del self.cmdline_cache[pid]
+
+        snap = RSSSnapshot(pids=sorted(seen))
+        for pid in snap.pids:
+            rss = self.table.rss_bytes(pid)
+            snap.total_bytes += rss
+            model = self.attribute(pid)
+            if model is None:
+                snap.unattributed_bytes += rss
+            else:
+                snap.per_model[model] = snap.per_model.get(model, 0) + rss
+        return snap
+
+
+EVENT_CODES = {
+    "": 0,
+    "memory_overload": 1,
+    "memory_trend": 2,
+    "health_ok": 3,
+    "health_fail": 4,
+    "recovery_ok": 5,
+    "recovery_failed": 6,
+    "emergency_fallback": 7,
+    "memory_upgrade": 8,
+}
+EVENT_NAMES = {code: name for name, code in EVENT_CODES.items()}
+
+
+@dataclass
+class MetricBucket:
+    """Running min/max/avg aggregate for one downsampling bucket."""
+
+    start: float
+    mem_n: int = 0
+    mem_min: float = 0.0
+    mem_max: float = 0.0
+    mem_sum: float = 0.0
+    lat_n: int = 0
+    lat_max: float = 0.0
+    lat_sum: float = 0.0
+    events: int = 0
+
+    def add_sample(self, mem: float, latency_ms: float, event: int) -> None:
+        if mem == mem:  # NaN means "no memory reading in this record"
+            self.add_mem(1, mem, mem, mem)
+        if latency_ms == latency_ms:
+            self.add_latency(1, latency_ms, latency_ms)
+        if event and event != EVENT_CODES["health_ok"]:
+            self.events += 1
+
+    def add_mem(self, n: int, lo: float, hi: float, total: float) -> None:
+        if n <= 0:
+            return
+        if self.mem_n == 0:
+            self.mem_min, self.mem_max = lo, hi
+        else:
+            self.mem_min = min(self.mem_min, lo)
+            self.mem_max = max(self.mem_max, hi)
+        self.mem_n += n
+        self.mem_sum += total
+
+    def add_latency(self, n: int, hi: float, total: float) -> None:
+        if n <= 0:
+            return
+        self.lat_max = max(self.lat_max, hi) if self.lat_n else hi
+        self.lat_n += n
+        self.lat_sum += total
+
+
+class MetricsStore:
+    """Fixed-record, mmap-backed ring file of raw samples plus 1-minute and 1-hour min/max/avg tiers.
+
+    Layout: 64-byte header (magic, version, capacity/head/count per tier) followed by the three
+    rings. Queries binary-search the time-ordered rings and only touch the requested range.
+    """
+
+    MAGIC = b"WDTS"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHH" + "III" * 3)
+    HEADER_SIZE = 64
+    RAW = struct.Struct("<dffhH")  # ts, memory %, health latency ms, profile index, event code
+    BUCKET = struct.Struct("<dIfffIffI")  # ts, mem n/min/max/avg, latency n/max/avg, events
+    TIER_WIDTHS = (0.0, 60.0, 3600.0)
+
+    def __init__(self, path: str, capacities: Tuple[int, int, int] = (200_000, 129_600, 17_520), readonly: bool = False):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.readonly = readonly
+        self.record_sizes = (self.RAW.size, self.BUCKET.size, self.BUCKET.size)
+        if self.path.exists():
+            with open(self.path, "rb") as f:
+                header = f.read(self.HEADER.size)
+            fields = self.HEADER.unpack(header) if len(header) == self.HEADER.size else None
+            if fields is None or fields[0] != self.MAGIC or fields[1] != self.VERSION:
+                raise ValueError(f"{self.path} is not a watchdog metrics file")
+            capacities = (fields[3], fields[6], fields[9])
+        elif readonly:
+            raise FileNotFoundError(str(self.path))
+        self.capacities = capacities
+        self.offsets = []
+        offset = self.HEADER_SIZE
+        for cap, size in zip(capacities, self.record_sizes):
+            self.offsets.append(offset)
+            offset += cap * size
+        file_size = offset
+
+        if readonly:
+            self.fd = os.open(self.path, os.O_RDONLY)
+            self.mm = mmap.mmap(self.fd, file_size, access=mmap.ACCESS_READ)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(self.fd).st_size < file_size:
+                os.ftruncate(self.fd, file_size)
+            self.mm = mmap.mmap(self.fd, file_size)
+        self.heads = [0, 0, 0]
+        self.counts = [0, 0, 0]
+        header = self.HEADER.unpack_from(self.mm, 0)
+        if header[0] == self.MAGIC:
+            self.heads = [header[4], header[7], header[10]]
+            self.counts = [header[5], header[8], header[11]]
+        elif not readonly:
+            self.write_header()
+
+        self.buckets: List[Optional[MetricBucket]] = [None, None, None]
+        if not readonly:
+            self.rebuild_accumulators()
+
+    def write_header(self) -> None:
+        fields: List[Any] = [self.MAGIC, self.VERSION, 0]
+        for tier in range(3):
+            fields += [self.capacities[tier], self.heads[tier], self.counts[tier]]
+        self.HEADER.pack_into(self.mm, 0, *fields)
+
+    def physical(self, tier: int, logical: int) -> int:
+        cap = self.capacities[tier]
+        return (self.heads[tier] - self.counts[tier] + logical) % cap
+
+    def ts_at(self, tier: int, logical: int) -> float:
+        pos = self.offsets[tier] + self.physical(tier, logical) * self.record_sizes[tier]
+        return struct.unpack_from("<d", self.mm, pos)[0]
+
+    def bisect(self, tier: int, ts: float) -> int:
+        """First logical index whose timestamp is >= ts."""
+        lo, hi = 0, self.counts[tier]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts_at(tier, mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def iter_range(self, tier: int, lo: int, hi: int) -> Any:
+        """Unpack logical records [lo, hi) in at most two contiguous slices of the ring."""
+        size = self.record_sizes[tier]
+        fmt = self.RAW if tier == 0 else self.BUCKET
+        cap = self.capacities[tier]
+        while lo < hi:
+            start = self.physical(tier, lo)
+            n = min(hi - lo, cap - start)
+            base = self.offsets[tier] + start * size
+            yield from fmt.iter_unpack(self.mm[base : base + n * size])
+            lo += n
+
+    def put(self, tier: int, payload: bytes) -> None:
+        pos = self.offsets[tier] + self.heads[tier] * self.record_sizes[tier]
+        self.mm[pos : pos + len(payload)] = payload
+        self.heads[tier] = (self.heads[tier] + 1) % self.capacities[tier]
+        self.counts[tier] = min(self.counts[tier] + 1, self.capacities[tier])
+
+    def put_bucket(self, tier: int, b: MetricBucket) -> None:
+        self.put(
+            tier,
+            self.BUCKET.pack(
+                b.start,
+                b.mem_n,
+                b.mem_min,
+                b.mem_max,
+                b.mem_sum / b.mem_n if b.mem_n else float("nan"),
+                b.lat_n,
+                b.lat_max,
+                b.lat_sum / b.lat_n if b.lat_n else float("nan"),
+                b.events,
+            ),
+        )
+
+    def roll(self, tier: int, ts: float) -> MetricBucket:
+        """Return the open bucket of `tier` covering ts, closing and cascading the previous one."""
+        width = self.TIER_WIDTHS[tier]
+        start = ts - ts % width
+        cur = self.buckets[tier]
+        if cur is not None and cur.start == start:
+            return cur
+        if cur is not None and (cur.mem_n or cur.lat_n or cur.events):
+            self.put_bucket(tier, cur)
+            if tier + 1 < len(self.TIER_WIDTHS):
+                parent = self.roll(tier + 1, cur.start)
+                parent.add_mem(cur.mem_n, cur.mem_min, cur.mem_max, cur.mem_sum)
+                parent.add_latency(cur.lat_n, cur.lat_max, cur.lat_sum)
+                parent.events += cur.events
+        self.buckets[tier] = MetricBucket(start=start)
+        return self.buckets[tier]
+
+    def rebuild_accumulators(self) -> None:
+        """Re-feed records newer than the last closed bucket so a restart doesn't lose partial buckets."""
+        since = self.ts_at(2, self.counts[2] - 1) + 3600.0 if self.counts[2] else 0.0
+        for ts, n, lo_v, hi_v, avg, lat_n, lat_hi, lat_avg, ev in self.iter_range(1, self.bisect(1, since), self.counts[1]):
+            parent = self.roll(2, ts)
+            parent.add_mem(n, lo_v, hi_v, avg * n if n else 0.0)
+            parent.add_latency(lat_n, lat_hi, lat_avg * lat_n if lat_n else 0.0)
+            parent.events += ev
+        since = self.ts_at(1, self.counts[1] - 1) + 60.0 if self.counts[1] else 0.0
+        for ts, mem, lat, _profile, event in self.iter_range(0, self.bisect(0, since), self.counts[0]):
+            self.roll(1, ts).add_sample(mem, lat, event)
+
+    def append(
+        self,
+        ts: float,
+        mem: Optional[float] = None,
+        latency_ms: Optional[float] = None,
+        profile_index: int = -1,
+        event: str = "",
+    ) -> None:
+        code = EVENT_CODES.get(event, 0)
+        mem_v = float("nan") if mem is None else mem
+        lat_v = float("nan") if latency_ms is None else latency_ms
+        with self.lock:
+            self.put(0, self.RAW.pack(ts, mem_v, lat_v, profile_index, code))
+            self.roll(1, ts).add_sample(mem_v, lat_v, code)
+            self.write_header()
+
+    def query(
+        self,
+        start: float,
+        end: float,
+        resolution: str = "auto",
+        percentiles: Tuple[float, ...] = (50, 95, 99),
+        threshold: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        tier = {"raw": 0, "1m": 1, "1h": 2}.get(resolution)
+        if tier is None:
+            # The finest tier that still reaches back to `start` (raw/1m only while the slice is small
+            # enough to sort quickly). A young store covers no window completely; then the finest tier
+            # with records in it wins, and coarse tiers holding nothing yet never shadow raw data.
+            overlapping: Optional[int] = None
+            for candidate in (0, 1, 2):
+                n = self.bisect(candidate, end) - self.bisect(candidate, start)
+                if not n or (candidate < 2 and n > 50_000):
+                    continue
+                if self.ts_at(candidate, 0) <= start:
+                    tier = candidate
+                    break
+                if overlapping is None:
+                    overlapping = candidate
+            if tier is None:
+                tier = overlapping if overlapping is not None else 0
+        lo, hi = self.bisect(tier, start), self.bisect(tier, end)
+
+        mems: List[float] = []
+        lats: List[float] = []
+        mem_max = float("-inf")
+        mem_max_ts = 0.0
+        mem_sum = 0.0
+        mem_n = 0
+        lat_max = 0.0
+        events: Dict[str, int] = {}
+        above_sec = 0.0
+        last_mem_ts: Optional[float] = None
+        last_above = False
+        for rec in self.iter_range(tier, lo, hi):
+            if tier == 0:
+                ts, mem, lat, _profile, code = rec
+                if mem == mem:
+                    mems.append(mem)
+                    mem_sum += mem
+                    mem_n += 1
+                    if mem > mem_max:
+                        mem_max, mem_max_ts = mem, ts
+                    if last_above and last_mem_ts is not None:
+                        # Credit the gap until the next sample, capped so outages don't count as overload.
+                        above_sec += min(ts - last_mem_ts, 60.0)
+                    last_mem_ts = ts
+                    last_above = threshold is not None and mem >= threshold
+                if lat == lat:
+                    lats.append(lat)
+                    lat_max = max(lat_max, lat)
+                if code:
+                    name = EVENT_NAMES.get(code, str(code))
+                    events[name] = events.get(name, 0) + 1
+            else:
+                ts, n, lo_v, hi_v, avg, lat_n, lat_hi, lat_avg, ev = rec
+                if n:
+                    mems.append(avg)
+                    mem_sum += avg * n
+                    mem_n += n
+                    if hi_v > mem_max:
+                        mem_max, mem_max_ts = hi_v, ts
+                    if threshold is not None and hi_v >= threshold:
+                        # Upper bound: the whole bucket counts once its max crossed the threshold.
+                        above_sec += self.TIER_WIDTHS[tier]
+                if lat_n:
+                    lats.append(lat_avg)
+                    lat_max = max(lat_max, lat_hi)
+                if ev:
+                    events["events"] = events.get("events", 0) + ev
+
+        def pct(values: List[float]) -> Dict[str, float]:
+            if not values:
+                return {}
+            values.sort()
+            return {f"p{p:g}": values[min(len(values) - 1, int(len(values) * p / 100))] for p in percentiles}
+
+        return {
+            "resolution": ("raw", "1m", "1h")[tier],
+            "records": hi - lo,
+            "memory_samples": mem_n,
+            "memory_avg": mem_sum / mem_n if mem_n else None,
+            "memory_max": mem_max if mem_n else None,
+            "memory_max_ts": mem_max_ts if mem_n else None,
+            "memory_percentiles": pct(mems),
+            "above_threshold_sec": above_sec,
+            "health_latency_max_ms": lat_max if lats else None,
+            "health_latency_percentiles_ms": pct(lats),
+            "events": events,
+        }
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.readonly:
+                self.mm.flush()
+            self.mm.close()
+            os.close(self.fd)
+
+
+class ModelPlanner:
+    """0/1 knapsack over models: the loadable set with the highest total priority within a RAM budget.
+
+    Sizes are rounded up to resolution_gb so the DP table stays small; results are cached by
+    (budget bucket, candidate models with their sizes and priorities).
+    """
+
+    def __init__(self, bucket_gb: float = 0.5, resolution_gb: float = 0.1, cache_size: int = 256):
+        self.bucket_gb = bucket_gb
+        self.resolution_gb = resolution_gb
+        self.cache_size = cache_size
+        self.cache: Dict[Tuple[int, Tuple[Tuple[str, int, float], ...]], frozenset] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def best(self, budget_gb: float, models: List[Tuple[str, float, float]]) -> frozenset:
+        """`models` holds (name, ram_gb, priority); ties go to the set that uses more RAM."""
+        units = [(name, max(int(-(-ram // self.resolution_gb)), 1), priority) for name, ram, priority in models]
+        # Floor the budget to its bucket so nearby readings share one cached plan.
+        bucket = int(budget_gb // self.bucket_gb) if budget_gb > 0 else -1
+        key = (bucket, tuple(sorted(units)))
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        capacity = int(bucket * self.bucket_gb / self.resolution_gb + 1e-9) if bucket >= 0 else 0
+        # best[c] = (total priority, units used, chosen names) using at most c units.
+        best: List[Tuple[float, int, frozenset]] = [(0.0, 0, frozenset())] * (capacity + 1)
+        for name, size, priority in units:
+            for c in range(capacity, size - 1, -1):
+                value, used, chosen = best[c - size]
+                cand = (value + priority, used + size, chosen | {name})
+                if cand[:2] > best[c][:2]:
+                    best[c] = cand
+        plan = best[capacity][2]
+        if not plan and units:
+            # Never plan an empty server: keep the smallest model.
+            plan = frozenset({min(units, key=lambda u: (u[1], -u[2]))[0]})
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[key] = plan
+        return plan
+
+
+class MemoryTrend:
+    """Fixed-size ring buffer of (monotonic ts, memory %) samples with a least-squares slope."""
+
+    def __init__(self, size: int = 64, window_sec: float = 5.0):
+        self.size = max(size, 3)
+        self.window_sec = window_sec
+        self.ts = [0.0] * self.size
+        self.values = [0.0] * self.size
+        self.head = 0
+        self.count = 0
+
+    def add(self, ts: float, value: float) -> None:
+        self.ts[self.head] = ts
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def latest(self) -> Optional[Tuple[float, float]]:
+        if not self.count:
+            return None
+        idx = (self.head - 1) % self.size
+        return self.ts[idx], self.values[idx]
+
+    def slope(self) -> float:
+        """Percent per second over samples inside window_sec of the newest one; 0.0 if too few."""
+        last = self.latest()
+        if last is None:
+            return 0.0
+        cutoff = last[0] - self.window_sec
+        n = 0
+        sum_t = sum_v = sum_tt = sum_tv = 0.0
+        idx = self.head
+        for _ in range(self.count):
+            idx = (idx - 1) % self.size
+            t = self.ts[idx]
+            if t < cutoff:
+                break
+            # Shift timestamps to the newest sample to keep the sums well conditioned.
+            t -= last[0]
+            v = self.values[idx]
+            n += 1
+            sum_t += t
+            sum_v += v
+            sum_tt += t * t
+            sum_tv += t * v
+        if n < 3:
+            return 0.0
+        denom = n * sum_tt - sum_t * sum_t
+        if denom <= 0:
+            return 0.0
+        return (n * sum_tv - sum_t * sum_v) / denom
+
+    def time_to(self, threshold: float) -> Optional[float]:
+        """Projected seconds until `threshold` is crossed at the current slope, or None if not rising."""
+        last = self.latest()
+        if last is None:
+            return None
+        if last[1] >= threshold:
+            return 0.0
+        rate = self.slope()
+        if rate <= 0:
+            return None
+        return (threshold - last[1]) / rate
+
+
+@dataclass
+class ParsedConfig:
+    """Everything Watchdog.parse_config() derives from a config; Watchdog.apply_config() installs it."""
+
+    config: Dict[str, Any]
+    models: List[ModelSpec]
+    profiles: List[ProfileSpec]
+    commands: Dict[str, CommandTemplate]
+    interval_sec: int
+    memory_threshold_percent: float
+    consecutive_health_fail_limit: int
+    cooldown_sec: int
+    memory_log_mode: str
+    memory_log_delta_percent: float
+    memory_log_heartbeat_sec: float
+    prefer_lower_memory_on_overload: bool
+    incremental_switch: bool
+    planner: Optional[ModelPlanner]
+    planner_headroom_gb: float
+    upgrade_below_percent: float
+    upgrade_after_sec: float
+    readiness_enabled: bool
+    adaptive_enabled: bool
+    min_sample_interval_sec: float
+    max_sample_interval_sec: float
+    near_threshold_percent: float
+    rising_rate_percent_per_sec: float
+    flat_rate_percent_per_sec: float
+    trend_lead_time_sec: float
+    rss_enabled: bool
+    rss_interval_sec: float
+    rss_alpha: float
+    rss_settle_sec: float
+    cache_login_env: bool
+    health_api_url: Optional[str]
+    require_loaded: bool
+    hedge_enabled: bool
+    hedge_window: int
+    hedge_min_samples: int
+    hedge_min_delay_sec: float
+    health_probes: List[HealthProbe]
+
+
+class SystemClock:
+    """Wall/monotonic time and sleeping; the simulator swaps in a virtual clock."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class Watchdog:
+    def __init__(self, config: Dict[str, Any], dry_run: bool = False):
+        self.dry_run = dry_run
+        self.clock: Any = SystemClock()
+        # When set, every command goes through this instead of subprocess (simulation/benchmarks).
+        self.command_runner: Optional[Callable[[List[str], int, str], subprocess.CompletedProcess]] = None
+        self.state = State(current_model_index=0)
+        self.apply_config(self.parse_config(config))
+        self.config_path: Optional[str] = None
+        rlcfg = self.config.get("config_reload", {})
+        self.config_reload_enabled = bool(rlcfg.get("enabled", True))
+        self.config_reload_interval_sec = float(rlcfg.get("interval_sec", 2))
+        self.config_stat: Optional[Tuple[int, int, int]] = None
+        self.next_config_check = 0.0
+        self.log_file = self.config.get("log_file", "watchdog.log")
+        lcfg = self.config.get("logging", {})
+        echo = lcfg.get("stdout", True)
+        self.log_writer = LogWriter(
+            self.log_file,
+            fmt=lcfg.get("format", "text"),
+            echo=sys.stdout.isatty() if echo == "auto" else bool(echo),
+            flush_interval_sec=float(lcfg.get("flush_interval_sec", 1.0)),
+            max_bytes=int(lcfg.get("max_bytes", 5 * 1024 * 1024)),
+            max_age_sec=float(lcfg.get("max_age_sec", 0)),
+            backup_count=int(lcfg.get("backup_count", 3)),
+        )
+        self.last_memory_logged: Optional[float] = None
+        self.last_memory_log_ts = 0.0
+        self.memory_sampler: Optional[MemorySampler] = None
+        self.next_profile_index: Optional[int] = None
+        self.low_since: Optional[float] = None
+        self.proxy: Optional[RequestProxy] = None
+        self.warming_up = False
+
+        acfg = self.config.get("adaptive_sampling", {})
+        self.trend = MemoryTrend(
+            size=int(acfg.get("ring_size", 64)),
+            window_sec=float(acfg.get("window_sec", 3)),
+        )
+        self.sample_interval_sec = self.max_sample_interval_sec
+        self.last_mem_percent: Optional[float] = None
+
+        self.rss_collector: Optional[ProcessRSSCollector] = None
+        self.rss_lock = threading.Lock()
+        self.last_rss: Optional[RSSSnapshot] = None
+        self.last_rss_ts = 0.0
+        # When set, notify() hands messages to this callable instead of delivering inline.
+        self.notify_dispatcher: Optional[Callable[[str, str], None]] = None
+        self.notify_queue: Optional[NotificationQueue] = None
+        qcfg = self.config.get("notification", {}).get("queue", {})
+        if qcfg.get("enabled", True):
+            self.notify_queue = NotificationQueue(
+                self.deliver_notification,
+                self.log,
+                spool_file=qcfg.get("spool_file", "watchdog.notify.json") or None,
+                coalesce_sec=float(qcfg.get("coalesce_sec", 3)),
+                max_pending=int(qcfg.get("max_pending", 100)),
+                retry_initial_sec=float(qcfg.get("retry_initial_sec", 5)),
+                retry_max_sec=float(qcfg.get("retry_max_sec", 300)),
+                max_attempts=int(qcfg.get("max_attempts", 8)),
+            )
+            self.notify_dispatcher = self.notify_queue.put
+
+        self.telemetry = Telemetry()
+        self.tracer = Tracer()
+        self.http = HTTPPool(self.telemetry)
+        self.login_envs: Dict[str, Optional[Dict[str, str]]] = {}
+        self.login_env_lock = threading.Lock()
+        self.probe_latency: Dict[str, collections.deque] = {}
+        self.ps_lock = threading.Lock()
+        self.ps_raw: Optional[bytes] = None
+        self.ps_models: Optional[Set[str]] = None
+        # Probes and their hedge copies get separate pools, so a hedge never queues behind a probe.
+        # Both are sized for the active probes and swapped out (under the lock) when that count changes.
+        self.probe_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.hedge_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.probe_pool_size = 0
+        self.probe_pool_lock = threading.Lock()
+        mcfg = self.config.get("metrics", {})
+        self.metrics: Optional[MetricsStore] = None
+        if mcfg.get("enabled", False):
+            try:
+                self.metrics = MetricsStore(mcfg.get("file", "watchdog.metrics"), metrics_capacities(mcfg))
+            except (OSError, ValueError) as e:
+                # A damaged metrics file must not keep the watchdog itself from starting.
+                self.log(f"metrics disabled, cannot open {mcfg.get('file', 'watchdog.metrics')}: {e}")
+
+        self.state_file = self.config.get("state_file", "watchdog.state.json")
+        self.state_lock = threading.Lock()
+        if self.profiles:
+            self.state.current_profile_index = self.find_initial_profile_index()
+        self.load_state()
+        if self.profiles:
+            self.log(f"profile mode enabled, start profile={self.current_profile().name}")
+
+    def parse_config(self, config: Dict[str, Any]) -> ParsedConfig:
+        """Validate `config` and return the Watchdog attributes it defines, without touching self.
+
+        Raises ValueError (or TypeError) on a bad config; nothing is assigned until the whole config
+        parsed, so a hot reload either lands completely or not at all.
+        """
+        if not isinstance(config, dict):
+            raise ValueError("config must be a JSON object")
+        raw_models = config.get("models", [])
+        raw_profiles = config.get("profiles", [])
+        if not raw_models and not raw_profiles:
+            raise ValueError("config.models must not be empty")
+        models = self.parse_models(raw_models)
+        profiles = self.parse_profiles(raw_profiles, models)
+        interval_sec = int(config.get("interval_sec", 5))
+        threshold = float(config.get("memory_threshold_percent", 90))
+        cooldown_sec = int(config.get("cooldown_sec", 60))
+        if interval_sec <= 0:
+            raise ValueError("interval_sec must be positive")
+        if not 0 < threshold <= 100:
+            raise ValueError("memory_threshold_percent must be in (0, 100]")
+
+        commands: Dict[str, CommandTemplate] = {}
+        for key, (section, name) in COMMAND_PATHS.items():
+            argv = config.get(section, {}).get(name)
+            if argv:
+                commands[key] = CommandTemplate(argv, f"{section}.{name}")
+
+        lcfg = config.get("logging", {})
+        pcfg = config.get("planner", {})
+        planner: Optional[ModelPlanner] = None
+        if pcfg.get("enabled", False) and profiles:
+            planner = ModelPlanner(bucket_gb=float(pcfg.get("ram_bucket_gb", 0.5)))
+        acfg = config.get("adaptive_sampling", {})
+        rcfg = config.get("rss_accounting", {})
+        hc = config.get("health_check", {})
+        health_api_url: Optional[str] = hc.get("api_url")
+        return ParsedConfig(
+            config=config,
+            models=models,
+            profiles=profiles,
+            commands=commands,
+            interval_sec=interval_sec,
+            memory_threshold_percent=threshold,
+            consecutive_health_fail_limit=int(config.get("consecutive_health_fail_limit", 3)),
+            cooldown_sec=cooldown_sec,
+            memory_log_mode=lcfg.get("memory_line", "change"),
+            memory_log_delta_percent=float(lcfg.get("memory_change_percent", 1.0)),
+            memory_log_heartbeat_sec=float(lcfg.get("memory_heartbeat_sec", 300)),
+            prefer_lower_memory_on_overload=bool(config.get("prefer_lower_memory_on_overload", True)),
+            incremental_switch=bool(config.get("incremental_switch", {}).get("enabled", False)),
+            planner=planner,
+            planner_headroom_gb=float(pcfg.get("headroom_gb", 1.0)),
+            upgrade_below_percent=float(pcfg.get("upgrade_below_percent", threshold - 15)),
+            upgrade_after_sec=float(pcfg.get("upgrade_after_sec", 600)),
+            readiness_enabled=bool(config.get("readiness", {}).get("enabled", False)),
+            adaptive_enabled=bool(acfg.get("enabled", False)),
+            min_sample_interval_sec=float(acfg.get("min_interval_sec", 0.25)),
+            max_sample_interval_sec=float(acfg.get("max_interval_sec", interval_sec)),
+            near_threshold_percent=float(acfg.get("near_threshold_percent", 8)),
+            rising_rate_percent_per_sec=float(acfg.get("rising_rate_percent_per_sec", 0.5)),
+            flat_rate_percent_per_sec=float(acfg.get("flat_rate_percent_per_sec", 0.05)),
+            trend_lead_time_sec=float(acfg.get("lead_time_sec", 0)),
+            rss_enabled=bool(rcfg.get("enabled", False)),
+            rss_interval_sec=float(rcfg.get("interval_sec", 30)),
+            rss_alpha=float(rcfg.get("ewma_alpha", 0.3)),
+            rss_settle_sec=float(rcfg.get("settle_sec", cooldown_sec)),
+            cache_login_env=bool(config.get("commands", {}).get("cache_login_env", False)),
+            health_api_url=health_api_url,
+            require_loaded=bool(hc.get("require_loaded", False)),
+            hedge_enabled=bool(hc.get("hedge", True)),
+            hedge_window=int(hc.get("hedge_window", 100)),
+            hedge_min_samples=int(hc.get("hedge_min_samples", 20)),
+            hedge_min_delay_sec=float(hc.get("hedge_min_delay_sec", 0.01)),
+            health_probes=self.parse_health_checks(config, health_api_url),
+        )
+
+    def apply_config(self, parsed: ParsedConfig) -> None:
+        """Install the attributes parse_config() derived (objects built from them are rebuilt by the caller)."""
+        self.config = parsed.config
+        self.models = parsed.models
+        self.profiles = parsed.profiles
+        self.commands = parsed.commands
+        self.interval_sec = parsed.interval_sec
+        self.memory_threshold_percent = parsed.memory_threshold_percent
+        self.consecutive_health_fail_limit = parsed.consecutive_health_fail_limit
+        self.cooldown_sec = parsed.cooldown_sec
+        self.memory_log_mode = parsed.memory_log_mode
+        self.memory_log_delta_percent = parsed.memory_log_delta_percent
+        self.memory_log_heartbeat_sec = parsed.memory_log_heartbeat_sec
+        self.prefer_lower_memory_on_overload = parsed.prefer_lower_memory_on_overload
+        self.incremental_switch = parsed.incremental_switch
+        self.planner = parsed.planner
+        self.planner_headroom_gb = parsed.planner_headroom_gb
+        self.upgrade_below_percent = parsed.upgrade_below_percent
+        self.upgrade_after_sec = parsed.upgrade_after_sec
+        self.readiness_enabled = parsed.readiness_enabled
+        self.adaptive_enabled = parsed.adaptive_enabled
+        self.min_sample_interval_sec = parsed.min_sample_interval_sec
+        self.max_sample_interval_sec = parsed.max_sample_interval_sec
+        self.near_threshold_percent = parsed.near_threshold_percent
+        self.rising_rate_percent_per_sec = parsed.rising_rate_percent_per_sec
+        self.flat_rate_percent_per_sec = parsed.flat_rate_percent_per_sec
+        self.trend_lead_time_sec = parsed.trend_lead_time_sec
+        self.rss_enabled = parsed.rss_enabled
+        self.rss_interval_sec = parsed.rss_interval_sec
+        self.rss_alpha = parsed.rss_alpha
+        self.rss_settle_sec = parsed.rss_settle_sec
+        self.cache_login_env = parsed.cache_login_env
+        self.health_api_url = parsed.health_api_url
+        self.require_loaded = parsed.require_loaded
+        self.hedge_enabled = parsed.hedge_enabled
+        self.hedge_window = parsed.hedge_window
+        self.hedge_min_samples = parsed.hedge_min_samples
+        self.hedge_min_delay_sec = parsed.hedge_min_delay_sec
+        self.health_probes = parsed.health_probes
+
+    def config_changed(self) -> bool:
+        """Cheap stat() poll of the config file, at most every config_reload.interval_sec."""
+        now = self.clock.monotonic()
+        if not self.config_path or not self.config_reload_enabled or now < self.next_config_check:
+            return False
+        self.next_config_check = now + self.config_reload_interval_sec
+        try:
+            st = os.stat(self.config_path)
+        except OSError:
+            return False
+        # Editors usually save by rename, which changes the inode even when mtime looks the same.
+        key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if self.config_stat is None:
+            self.config_stat = key
+            return False
+        if key == self.config_stat:
+            return False
+        self.config_stat = key
+        return True
+
+    def maybe_reload_config(self) -> bool:
+        """Swap in the config file if it changed and validates; a bad file keeps the running config."""
+        if not self.config_changed():
+            return False
+        assert self.config_path is not None
+        try:
+            new_config = load_config(self.config_path)
+            parsed = self.parse_config(new_config)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            self.log(f"config reload rejected, keeping current config: {e}")
+            return False
+
+        # Carry measured RAM and the active profile/model across by name.
+        measured = {m.name: m.measured_ram_gb for m in self.models}
+        for m in parsed.models:
+            m.measured_ram_gb = measured.get(m.name)
+        measured = {p.name: p.measured_ram_gb for p in self.profiles}
+        for p in parsed.profiles:
+            p.measured_ram_gb = measured.get(p.name)
+        restart_only = [key for key in RESTART_ONLY_KEYS if config_lookup(self.config, key) != config_lookup(new_config, key)]
+        cur_profile = self.current_profile().name if self.profiles else None
+        cur_model = self.current_model().name if self.models else None
+
+        with self.state_lock:
+            self.apply_config(parsed)
+            if self.profiles:
+                names = [p.name for p in self.profiles]
+                if cur_profile in names:
+                    self.state.current_profile_index = names.index(cur_profile)
+                elif cur_profile and cur_profile.startswith(AUTO_PROFILE_PREFIX) and all(
+                    m in {spec.name for spec in self.models} for m in cur_profile[len(AUTO_PROFILE_PREFIX) :].split("+")
+                ):
+                    self.state.current_profile_index = self.profile_index_for(
+                        frozenset(cur_profile[len(AUTO_PROFILE_PREFIX) :].split("+"))
+                    )
+                else:
+                    self.state.current_profile_index = self.find_initial_profile_index()
+                    self.log(f"profile {cur_profile} no longer configured, now tracking {self.current_profile().name}")
+            if self.models:
+                names = [m.name for m in self.models]
+                self.state.current_model_index = names.index(cur_model) if cur_model in names else 0
+        self.sample_interval_sec = min(self.sample_interval_sec, self.max_sample_interval_sec)
+        # Rebuild what was built from the old values.
+        with self.rss_lock:
+            # Recreated on the next update_rss() with the new model names and process list.
+            self.rss_collector = None
+        self.size_probe_pools(len(self.active_probes()))
+        if self.proxy is not None:
+            self.proxy.configure(self.config.get("proxy", {}))
+        with self.login_env_lock:
+            # Profile edits usually come with a config edit; take a fresh login snapshot on the next command.
+            self.login_envs.clear()
+        self.log(
+            f"config reloaded from {self.config_path}: "
+            f"{len(self.profiles)} profiles, {len(self.models)} models, {len(self.commands)} commands"
+        )
+        if restart_only:
+            self.log(f"config reload: {', '.join(restart_only)} changed, takes effect after restart")
+        return True
+
+    def command(self, key: str, values: Optional[Dict[str, str]] = None) -> Optional[List[str]]:
+        """The precompiled command for `key` (see COMMAND_PATHS) rendered with `values`, or None if unset."""
+        template = self.commands.get(key)
+        return template.render(values) if template is not None else None
+
+    def log(self, msg: str, **fields: Any) -> None:
+        self.log_writer.write(msg, fields)
+
+    def close(self) -> None:
+        if self.notify_queue is not None:
+            self.notify_queue.close()
+        with self.probe_pool_lock:
+            for pool in (self.probe_pool, self.hedge_pool):
+                if pool is not None:
+                    pool.shutdown(wait=False, cancel_futures=True)
+            self.probe_pool = self.hedge_pool = None
+        self.http.close()
+        if self.metrics is not None:
+            self.metrics.close()
+        self.log_writer.close()
+
+    def record_metric(self, mem: Optional[float] = None, latency_ms: Optional[float] = None, event: str = "") -> None:
+        if self.metrics is None:
+            return
+        index = self.state.current_profile_index if self.profiles else self.state.current_model_index
+        try:
+            self.metrics.append(self.clock.time(), mem=mem, latency_ms=latency_ms, profile_index=index, event=event)
+        except (OSError, ValueError) as e:
+            self.log(f"metrics write failed, disabling metrics: {e}")
+            self.metrics = None
+
+    def log_memory(self, mem: float) -> None:
+        """Per-tick memory line; in "change" mode only when it moved or the heartbeat is due."""
+        now = self.clock.monotonic()
+        if self.memory_log_mode == "change" and self.last_memory_logged is not None:
+            moved = abs(mem - self.last_memory_logged) >= self.memory_log_delta_percent
+            if not moved and now - self.last_memory_log_ts < self.memory_log_heartbeat_sec:
+                return
+        self.last_memory_logged = mem
+        self.last_memory_log_ts = now
+        self.log(f"memory usage={mem:.2f}%", event="memory", memory_percent=round(mem, 2))
+
+    def load_state(self) -> None:
+        """Resume profile/model, cooldown and measured RAM from the last run, matched by name."""
+        if not self.state_file:
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.log(f"ignore unreadable state file {self.state_file}: {e}")
+            return
+
+        profile_names = [p.name for p in self.profiles]
+        model_names = [m.name for m in self.models]
+        saved_profile = str(saved.get("profile") or "")
+        if saved_profile.startswith(AUTO_PROFILE_PREFIX) and saved_profile not in profile_names:
+            models = saved_profile[len(AUTO_PROFILE_PREFIX) :].split("+")
+            if models and all(m in model_names for m in models):
+                self.profile_index_for(frozenset(models))
+                profile_names = [p.name for p in self.profiles]
+        if saved.get("profile") in profile_names:
+            self.state.current_profile_index = profile_names.index(saved["profile"])
+        if saved.get("model") in model_names:
+            self.state.current_model_index = model_names.index(saved["model"])
+        self.state.last_action_ts = float(saved.get("last_action_ts", 0.0))
+        self.state.health_fail_count = int(saved.get("health_fail_count", 0))
+        measured = saved.get("measured_ram_gb", {})
+        for m in self.models:
+            if m.name in measured.get("models", {}):
+                m.measured_ram_gb = float(measured["models"][m.name])
+        for p in self.profiles:
+            if p.name in measured.get("profiles", {}):
+                p.measured_ram_gb = float(measured["profiles"][p.name])
+
+        target = saved.get("profile") if self.profiles else saved.get("model")
+        remaining = self.cooldown_sec - (self.clock.time() - self.state.last_action_ts)
+        msg = f"restored state from {self.state_file}: {target}"
+        if remaining > 0:
+            msg += f", cooldown {remaining:.0f}s left"
+        self.log(msg)
+
+    def save_state(self) -> None:
+        """Atomically persist State so a restart resumes where this process left off."""
+        if not self.state_file:
+            return
+        payload = {
+            "profile": self.current_profile().name if self.profiles else None,
+            "model": self.current_model().name if self.models else None,
+            "current_profile_index": self.state.current_profile_index,
+            "current_model_index": self.state.current_model_index,
+            "last_action_ts": self.state.last_action_ts,
+            "health_fail_count": self.state.health_fail_count,
+            "measured_ram_gb": {
+                "models": {m.name: m.measured_ram_gb for m in self.models if m.measured_ram_gb is not None},
+                "profiles": {p.name: p.measured_ram_gb for p in self.profiles if p.measured_ram_gb is not None},
+            },
+            "saved_at": self.clock.time(),
+        }
+        with self.state_lock:
+            try:
+                atomic_write_json(self.state_file, payload)
+            except OSError as e:
+                self.log(f"save state failed: {e}")
+
+    def record_health(self, ok: bool) -> bool:
+        """Update the consecutive failure count; True when it reaches the recovery limit."""
+        if not ok and self.warming_up:
+            self.log("health check failed during warm-up, not counted")
+            return False
+        if ok:
+            if self.state.health_fail_count:
+                self.state.health_fail_count = 0
+                self.save_state()
+            return False
+        self.state.health_fail_count += 1
+        self.log(f"health fail count={self.state.health_fail_count}")
+        self.save_state()
+        return self.state.health_fail_count >= self.consecutive_health_fail_limit
+
+    def reset_health_failures(self) -> None:
+        self.state.health_fail_count = 0
+        self.save_state()
+
+    def run_command(self, cmd: List[str], timeout: int = 30, kind: str = "command") -> subprocess.CompletedProcess:
+        with self.tracer.span(f"command:{kind}", argv0=cmd[0] if cmd else "") as span:
+            res = self.exec_command(cmd, timeout=timeout, kind=kind)
+            span.attrs["rc"] = res.returncode
+        return res
+
+    def login_env(self, shell: str) -> Optional[Dict[str, str]]:
+        """Environment a login shell ends up with, captured once per shell; None if it can't be read."""
+        with self.login_env_lock:
+            if shell in self.login_envs:
+                return self.login_envs[shell]
+            env: Optional[Dict[str, str]] = None
+            try:
+                res = subprocess.run([shell, "-lc", "env -0"], capture_output=True, timeout=30, check=False)
+                if res.returncode == 0:
+                    env = {}
+                    for entry in res.stdout.split(b"\0"):
+                        key, sep, value = entry.decode("utf-8", "replace").partition("=")
+                        if sep and key:
+                            env[key] = value
+            except (OSError, subprocess.TimeoutExpired) as e:
+                self.log(f"cannot capture login environment of {shell}: {e}")
+            self.login_envs[shell] = env
+            return env
+
+    def unwrap_login_shell(self, cmd: List[str]) -> Tuple[List[str], Optional[Dict[str, str]]]:
+        """Turn `<shell> -lc script` into `<shell> -c script` run with the cached login environment.
+
+        Sourcing login profiles on every switch/restart/notify costs far more than the command itself,
+        but a cached snapshot misses later profile edits and skips per-login side effects, so this only
+        happens with commands.cache_login_env; the snapshot is retaken after each config reload.
+        """
+        if not self.cache_login_env or len(cmd) != 3 or cmd[1] != "-lc":
+            return cmd, None
+        if os.path.basename(cmd[0]) not in ("bash", "zsh", "sh"):
+            return cmd, None
+        env = self.login_env(cmd[0])
+        if env is None:
+            return cmd, None
+        return [cmd[0], "-c", cmd[2]], env
+
+    def exec_command(self, cmd: List[str], timeout: int, kind: str) -> subprocess.CompletedProcess:
+        pretty = " ".join(shlex.quote(c) for c in cmd)
+        if self.dry_run:
+            self.log(f"[DRY-RUN] command: {pretty}")
+            return subprocess.CompletedProcess(args=cmd, returncode=0, stdout="", stderr="")
+        if self.command_runner is not None:
+            return self.command_runner(cmd, timeout, kind)
+        run_cmd, env = self.unwrap_login_shell(cmd)
+        start = time.perf_counter()
+        try:
+            return subprocess.run(
+                run_cmd,
+                capture_output=True,
+                text=True,
+                timeout=timeout,
+                check=False,
+                env=env,
+            )
+        except FileNotFoundError as e:
+            return subprocess.CompletedProcess(args=cmd, returncode=127, stdout="", stderr=str(e))
+        except subprocess.TimeoutExpired as e:
+            return subprocess.CompletedProcess(args=cmd, returncode=124, stdout="", stderr=f"timed out after {e.timeout}s")
+        finally:
+            self.telemetry.observe("command_duration_seconds", time.perf_counter() - start, kind=kind)
+
+    def parse_models(self, raw_models: List[Any]) -> List[ModelSpec]:
+        parsed: List[ModelSpec] = []
+        for item in raw_models:
+            if isinstance(item, str):
+                parsed.append(ModelSpec(name=item, ram_gb=None))
+                continue
+            if isinstance(item, dict):
+                name = item.get("name")
+                if not name:
+                    raise ValueError("each model object requires name")
+                ram = item.get("ram_gb")
+                parsed.append(
+                    ModelSpec(
+                        name=name,
+                        ram_gb=float(ram) if ram is not None else None,
+                        priority=float(item.get("priority", 1.0)),
+                    )
+                )
+                continue
+            raise ValueError("config.models entries must be string or object")
+        return parsed
+
+    def parse_profiles(self, raw_profiles: List[Any], models: List[ModelSpec]) -> List[ProfileSpec]:
+        parsed: List[ProfileSpec] = []
+        for item in raw_profiles:
+            if not isinstance(item, dict):
+                raise ValueError("config.profiles entries must be object")
+            name = item.get("name")
+            profile_models = item.get("models")
+            if not name or not isinstance(profile_models, list) or not profile_models:
+                raise ValueError("each profile requires name and non-empty models")
+            ram = item.get("ram_gb")
+            if ram is None:
+                ram = 0.0
+                for model_name in profile_models:
+                    for m in models:
+                        if m.name == model_name and m.ram_gb is not None:
+                            ram += m.ram_gb
+                            break
+                if ram == 0.0:
+                    ram = None
+            parsed.append(
+                ProfileSpec(name=name, models=profile_models, ram_gb=float(ram) if ram is not None else None)
+            )
+        return parsed
+
+    def find_initial_profile_index(self) -> int:
+        configured = self.config.get("initial_profile")
+        if configured:
+            for idx, p in enumerate(self.profiles):
+                if p.name == configured:
+                    return idx
+        return 0
+
+    def memory_usage_percent(self) -> float:
+        if self.memory_sampler is None:
+            self.memory_sampler = create_memory_sampler(
+                self.config.get("memory_sampler", "auto"), self.config.get("cgroup_dir")
+            )
+            self.log(f"memory sampler={self.memory_sampler.name}")
+        mem = self.memory_sampler.percent()
+        self.update_rss()
+        return mem
+
+    def update_rss(self, force: bool = False) -> Optional[RSSSnapshot]:
+        """Collect per-process RSS (throttled) and fold settled readings into per-model/profile EWMAs."""
+        if not self.rss_enabled:
+            return None
+        with self.rss_lock:
+            now = self.clock.monotonic()
+            if not force and now - self.last_rss_ts < self.rss_interval_sec:
+                return self.last_rss
+            self.last_rss_ts = now
+            if self.rss_collector is None:
+                rcfg = self.config.get("rss_accounting", {})
+                try:
+                    self.rss_collector = ProcessRSSCollector(
+                        process_names=rcfg.get("process_names", ["ollama", "openclaw"]),
+                        model_names=[m.name for m in self.models],
+                        ollama_models_dir=rcfg.get("ollama_models_dir"),
+                    )
+                except (OSError, AttributeError) as e:
+                    self.log(f"rss accounting unavailable: {e}")
+                    self.rss_enabled = False
+                    return None
+            try:
+                snap = self.rss_collector.collect()
+            except OSError as e:
+                self.log(f"rss collect error: {e}")
+                return self.last_rss
+            self.last_rss = snap
+
+            # Right after a switch/restart models are still loading; don't let that skew the averages.
+            if self.clock.time() - self.state.last_action_ts < self.rss_settle_sec or not snap.total_bytes:
+                return snap
+            gb = 1024 ** 3
+            for model in self.models:
+                if model.name in snap.per_model:
+                    model.measured_ram_gb = self.ewma(model.measured_ram_gb, snap.per_model[model.name] / gb)
+            if self.profiles:
+                profile = self.current_profile()
+                profile.measured_ram_gb = self.ewma(profile.measured_ram_gb, snap.total_bytes / gb)
+            return snap
+
+    def ewma(self, prev: Optional[float], value: float) -> float:
+        if prev is None:
+            return value
+        return prev + self.rss_alpha * (value - prev)
+
+    def profile_ram_gb(self, profile: ProfileSpec) -> Optional[float]:
+        """Measured profile RSS, else the sum of measured/configured model figures, else config ram_gb."""
+        if profile.measured_ram_gb is not None:
+            return profile.measured_ram_gb
+        by_name = {m.name: m for m in self.models}
+        specs = [by_name[name] for name in profile.models if name in by_name]
+        if any(m.measured_ram_gb is not None for m in specs):
+            return sum(m.effective_ram_gb() or 0.0 for m in specs)
+        return profile.ram_gb
+
+    def model_budget_gb(self) -> Optional[float]:
+        """RAM the model processes may use without crossing the threshold, from the latest RSS snapshot."""
+        if self.last_rss is None or self.last_mem_percent is None or self.memory_sampler is None:
+            return None
+        gb = 1024 ** 3
+        total_gb = self.memory_sampler.total_bytes() / gb
+        used_gb = total_gb * self.last_mem_percent / 100
+        other_gb = max(used_gb - self.last_rss.total_bytes / gb, 0.0)
+        return total_gb * self.memory_threshold_percent / 100 - other_gb
+
+    def parse_health_checks(self, config: Dict[str, Any], health_api_url: Optional[str]) -> List[HealthProbe]:
+        default_timeout = float(config.get("health_check", {}).get("timeout_sec", 15))
+        probes: List[HealthProbe] = []
+        for i, raw in enumerate(config.get("health_checks", [])):
+            kind = raw.get("type", "command")
+            if kind not in ("command", "http", "tcp", "inference", "ps"):
+                raise ValueError(f"health_checks[{i}]: unknown type {kind!r}")
+            probe = HealthProbe(
+                name=str(raw.get("name", f"{kind}{i}")),
+                kind=kind,
+                timeout_sec=float(raw.get("timeout_sec", default_timeout)),
+                required=bool(raw.get("required", False)),
+                hedge=bool(raw.get("hedge", kind in ("http", "ps"))),
+                command=raw.get("command"),
+                url=raw.get("url"),
+                method=str(raw.get("method", "GET")).upper(),
+                host=str(raw.get("host", "127.0.0.1")),
+                port=int(raw.get("port", 0)),
+                prompt=str(raw.get("prompt", "ping")),
+            )
+            if kind == "command" and not probe.command:
+                raise ValueError(f"health_checks[{i}]: command probe needs 'command'")
+            if kind == "http" and not probe.url:
+                raise ValueError(f"health_checks[{i}]: http probe needs 'url'")
+            if kind == "tcp" and not probe.port:
+                raise ValueError(f"health_checks[{i}]: tcp probe needs 'port'")
+            if kind == "inference" and not probe.url:
+                probe.url = "http://127.0.0.1:11434/api/generate"
+            if kind == "ps" and not (health_api_url or probe.command):
+                raise ValueError(f"health_checks[{i}]: ps probe needs health_check.api_url or 'command'")
+            probes.append(probe)
+        return probes
+
+    def active_probes(self) -> List[HealthProbe]:
+        """Configured probes with each inference probe expanded to one per model of the active profile."""
+        models = self.current_profile().models if self.profiles else [self.current_model().name]
+        expanded: List[HealthProbe] = []
+        for probe in self.health_probes:
+            if probe.kind != "inference":
+                expanded.append(probe)
+                continue
+            for model in models:
+                expanded.append(
+                    HealthProbe(
+                        name=f"{probe.name}:{model}",
+                        kind=probe.kind,
+                        timeout_sec=probe.timeout_sec,
+                        required=probe.required,
+                        url=probe.url,
+                        method="POST",
+                        prompt=probe.prompt,
+                        model=model,
+                    )
+                )
+        return expanded
+
+    def run_probe(self, probe: HealthProbe) -> Tuple[bool, str]:
+        """Run one probe within its own timeout; returns (ok, failure detail)."""
+        if probe.kind == "command":
+            res = self.run_command(probe.command or [], timeout=max(int(probe.timeout_sec), 1), kind="health")
+            if res.returncode != 0:
+                return False, f"rc={res.returncode}, stderr={res.stderr.strip()}"
+            return True, ""
+        if probe.kind == "tcp":
+            with socket.create_connection((probe.host, probe.port), timeout=probe.timeout_sec):
+                return True, ""
+        if probe.kind == "ps":
+            loaded = self.loaded_models(probe.timeout_sec, probe.command, hedge=probe.hedge)
+            if loaded is None:
+                return False, "ps failed"
+            missing = self.missing_active_models(loaded)
+            if missing:
+                return False, "not loaded: " + ", ".join(missing)
+            return True, ""
+        if probe.hedge:
+            res = self.hedged_request(probe.name, probe.method, probe.url or "", timeout=probe.timeout_sec)
+            if res.status >= 400:
+                return False, f"status={res.status}"
+            return True, ""
+        body = None
+        headers = None
+        if probe.kind == "inference":
+            payload = {"model": probe.model, "prompt": probe.prompt, "stream": False, "options": {"num_predict": 1}}
+            body = json.dumps(payload).encode("utf-8")
+            headers = {"Content-Type": "application/json"}
+        res = self.http.request(probe.method, probe.url or "", body=body, headers=headers, timeout=probe.timeout_sec)
+        if res.status >= 400:
+            return False, f"status={res.status}"
+        return True, ""
+
+    def quorum_min_ok(self, total: int) -> int:
+        quorum = self.config.get("health_quorum", "all")
+        if quorum == "all":
+            return total
+        if quorum == "any":
+            return min(1, total)
+        if quorum == "majority":
+            return total // 2 + 1
+        return min(int(quorum), total)
+
+    def health_checks_ok(self, quiet: bool = False) -> bool:
+        """Run all probes concurrently; healthy when every required probe passes and the quorum is met.
+
+        Each probe has its own deadline. The result is returned as soon as it is decided, so a
+        slow probe doesn't stretch the tick when the others already settle the outcome.
+        """
+        probes = self.active_probes()
+        if not probes:
+            return True
+        self.size_probe_pools(len(probes))
+
+        def timed(probe: HealthProbe) -> Tuple[bool, str]:
+            start = time.perf_counter()
+            try:
+                ok, detail = self.run_probe(probe)
+            except Exception as e:  # noqa: BLE001
+                ok, detail = False, f"exception: {e}"
+            self.telemetry.observe(
+                "health_probe_duration_seconds",
+                time.perf_counter() - start,
+                probe=probe.name,
+                result="ok" if ok else "fail",
+            )
+            return ok, detail
+
+        start = time.monotonic()
+        pending = {self.submit_probe(False, timed, p): p for p in probes}
+        min_ok = self.quorum_min_ok(len(probes))
+        passed = 0
+        failed: List[str] = []
+        required_failed = False
+        while pending:
+            now = time.monotonic()
+            for fut, probe in list(pending.items()):
+                if not fut.done() and now - start >= probe.timeout_sec:
+                    # Overran its deadline (e.g. stuck connect); count it failed and stop waiting for it.
+                    del pending[fut]
+                    failed.append(f"{probe.name}: timed out after {probe.timeout_sec:g}s")
+                    required_failed = required_failed or probe.required
+            for fut in [f for f in pending if f.done()]:
+                probe = pending.pop(fut)
+                ok, detail = fut.result()
+                if ok:
+                    passed += 1
+                else:
+                    failed.append(f"{probe.name}: {detail}")
+                    required_failed = required_failed or probe.required
+            required_pending = any(p.required for p in pending.values())
+            if required_failed or passed + len(pending) < min_ok:
+                break
+            if passed >= min_ok and not required_pending:
+                break
+            if not pending:
+                break
+            next_deadline = min(start + p.timeout_sec for p in pending.values())
+            concurrent.futures.wait(
+                list(pending), timeout=max(next_deadline - time.monotonic(), 0), return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+        ok = not required_failed and passed >= min_ok
+        if not ok and not quiet:
+            self.log(f"health probes failed ({passed}/{len(probes)} ok, need {min_ok}): " + "; ".join(failed))
+        return ok
+
+    def size_probe_pools(self, count: int) -> None:
+        """Retire the probe/hedge pools if they were sized for a different number of active probes.
+
+        Called on config reload and before each health check (a profile switch changes how many
+        inference probes there are); the replacements are created on the next submit.
+        """
+        count = max(count, 1)
+        with self.probe_pool_lock:
+            if count == self.probe_pool_size:
+                return
+            for pool in (self.probe_pool, self.hedge_pool):
+                if pool is not None:
+                    # Work already running (an overrun probe) finishes on the old threads.
+                    pool.shutdown(wait=False)
+            self.probe_pool = self.hedge_pool = None
+            self.probe_pool_size = count
+
+    def submit_probe(self, hedge: bool, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> concurrent.futures.Future:
+        """Submit to the probe pool (one worker per active probe) or the hedge pool (two per probe)."""
+        with self.probe_pool_lock:
+            size = max(self.probe_pool_size, 1)
+            if hedge:
+                if self.hedge_pool is None:
+                    self.hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=size * 2, thread_name_prefix="wd-hedge")
+                pool = self.hedge_pool
+            else:
+                if self.probe_pool is None:
+                    self.probe_pool = concurrent.futures.ThreadPoolExecutor(max_workers=size, thread_name_prefix="wd-probe")
+                pool = self.probe_pool
+            return pool.submit(fn, *args, **kwargs)
+
+    def hedged_request(self, name: str, method: str, url: str, timeout: float) -> HTTPResult:
+        """HTTP request that sends a second copy if the first hasn't answered by this probe's recent p95.
+
+        Hedging starts once hedge_min_samples latencies are known; whichever copy answers first wins.
+        """
+        samples = self.probe_latency.setdefault(name, collections.deque(maxlen=self.hedge_window))
+        hedge_after: Optional[float] = None
+        if self.hedge_enabled and len(samples) >= self.hedge_min_samples:
+            ordered = sorted(samples)
+            hedge_after = max(ordered[int(0.95 * (len(ordered) - 1))], self.hedge_min_delay_sec)
+
+        start = time.perf_counter()
+        # Both copies run on the hedge pool: the calling probe occupies a probe worker meanwhile.
+        futures = [self.submit_probe(True, self.http.request, method, url, timeout=timeout)]
+        if hedge_after is not None and hedge_after < timeout:
+            done, _ = concurrent.futures.wait(futures, timeout=hedge_after)
+            if not done:
+                futures.append(self.submit_probe(True, self.http.request, method, url, timeout=timeout))
+                self.telemetry.inc("health_hedged_requests_total", probe=name)
+
+        error: Optional[BaseException] = None
+        pending = set(futures)
+        while pending:
+            remaining = timeout - (time.perf_counter() - start)
+            done, pending = concurrent.futures.wait(
+                pending, timeout=max(remaining, 0), return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if not done:
+                break
+            for fut in done:
+                try:
+                    res = fut.result()
+                except Exception as e:  # noqa: BLE001
+                    error = e
+                    continue
+                samples.append(time.perf_counter() - start)
+                return res
+        if error is not None:
+            raise error
+        raise TimeoutError(f"no response within {timeout:g}s")
+
+    def loaded_models(
+        self, timeout: float, command: Optional[List[str]] = None, hedge: bool = True
+    ) -> Optional[Set[str]]:
+        """Names of models the server has loaded, from /api/ps or a ps command; None on failure.
+
+        Parsing is skipped when the raw output is byte-identical to the previous tick.
+        """
+        if self.health_api_url:
+            url = self.health_api_url.rstrip("/") + "/api/ps"
+            if hedge:
+                res = self.hedged_request("ps", "GET", url, timeout)
+            else:
+                res = self.http.request("GET", url, timeout=timeout)
+            if res.status >= 400:
+                self.log(f"health api failed status={res.status}")
+                return None
+            raw = res.body
+        else:
+            cmd_res = self.run_command(command or [], timeout=max(int(timeout), 1), kind="health")
+            if cmd_res.returncode != 0:
+                self.log(f"health command failed rc={cmd_res.returncode}, stderr={cmd_res.stderr.strip()}")
+                return None
+            raw = cmd_res.stdout.encode("utf-8")
+
+        with self.ps_lock:
+            if raw == self.ps_raw and self.ps_models is not None:
+                return self.ps_models
+        if self.health_api_url:
+            try:
+                models = {m.get("name", "") for m in json.loads(raw).get("models", [])}
+            except (ValueError, AttributeError) as e:
+                self.log(f"health api returned unparsable ps output: {e}")
+                return None
+        else:
+            # `ollama ps` table: header row, then the model name in the first column.
+            models = {line.split()[0] for line in raw.decode("utf-8", "replace").splitlines()[1:] if line.strip()}
+        with self.ps_lock:
+            self.ps_raw = raw
+            self.ps_models = models
+        return models
+
+    def missing_active_models(self, loaded: Set[str]) -> List[str]:
+        if not self.require_loaded:
+            return []
+        wanted = self.current_profile().models if self.profiles else [self.current_model().name]
+        # Ollama reports untagged names with ":latest".
+        return [m for m in wanted if m not in loaded and f"{m}:latest" not in loaded]
+
+    def health_timeout_sec(self) -> float:
+        """Longest a health check can take: the slowest probe (they run concurrently) or health_check.timeout_sec."""
+        if self.health_probes:
+            return max(p.timeout_sec for p in self.health_probes)
+        return float(self.config.get("health_check", {}).get("timeout_sec", 15))
+
+    def health_ok(self, quiet: bool = False) -> bool:
+        if self.health_probes:
+            return self.health_checks_ok(quiet)
+        hc = self.config.get("health_check", {})
+        timeout = int(hc.get("timeout_sec", 15))
+
+        # Prefer the server's HTTP API over forking its CLI; the command is the fallback.
+        cmd = hc.get("command")
+        if self.health_api_url:
+            try:
+                loaded = self.loaded_models(timeout)
+            except Exception as e:  # noqa: BLE001
+                if not quiet:
+                    self.log(f"health api exception: {e}")
+                return False
+            if loaded is None:
+                return False
+            missing = self.missing_active_models(loaded)
+            if missing:
+                if not quiet:
+                    self.log(f"health check: models not loaded: {', '.join(missing)}")
+                return False
+        elif cmd:
+            if self.require_loaded:
+                loaded = self.loaded_models(timeout, cmd)
+                if loaded is None:
+                    return False
+                missing = self.missing_active_models(loaded)
+                if missing:
+                    if not quiet:
+                        self.log(f"health check: models not loaded: {', '.join(missing)}")
+                    return False
+            else:
+                res = self.run_command(cmd, timeout=timeout, kind="health")
+                if res.returncode != 0:
+                    if not quiet:
+                        self.log(f"health command failed rc={res.returncode}, stderr={res.stderr.strip()}")
+                    return False
+
+        url = hc.get("url")
+        if url:
+            method = hc.get("method", "GET").upper()
+            try:
+                code = self.hedged_request("url", method, url, timeout).status
+                if code >= 400:
+                    if not quiet:
+                        self.log(f"health url failed status={code}")
+                    return False
+            except Exception as e:  # noqa: BLE001
+                if not quiet:
+                    self.log(f"health url exception: {e}")
+                return False
+
+        return True
+
+    def wait_until_ready(self) -> Optional[float]:
+        """Poll health with exponential backoff after a switch/restart; seconds to ready, or None on deadline.
+
+        While this runs, health failures seen by the monitoring loop are treated as warm-up and not counted.
+        """
+        rcfg = self.config.get("readiness", {})
+        deadline_sec = float(rcfg.get("deadline_sec", 120))
+        delay = float(rcfg.get("initial_delay_sec", 0.25))
+        max_delay = float(rcfg.get("max_delay_sec", 5))
+        backoff = float(rcfg.get("backoff", 2))
+        if self.dry_run:
+            self.log("[DRY-RUN] skip readiness wait")
+            return 0.0
+
+        start = self.clock.monotonic()
+        self.warming_up = True
+        try:
+            attempts = 0
+            while True:
+                attempts += 1
+                if self.health_ok(quiet=True):
+                    elapsed = self.clock.monotonic() - start
+                    self.telemetry.observe("time_to_ready_seconds", elapsed)
+                    self.log(f"service ready after {elapsed:.2f}s ({attempts} probes)")
+                    return elapsed
+                remaining = deadline_sec - (self.clock.monotonic() - start)
+                if remaining <= 0:
+                    self.log(f"service not ready after {deadline_sec:.0f}s ({attempts} probes)")
+                    return None
+                self.clock.sleep(min(delay, remaining))
+                delay = min(delay * backoff, max_delay)
+        finally:
+            self.warming_up = False
+            self.reset_health_failures()
+
+    def notify(self, title: str, detail: str) -> None:
+        if self.notify_dispatcher is not None:
+            self.notify_dispatcher(title, detail)
+            return
+        self.deliver_notification(title, detail)
+
+    def deliver_notification(self, title: str, detail: str, channels: Optional[List[str]] = None) -> List[str]:
+        """Send to the configured channels (or only `channels`); returns the channels that failed."""
+        message = f"{title}\n{detail}"
+        ncfg = self.config.get("notification", {})
+        failed: List[str] = []
+
+        webhook = ncfg.get("webhook_url")
+        if webhook and (channels is None or "webhook" in channels):
+            data = json.dumps({"text": message}).encode("utf-8")
+            try:
+                if self.dry_run:
+                    self.log(f"[DRY-RUN] webhook POST to {webhook}: {message}")
+                else:
+                    start = time.perf_counter()
+                    try:
+                        res = self.http.request(
+                            "POST", webhook, body=data, headers={"Content-Type": "application/json"}, timeout=10
+                        )
+                    finally:
+                        self.telemetry.observe(
+                            "command_duration_seconds", time.perf_counter() - start, kind="notify_webhook"
+                        )
+                    if res.status >= 400:
+                        self.log(f"notify webhook failed: HTTP {res.status}")
+                        failed.append("webhook")
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                self.log(f"notify webhook failed: {e}")
+                failed.append("webhook")
+
+        formatted = self.command("notify", {"model": "", "message": message})
+        if formatted and (channels is None or "command" in channels):
+            res = self.run_command(formatted, timeout=20, kind="notify")
+            if res.returncode != 0:
+                self.log(f"notify command failed rc={res.returncode}, stderr={res.stderr.strip()}")
+                failed.append("command")
+        return failed
+
+    def current_model(self) -> ModelSpec:
+        return self.models[self.state.current_model_index]
+
+    def current_profile(self) -> ProfileSpec:
+        return self.profiles[self.state.current_profile_index]
+
+    def pick_target_model_index(self, reason: str) -> int:
+        cur = self.state.current_model_index
+
+        # On memory overload, prefer moving to the lightest model to quickly lower pressure.
+        if reason in MEMORY_REASONS and self.prefer_lower_memory_on_overload:
+            with_ram: List[Tuple[int, float]] = []
+            for idx, model in enumerate(self.models):
+                ram = model.effective_ram_gb()
+                if ram is not None:
+                    with_ram.append((idx, ram))
+            if with_ram:
+                lightest_idx, _ = sorted(with_ram, key=lambda p: p[1])[0]
+                if lightest_idx != cur:
+                    return lightest_idx
+
+        return (cur + 1) % len(self.models)
+
+    def planner_budget_gb(self) -> Optional[float]:
+        """RAM the planner may give to models: the threshold minus non-model usage minus headroom."""
+        budget = self.model_budget_gb()
+        if budget is None:
+            if self.last_mem_percent is None or self.memory_sampler is None:
+                return None
+            # No RSS measurement: estimate non-model usage with the configured model sizes.
+            gb = 1024 ** 3
+            total_gb = self.memory_sampler.total_bytes() / gb
+            by_name = {m.name: m for m in self.models}
+            current = sum(by_name[n].effective_ram_gb() or 0.0 for n in self.current_profile().models if n in by_name)
+            other_gb = max(total_gb * self.last_mem_percent / 100 - current, 0.0)
+            budget = total_gb * self.memory_threshold_percent / 100 - other_gb
+        return budget - self.planner_headroom_gb
+
+    def plan_models(self) -> Optional[frozenset]:
+        if self.planner is None:
+            return None
+        budget = self.planner_budget_gb()
+        if budget is None:
+            return None
+        candidates = [(m.name, m.effective_ram_gb(), m.priority) for m in self.models if m.effective_ram_gb() is not None]
+        if not candidates:
+            return None
+        plan = self.planner.best(budget, [(n, float(r or 0.0), p) for n, r, p in candidates])
+        return plan
+
+    def plan_value(self, models: Any) -> float:
+        priority = {m.name: m.priority for m in self.models}
+        return sum(priority.get(name, 0.0) for name in models)
+
+    def profile_index_for(self, models: frozenset) -> int:
+        """Index of the profile mounting exactly `models`, adding an auto profile when none does."""
+        for idx, p in enumerate(self.profiles):
+            if frozenset(p.models) == models:
+                return idx
+        ordered = [m.name for m in self.models if m.name in models]
+        ram = sum(m.effective_ram_gb() or 0.0 for m in self.models if m.name in models)
+        self.profiles.append(ProfileSpec(name=AUTO_PROFILE_PREFIX + "+".join(ordered), models=ordered, ram_gb=ram))
+        return len(self.profiles) - 1
+
+    def upgrade_due(self, mem: float) -> bool:
+        """True once memory has stayed below upgrade_below_percent for upgrade_after_sec and a richer plan fits."""
+        now = self.clock.monotonic()
+        if mem >= self.upgrade_below_percent:
+            self.low_since = None
+            return False
+        if self.low_since is None:
+            self.low_since = now
+        if now - self.low_since < self.upgrade_after_sec or self.should_cooldown():
+            return False
+        plan = self.plan_models()
+        if plan is None or self.plan_value(plan) <= self.plan_value(self.current_profile().models):
+            return False
+        self.low_since = None
+        self.log(f"memory below {self.upgrade_below_percent:.0f}% for {self.upgrade_after_sec:.0f}s, upgrade to {'+'.join(sorted(plan))}")
+        return True
+
+    def pick_target_profile_index(self, reason: str) -> int:
+        if self.next_profile_index is not None:
+            # Target chosen elsewhere (fleet supervisor); consume it once.
+            target, self.next_profile_index = self.next_profile_index, None
+            return target
+        cur = self.state.current_profile_index
+        if self.planner is not None and reason in MEMORY_REASONS:
+            plan = self.plan_models()
+            if plan is not None and plan != frozenset(self.current_profile().models):
+                return self.profile_index_for(plan)
+        if reason in MEMORY_REASONS and self.prefer_lower_memory_on_overload:
+            cur_ram = self.profile_ram_gb(self.current_profile())
+            if cur_ram is not None:
+                candidates: List[Tuple[int, float]] = []
                 for idx, p in enumerate(self.profiles):
-                    if p.ram_gb is not None and p.ram_gb < cur_ram:
-                        candidates.append((idx, p.ram_gb))
+                    ram = self.profile_ram_gb(p)
+                    if ram is not None and ram < cur_ram:
+                        candidates.append((idx, ram))
                 if candidates:
+                    budget = self.model_budget_gb()
+                    if budget is not None:
+                        # Jump straight to the richest lighter profile that fits instead of stepping down.
+                        fitting = [c for c in candidates if c[1] <= budget]
+                        self.log(
+                            f"model memory budget={budget:.1f}GB, "
+                            + ", ".join(f"{self.profiles[i].name}={r:.1f}GB" for i, r in candidates)
+                        )
+                        if fitting:
+                            return max(fitting, key=lambda p: p[1])[0]
                     return sorted(candidates, key=lambda p: p[1])[0][0]
         return (cur + 1) % len(self.profiles)
 
     def switch_model(self, reason: str) -> str:
         self.state.current_model_index = self.pick_target_model_index(reason)
+        self.save_state()
         target = self.models[self.state.current_model_index].name
         scfg = self.config.get("switch", {})
-        cmd = scfg.get("command")
-        if cmd:
-            formatted = self.fill_cmd(cmd, model=target)
-            res = self.run_command(formatted, timeout=int(scfg.get("timeout_sec", 30)))
+        formatted = self.command("switch", {"model": target, "message": ""})
+        if formatted:
+            res = self.run_command(formatted, timeout=int(scfg.get("timeout_sec", 30)), kind="switch")
             if res.returncode != 0:
                 raise RuntimeError(f"switch command failed rc={res.returncode}, stderr={res.stderr.strip()}")
         self.log(f"switched model -> {target}")
         return target
 
     def switch_profile(self, reason: str) -> str:
+        target = self.select_profile(reason)
+        self.run_switch_command(target)
+        return target.name
+
+    def select_profile(self, reason: str) -> ProfileSpec:
         self.state.current_profile_index = self.pick_target_profile_index(reason)
-        target = self.current_profile()
+        self.save_state()
+        return self.current_profile()
+
+    def run_switch_command(self, target: ProfileSpec) -> None:
         scfg = self.config.get("switch", {})
-        cmd = scfg.get("command")
-        if cmd:
-            formatted = self.fill_cmd_with_profile(cmd, target)
-            res = self.run_command(formatted, timeout=int(scfg.get("timeout_sec", 30)))
+        formatted = self.command("switch", target.template_values())
+        if formatted:
+            res = self.run_command(formatted, timeout=int(scfg.get("timeout_sec", 30)), kind="switch")
             if res.returncode != 0:
                 raise RuntimeError(f"switch command failed rc={res.returncode}, stderr={res.stderr.strip()}")
         self.log(f"switched profile -> {target.name} models={','.join(target.models)}")
-        return target.name
+
+    def plan_profile_delta(
+        self, loaded: Set[str], target: ProfileSpec
+    ) -> Tuple[List[str], List[str], Optional[str]]:
+        """Models to unload and load to go from `loaded` to `target`, in an order that stays in budget.
+
+        Unloads come first, largest first, so memory is freed before anything new is mapped; loads
+        follow smallest first. Only models the config knows about are unloaded; anything else the
+        server has loaded stays and counts against the budget. Returns (unload, load, reason the
+        plan can't be used), the reason being set when the plan would exceed the budget or there is
+        no RSS snapshot yet to check it against.
+        """
+        by_name = {m.name: m for m in self.models}
+        managed = set(by_name).union(*(p.models for p in self.profiles))
+
+        def size(name: str) -> float:
+            spec = by_name.get(name)
+            return (spec.effective_ram_gb() if spec else None) or 0.0
+
+        unload = sorted((loaded & managed) - set(target.models), key=size, reverse=True)
+        load = sorted((m for m in target.models if m not in loaded), key=size)
+        budget = self.model_budget_gb()
+        if budget is None:
+            if not load:
+                return unload, load, None
+            return unload, load, "no RSS snapshot to check the memory budget"
+        resident = sum(size(m) for m in loaded) - sum(size(m) for m in unload)
+        for name in load:
+            resident += size(name)
+            if resident > budget:
+                return unload, load, f"loading {name} needs {resident:.1f}GB > budget {budget:.1f}GB"
+        return unload, load, None
+
+    def apply_profile_delta(self, prev: ProfileSpec, target: ProfileSpec) -> bool:
+        """Unload/load only the models that differ between profiles; False means fall back to a restart."""
+        loaded: Set[str] = set(prev.models)
+        if self.health_api_url:
+            try:
+                actual = self.loaded_models(float(self.config.get("health_check", {}).get("timeout_sec", 15)))
+            except Exception as e:  # noqa: BLE001
+                actual = None
+                self.log(f"incremental switch: cannot read loaded models: {e}")
+            if actual is not None:
+                # Ollama reports untagged names as "<name>:latest"; map back to configured names.
+                names = {m.name for m in self.models}
+                loaded = set()
+                for name in actual:
+                    base = name[: -len(":latest")] if name.endswith(":latest") else name
+                    loaded.add(base if base in names else name)
+        unload, load, over = self.plan_profile_delta(loaded, target)
+        if over:
+            self.log(f"incremental switch not possible ({over}), falling back to restart")
+            return False
+        ucfg = self.config.get("unload", {})
+        lcfg = self.config.get("load", {})
+        if (unload and "unload" not in self.commands) or (load and "load" not in self.commands):
+            self.log("incremental switch needs unload.command/load.command, falling back to restart")
+            return False
+        self.log(f"incremental switch: unload={','.join(unload) or '-'} load={','.join(load) or '-'}")
+        for kind, names, cfg in (("unload", unload, ucfg), ("load", load, lcfg)):
+            for name in names:
+                cmd = self.command(kind, {"model": name, "message": ""}) or []
+                res = self.run_command(cmd, timeout=int(cfg.get("timeout_sec", 120)), kind=kind)
+                if res.returncode != 0:
+                    self.log(
+                        f"{kind} {name} failed rc={res.returncode}, stderr={res.stderr.strip()}; falling back to restart"
+                    )
+                    return False
+        return True
 
     def restart_service(self) -> None:
         rcfg = self.config.get("restart", {})
-        cmd = rcfg.get("command")
+        cmd = self.command("restart")
         if not cmd:
             self.log("restart.command is empty, skip restart")
             return
-        res = self.run_command(cmd, timeout=int(rcfg.get("timeout_sec", 60)))
+        res = self.run_command(cmd, timeout=int(rcfg.get("timeout_sec", 60)), kind="restart")
         if res.returncode != 0:
             raise RuntimeError(f"restart command failed rc={res.returncode}, stderr={res.stderr.strip()}")
         self.log("service restart completed")
@@ -327,37 +3427,105 @@ class Watchdog:
             return False
 
         label = ecfg.get("name", "gemini")
-        cmd = ecfg.get("command")
+        cmd = self.command("emergency_fallback")
         if not cmd:
             self.log("emergency_fallback.command is empty, skip fallback")
             return False
 
         self.log(f"emergency fallback start -> {label} ({reason})")
-        res = self.run_command(cmd, timeout=int(ecfg.get("timeout_sec", 30)))
+        res = self.run_command(cmd, timeout=int(ecfg.get("timeout_sec", 30)), kind="emergency_fallback")
         if res.returncode != 0:
             self.log(f"emergency fallback command failed rc={res.returncode}, stderr={res.stderr.strip()}")
             return False
 
-        restart_cmd = ecfg.get("restart_command")
+        restart_cmd = self.command("emergency_restart")
         if restart_cmd:
-            rres = self.run_command(restart_cmd, timeout=int(ecfg.get("restart_timeout_sec", 60)))
+            rres = self.run_command(
+                restart_cmd, timeout=int(ecfg.get("restart_timeout_sec", 60)), kind="emergency_restart"
+            )
             if rres.returncode != 0:
                 self.log(
                     f"emergency fallback restart failed rc={rres.returncode}, stderr={rres.stderr.strip()}"
                 )
                 return False
 
-        self.log(f"emergency fallback activated -> {label}")
-        return True
+        self.log(f"emergency fallback activated -> {label}")
+        return True
+
+    def memory_action(self, mem: float) -> Optional[str]:
+        """Record a sample and return the recovery reason it calls for, if any."""
+        self.last_mem_percent = mem
+        self.trend.add(self.clock.monotonic(), mem)
+        reason: Optional[str] = None
+        if mem >= self.memory_threshold_percent:
+            reason = "memory_overload"
+        elif self.trend_lead_time_sec > 0 and not self.should_cooldown():
+            eta = self.trend.time_to(self.memory_threshold_percent)
+            if eta is not None and eta <= self.trend_lead_time_sec:
+                self.log(
+                    f"memory trend {self.trend.slope():+.2f}%/s, "
+                    f"threshold {self.memory_threshold_percent:.0f}% in {eta:.1f}s"
+                )
+                reason = "memory_trend"
+        if reason is None and self.planner is not None and self.upgrade_due(mem):
+            reason = "memory_upgrade"
+        self.record_metric(mem=mem, event=reason or "")
+        return reason
+
+    def probe_health(self) -> bool:
+        """health_ok() plus latency/result recording for the metrics store and exporter."""
+        start = time.perf_counter()
+        ok = self.health_ok()
+        elapsed = time.perf_counter() - start
+        self.telemetry.observe("health_check_duration_seconds", elapsed)
+        self.record_metric(latency_ms=elapsed * 1000, event="health_ok" if ok else "health_fail")
+        return ok
+
+    def render_metrics(self) -> str:
+        gauges: List[Tuple[str, Dict[str, str], float]] = []
+        if self.last_mem_percent is not None:
+            gauges.append(("memory_usage_percent", {}, self.last_mem_percent))
+        if self.profiles:
+            cur = self.current_profile().name
+            for p in self.profiles:
+                gauges.append(("active_profile", {"profile": p.name}, 1.0 if p.name == cur else 0.0))
+        else:
+            cur = self.current_model().name
+            for m in self.models:
+                gauges.append(("active_model", {"model": m.name}, 1.0 if m.name == cur else 0.0))
+        gauges.append(("health_fail_count", {}, float(self.state.health_fail_count)))
+        if self.proxy is not None:
+            gauges.append(("proxy_inflight", {}, float(self.proxy.inflight)))
+            gauges.append(("proxy_queued", {}, float(self.proxy.queued)))
+        if self.state.last_action_ts:
+            gauges.append(("seconds_since_last_action", {}, max(self.clock.time() - self.state.last_action_ts, 0.0)))
+        return self.telemetry.render(gauges)
+
+    def next_sample_interval(self, mem: Optional[float]) -> float:
+        """Sample fast while memory is rising or near the threshold, back off while it is flat."""
+        if not self.adaptive_enabled or mem is None:
+            return float(self.interval_sec)
+        rate = self.trend.slope()
+        if mem >= self.memory_threshold_percent - self.near_threshold_percent or rate >= self.rising_rate_percent_per_sec:
+            self.sample_interval_sec = self.min_sample_interval_sec
+        elif abs(rate) <= self.flat_rate_percent_per_sec:
+            self.sample_interval_sec = min(self.sample_interval_sec * 2, self.max_sample_interval_sec)
+        return self.sample_interval_sec
 
     def should_cooldown(self) -> bool:
-        return time.time() - self.state.last_action_ts < self.cooldown_sec
+        return self.clock.time() - self.state.last_action_ts < self.cooldown_sec
 
     def recover(self, reason: str, mem_percent: Optional[float] = None) -> None:
         if self.should_cooldown():
             self.log(f"in cooldown ({self.cooldown_sec}s), skip recovery. reason={reason}")
+            self.telemetry.inc("recoveries_total", reason=reason, result="cooldown")
             return
 
+        with self.tracer.span("recovery", reason=reason) as root:
+            self.run_recovery(reason, mem_percent, root)
+        self.report_recovery_trace(root)
+
+    def run_recovery(self, reason: str, mem_percent: Optional[float], root: Span) -> None:
         cur = self.current_model().name
         before = f"model={cur}"
         if self.profiles:
@@ -365,42 +3533,122 @@ class Watchdog:
             before = f"profile={cur}"
         if mem_percent is not None:
             before += f", memory={mem_percent:.2f}%"
-        self.log(f"recovery start: {reason}, {before}")
+        self.log(f"recovery start: {reason}, {before}", event="recovery_start", reason=reason, source=cur)
+        if reason in MEMORY_REASONS:
+            with self.tracer.span("rss_refresh"):
+                self.update_rss(force=True)
 
         err: Optional[str] = None
         target = cur
+        fallback_active = False
+        if self.proxy is not None:
+            # Let in-flight requests finish before the service goes away; new ones wait in the queue.
+            with self.tracer.span("drain") as span:
+                span.attrs["drained"] = self.proxy.drain()
+        # The service goes down from the switch onwards; don't count those probe failures.
+        self.warming_up = self.readiness_enabled
         try:
-            if self.profiles:
-                target = self.switch_profile(reason=reason)
+            incremental = False
+            if self.profiles and self.incremental_switch and reason in MEMORY_REASONS:
+                # Memory-driven switches only change which models are resident: no switch command and
+                # no restart unless the delta can't be applied. A health failure still gets both.
+                prev = self.current_profile()
+                with self.tracer.span("incremental_switch") as span:
+                    spec = self.select_profile(reason)
+                    incremental = self.apply_profile_delta(prev, spec)
+                    span.attrs["ok"] = incremental
+                target = spec.name
+                if incremental:
+                    self.log(f"switched profile -> {target} models={','.join(spec.models)} (incremental)")
+                else:
+                    with self.tracer.span("switch_profile"):
+                        self.run_switch_command(spec)
+            elif self.profiles:
+                with self.tracer.span("switch_profile"):
+                    target = self.switch_profile(reason=reason)
             else:
-                target = self.switch_model(reason=reason)
-            self.restart_service()
+                with self.tracer.span("switch_model"):
+                    target = self.switch_model(reason=reason)
+            if not incremental:
+                with self.tracer.span("restart_service"):
+                    self.restart_service()
+            if self.readiness_enabled:
+                with self.tracer.span("readiness") as span:
+                    ready_sec = self.wait_until_ready()
+                    span.attrs["ready"] = ready_sec is not None
+                if ready_sec is None:
+                    raise RuntimeError("service not ready before readiness deadline")
+                root.attrs["time_to_ready_sec"] = round(ready_sec, 3)
         except Exception as e:  # noqa: BLE001
             err = str(e)
             self.log(f"recovery error: {err}")
             if "restart command failed" in err:
-                ok = self.activate_emergency_fallback("restart_failed")
+                with self.tracer.span("emergency_fallback"):
+                    ok = self.activate_emergency_fallback("restart_failed")
                 if ok:
-                    self.notify(
-                        "[Watchdog] Emergency fallback activated",
-                        "restart failed; switched to emergency fallback (gemini/openclaw).",
-                    )
+                    fallback_active = True
+                    self.record_metric(event="emergency_fallback")
+                    with self.tracer.span("notify"):
+                        self.notify(
+                            "[Watchdog] Emergency fallback activated",
+                            "restart failed; switched to emergency fallback (gemini/openclaw).",
+                        )
 
-        self.state.last_action_ts = time.time()
-        if err:
-            self.notify(
-                "[Watchdog] Recovery failed",
-                f"reason={reason}; from={cur}; to={target}; error={err}",
-            )
-        else:
-            self.notify(
-                "[Watchdog] Recovery completed",
-                f"reason={reason}; from={cur}; to={target}",
-            )
+        self.warming_up = False
+        if self.proxy is not None:
+            if fallback_active:
+                self.proxy.use_fallback()
+            elif err is None:
+                self.proxy.use_primary()
+            self.proxy.resume()
+        root.attrs.update({"from": cur, "to": target, "ok": err is None})
+        self.state.last_action_ts = self.clock.time()
+        self.save_state()
+        self.record_metric(event="recovery_failed" if err else "recovery_ok")
+        self.telemetry.inc("recoveries_total", reason=reason, result="failed" if err else "ok")
+        with self.tracer.span("notify"):
+            if err:
+                self.notify(
+                    "[Watchdog] Recovery failed",
+                    f"reason={reason}; from={cur}; to={target}; error={err}",
+                )
+            else:
+                self.notify(
+                    "[Watchdog] Recovery completed",
+                    f"reason={reason}; from={cur}; to={target}",
+                )
+
+    def report_recovery_trace(self, root: Span) -> None:
+        """One summary record per recovery, plus a Chrome trace file for slow ones."""
+        phases = []
+        for c in root.children:
+            rcs = [str(d.attrs["rc"]) for d in c.walk() if "rc" in d.attrs]
+            phases.append(f"{c.name}={c.duration:.2f}s" + (f"(rc={','.join(rcs)})" if rcs else ""))
+        self.log(
+            f"recovery trace: reason={root.attrs.get('reason')} total={root.duration:.2f}s "
+            f"cpu={root.cpu_total * 1000:.0f}ms {' '.join(phases)}",
+            event="recovery_trace",
+            trace=root.to_dict(),
+        )
+        tcfg = self.config.get("tracing", {})
+        trace_dir = tcfg.get("chrome_trace_dir")
+        if not trace_dir or root.duration < float(tcfg.get("slow_recovery_sec", 30)):
+            return
+        stamp = datetime.fromtimestamp(root.wall_start).strftime("%Y%m%d-%H%M%S")
+        path = Path(trace_dir) / f"recovery-{stamp}-{root.attrs.get('reason')}.trace.json"
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(chrome_trace(root), f)
+            self.log(f"slow recovery trace written to {path}")
+        except OSError as e:
+            self.log(f"write recovery trace failed: {e}")
 
     def loop(self) -> None:
         self.log("watchdog started")
+        next_health = self.clock.monotonic()
         while True:
+            self.maybe_reload_config()
             try:
                 mem = self.memory_usage_percent()
             except Exception as e:  # noqa: BLE001
@@ -408,21 +3656,1193 @@ class Watchdog:
                 mem = None
 
             if mem is not None:
-                self.log(f"memory usage={mem:.2f}%")
-                if mem >= self.memory_threshold_percent:
-                    self.recover("memory_overload", mem_percent=mem)
+                self.log_memory(mem)
+                reason = self.memory_action(mem)
+                if reason:
+                    self.recover(reason, mem_percent=mem)
 
-            ok = self.health_ok()
-            if ok:
-                self.state.health_fail_count = 0
-            else:
-                self.state.health_fail_count += 1
-                self.log(f"health fail count={self.state.health_fail_count}")
-                if self.state.health_fail_count >= self.consecutive_health_fail_limit:
+            if self.clock.monotonic() >= next_health:
+                if self.record_health(self.probe_health()):
                     self.recover("health_check_failed")
-                    self.state.health_fail_count = 0
+                    self.reset_health_failures()
+                next_health = self.clock.monotonic() + self.interval_sec
+
+            delay = self.next_sample_interval(mem)
+            self.clock.sleep(max(min(delay, next_health - self.clock.monotonic()), 0))
+
+
+class AsyncEngine:
+    """Runs memory sampling, health probes, recovery and notifications as separate asyncio tasks.
+
+    Blocking work (vm_stat, health commands, switch/restart, webhooks) runs on dedicated
+    thread pools so a hung probe or notification never delays the next memory sample.
+    """
+
+    def __init__(self, watchdog: Watchdog):
+        self.wd = watchdog
+        self.configure()
+        self.memory_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="wd-mem")
+        self.health_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="wd-health")
+        self.recovery_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="wd-recover")
+        self.notify_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="wd-notify")
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.recovery_task: Optional[asyncio.Task] = None
+        # Requests turned away while recovery_task runs; only the first one is logged.
+        self.skipped_recoveries = 0
+        self.notify_tasks: Set[asyncio.Task] = set()
+        self.pending_memory: Optional[concurrent.futures.Future] = None
+        self.pending_health: Optional[concurrent.futures.Future] = None
+
+    def configure(self) -> None:
+        """Derive intervals and deadlines from the watchdog's current config (again after a reload)."""
+        acfg = self.wd.config.get("async_engine", {})
+        hc = self.wd.config.get("health_check", {})
+        self.health_interval_sec = float(acfg.get("health_interval_sec", self.wd.interval_sec))
+        # Legacy checks run command then URL back to back; named probes run concurrently.
+        if self.wd.health_probes:
+            default_deadline = max(p.timeout_sec for p in self.wd.health_probes) + 1
+        else:
+            default_deadline = int(hc.get("timeout_sec", 15)) * 2
+        self.health_deadline_sec = float(acfg.get("health_deadline_sec", default_deadline))
+        self.notify_deadline_sec = float(acfg.get("notify_deadline_sec", 30))
+
+    def run(self) -> None:
+        try:
+            asyncio.run(self.main())
+        finally:
+            for pool in (self.memory_pool, self.health_pool, self.recovery_pool, self.notify_pool):
+                pool.shutdown(wait=False)
+
+    async def main(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        # With the notification queue enabled delivery is already off-loop; otherwise spawn tasks.
+        own_dispatch = self.wd.notify_dispatcher is None
+        if own_dispatch:
+            self.wd.notify_dispatcher = self.dispatch_notification
+        self.wd.log("watchdog started (engine=asyncio)")
+        tasks = [
+            asyncio.create_task(self.memory_task(), name="memory"),
+            asyncio.create_task(self.health_task(), name="health"),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for task in list(self.notify_tasks):
+                task.cancel()
+            if self.recovery_task is not None:
+                self.recovery_task.cancel()
+            if own_dispatch:
+                self.wd.notify_dispatcher = None
+
+    async def run_blocking(
+        self,
+        pool: concurrent.futures.ThreadPoolExecutor,
+        fn: Callable[..., Any],
+        deadline: float,
+        *args: Any,
+    ) -> Any:
+        return await self.wait_blocking(pool.submit(fn, *args), deadline)
+
+    async def wait_blocking(self, fut: concurrent.futures.Future, deadline: float) -> Any:
+        # shield() keeps the worker future alive on timeout; callers that stored `fut` beforehand
+        # can then see the worker is still stuck instead of queueing more work behind it.
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), timeout=deadline)
+
+    async def sleep_until(self, deadline: float) -> float:
+        assert self.loop is not None
+        now = self.loop.time()
+        if deadline <= now:
+            return now
+        await asyncio.sleep(deadline - now)
+        return self.loop.time()
+
+    def next_deadline(self, deadline: float, interval: float) -> float:
+        assert self.loop is not None
+        deadline += interval
+        now = self.loop.time()
+        if deadline < now:
+            # Skip missed ticks instead of bursting to catch up.
+            missed = int((now - deadline) // interval) + 1
+            deadline += missed * interval
+        return deadline
+
+    async def memory_task(self) -> None:
+        assert self.loop is not None
+        deadline = self.loop.time()
+        while True:
+            # Never swap config under a running switch/restart; the change is picked up afterwards.
+            if (self.recovery_task is None or self.recovery_task.done()) and self.wd.maybe_reload_config():
+                self.configure()
+            timeout = float(self.wd.interval_sec)
+            mem: Optional[float] = None
+            if self.pending_memory is not None and not self.pending_memory.done():
+                self.wd.log("memory monitor still busy, skip sample")
+            else:
+                # Stored before awaiting so a timed-out sample still blocks the next submission.
+                self.pending_memory = self.memory_pool.submit(self.wd.memory_usage_percent)
+                try:
+                    mem = await self.wait_blocking(self.pending_memory, timeout)
+                    self.pending_memory = None
+                except asyncio.TimeoutError:
+                    self.wd.log(f"memory monitor timed out after {timeout:.1f}s")
+                except Exception as e:  # noqa: BLE001
+                    self.wd.log(f"memory monitor error: {e}")
+
+            if mem is not None:
+                self.wd.log_memory(mem)
+                reason = self.wd.memory_action(mem)
+                if reason:
+                    self.start_recovery(reason, mem)
+
+            deadline = self.next_deadline(deadline, self.wd.next_sample_interval(mem))
+            await self.sleep_until(deadline)
+
+    async def health_task(self) -> None:
+        assert self.loop is not None
+        deadline = self.loop.time()
+        while True:
+            ok = False
+            if self.pending_health is not None and not self.pending_health.done():
+                self.wd.log("previous health probe still running, counting as failure")
+            else:
+                self.pending_health = self.health_pool.submit(self.wd.probe_health)
+                try:
+                    ok = await self.wait_blocking(self.pending_health, self.health_deadline_sec)
+                    self.pending_health = None
+                except asyncio.TimeoutError:
+                    self.wd.log(f"health probe exceeded {self.health_deadline_sec:.1f}s deadline")
+                except Exception as e:  # noqa: BLE001
+                    self.wd.log(f"health probe error: {e}")
+
+            if self.wd.record_health(ok):
+                if self.start_recovery("health_check_failed"):
+                    self.wd.reset_health_failures()
+
+            deadline = self.next_deadline(deadline, self.health_interval_sec)
+            await self.sleep_until(deadline)
+
+    def start_recovery(self, reason: str, mem_percent: Optional[float] = None) -> bool:
+        if self.recovery_task is not None and not self.recovery_task.done():
+            if not self.skipped_recoveries:
+                self.wd.log(f"recovery already running, skip until it ends. reason={reason}")
+            self.skipped_recoveries += 1
+            return False
+        self.skipped_recoveries = 0
+        self.recovery_task = asyncio.create_task(self.recovery(reason, mem_percent), name=f"recover:{reason}")
+        return True
+
+    async def recovery(self, reason: str, mem_percent: Optional[float]) -> None:
+        assert self.loop is not None
+        try:
+            await self.loop.run_in_executor(self.recovery_pool, self.wd.recover, reason, mem_percent)
+        except Exception as e:  # noqa: BLE001
+            self.wd.log(f"recovery task error: {e}")
+
+    def dispatch_notification(self, title: str, detail: str) -> None:
+        # Called from the recovery thread; hop onto the event loop to spawn the task.
+        assert self.loop is not None
+        self.loop.call_soon_threadsafe(self.spawn_notification, title, detail)
+
+    def spawn_notification(self, title: str, detail: str) -> None:
+        task = asyncio.create_task(self.notification(title, detail), name="notify")
+        self.notify_tasks.add(task)
+        task.add_done_callback(self.notify_tasks.discard)
+
+    async def notification(self, title: str, detail: str) -> None:
+        try:
+            await self.run_blocking(
+                self.notify_pool, self.wd.deliver_notification, self.notify_deadline_sec, title, detail
+            )
+        except asyncio.TimeoutError:
+            self.wd.log(f"notification exceeded {self.notify_deadline_sec:.1f}s deadline: {title}")
+        except Exception as e:  # noqa: BLE001
+            self.wd.log(f"notification error: {e}")
+
+
+FLEET_PORT = 47800
+
+
+def load_fleet_framing() -> Tuple[Callable[[Dict[str, Any], str], bytes], Callable[[bytes, str], Dict[str, Any]]]:
+    """HMAC-signed framing shared with remote_km (remote_km/common.py, or common.py installed alongside).
+
+    Loaded under its own module name so neither sys.path nor another module called `common` is touched.
+    """
+    module = sys.modules.get("remote_km_common")
+    if module is None:
+        here = Path(__file__).resolve().parent
+        path = next((p for p in (here / "remote_km" / "common.py", here / "common.py") if p.exists()), None)
+        if path is None:
+            raise ImportError(f"remote_km/common.py not found next to {here}")
+        spec = importlib.util.spec_from_file_location("remote_km_common", path)
+        assert spec is not None and spec.loader is not None
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules["remote_km_common"] = module
+    return module.pack_message, module.unpack_message
+
+
+class ReplayGuard:
+    """Rejects datagrams outside the clock-skew window or not newer than the last one from that peer."""
+
+    def __init__(self, max_skew_sec: float = 30.0):
+        self.max_skew_sec = max_skew_sec
+        self.last_seq: Dict[Tuple[str, int], int] = {}
+
+    def accept(self, peer: Tuple[str, int], msg: Dict[str, Any]) -> bool:
+        try:
+            seq = int(msg["seq"])
+            ts = float(msg["ts"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        if abs(time.time() - ts) > self.max_skew_sec:
+            return False
+        if seq <= self.last_seq.get(peer, -1):
+            return False
+        self.last_seq[peer] = seq
+        return True
+
+
+class FleetEndpoint(asyncio.DatagramProtocol):
+    """Signed UDP endpoint: sequence numbering, replay filtering and request/reply matching."""
+
+    def __init__(self, watchdog: Watchdog, secret: str, max_skew_sec: float = 30.0):
+        if not secret:
+            raise ValueError("fleet.secret must not be empty")
+        self.wd = watchdog
+        self.secret = secret
+        self.pack, self.unpack = load_fleet_framing()
+        self.guard = ReplayGuard(max_skew_sec)
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        # Seeded from the clock so a restarted process is not mistaken for a replay.
+        self.seq = int(time.time() * 1000)
+        self.waiters: Dict[Tuple[int, str], asyncio.Future] = {}
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+
+    def send(self, msg: Dict[str, Any], addr: Tuple[str, int]) -> int:
+        assert self.transport is not None
+        self.seq += 1
+        msg["seq"] = self.seq
+        msg["ts"] = time.time()
+        self.transport.sendto(self.pack(msg, self.secret), addr)
+        return self.seq
+
+    async def request(
+        self, msg: Dict[str, Any], addr: Tuple[str, int], reply: str, timeout: float
+    ) -> Optional[Dict[str, Any]]:
+        """Send `msg` and wait for the `reply`-typed answer to it; None on timeout."""
+        return await self.wait_reply(self.send(msg, addr), reply, timeout)
+
+    async def wait_reply(self, seq: int, reply: str, timeout: float) -> Optional[Dict[str, Any]]:
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters[(seq, reply)] = fut
+        try:
+            return await asyncio.wait_for(fut, timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.waiters.pop((seq, reply), None)
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        try:
+            msg = self.unpack(data, self.secret)
+        except (ValueError, KeyError, TypeError, UnicodeDecodeError) as e:
+            self.wd.log(f"fleet: dropped datagram from {addr[0]}:{addr[1]}: {e}")
+            return
+        if not isinstance(msg, dict) or not self.guard.accept(addr, msg):
+            return
+        re_seq = msg.get("re")
+        if re_seq is not None:
+            fut = self.waiters.get((int(re_seq), str(msg.get("t"))))
+            if fut is not None and not fut.done():
+                fut.set_result(msg)
+            return
+        self.handle(msg, addr)
+
+    def handle(self, msg: Dict[str, Any], addr: Tuple[str, int]) -> None:
+        pass
+
+
+class FleetAgent(FleetEndpoint):
+    """Runs on each OpenClaw host: reports memory/health and applies profile changes.
+
+    A background task probes every probe_interval_sec and polls are answered from its latest
+    round, so a slow health probe never makes the host look unreachable. When no supervisor has
+    polled for fallback_after_sec, the agent applies the local watchdog rules itself until polls
+    resume.
+    """
+
+    def __init__(
+        self,
+        watchdog: Watchdog,
+        secret: str,
+        max_skew_sec: float = 30.0,
+        probe_interval_sec: Optional[float] = None,
+        fallback_after_sec: float = 30.0,
+    ):
+        super().__init__(watchdog, secret, max_skew_sec)
+        if not watchdog.profiles:
+            raise ValueError("fleet agent requires config.profiles")
+        self.probe_interval_sec = float(probe_interval_sec or watchdog.interval_sec)
+        self.fallback_after_sec = fallback_after_sec
+        self.probe_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="wd-agent")
+        self.apply_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="wd-apply")
+        self.apply_id: Optional[str] = None
+        self.apply_result: Optional[Dict[str, Any]] = None
+        self.sample: Optional[Dict[str, Any]] = None
+        self.sample_at = 0.0
+        self.sample_ready = asyncio.Event()
+        self.last_poll_at = time.monotonic()
+        self.local_mode = False
+        self.local_counter = 0
+
+    def busy(self) -> bool:
+        return self.apply_id is not None and self.apply_result is None
+
+    def handle(self, msg: Dict[str, Any], addr: Tuple[str, int]) -> None:
+        kind = msg.get("t")
+        if kind == "poll":
+            self.last_poll_at = time.monotonic()
+            asyncio.ensure_future(self.answer_poll(msg, addr))
+        elif kind == "apply":
+            self.start_apply(msg, addr)
+
+    def probe(self, with_health: bool) -> Dict[str, Any]:
+        mem = self.wd.memory_usage_percent()
+        self.wd.last_mem_percent = mem
+        return {"mem": round(mem, 2), "ok": self.wd.health_ok(quiet=True) if with_health else None}
+
+    async def probe_task(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            busy = self.busy()
+            if not busy:
+                self.wd.maybe_reload_config()
+            try:
+                # Health is meaningless while a switch/restart is in progress; sample memory only.
+                sample = await loop.run_in_executor(self.probe_pool, self.probe, not busy)
+            except Exception as e:  # noqa: BLE001
+                self.wd.log(f"fleet agent: probe error: {e}")
+            else:
+                self.sample = sample
+                self.sample_at = time.monotonic()
+                self.sample_ready.set()
+                if not busy:
+                    self.check_fallback(sample)
+            await asyncio.sleep(self.probe_interval_sec)
+
+    async def answer_poll(self, msg: Dict[str, Any], addr: Tuple[str, int]) -> None:
+        # Only the very first poll waits, for the first probe round.
+        await self.sample_ready.wait()
+        assert self.sample is not None
+        busy = self.busy()
+        sample = dict(self.sample, ok=None) if busy else self.sample
+        self.send(
+            dict(
+                sample,
+                t="report",
+                re=msg["seq"],
+                profile=self.wd.current_profile().name,
+                busy=busy,
+                age=round(time.monotonic() - self.sample_at, 2),
+            ),
+            addr,
+        )
+
+    def check_fallback(self, sample: Dict[str, Any]) -> None:
+        """Without a supervisor, act on memory and health like the standalone watchdog loop."""
+        silent = time.monotonic() - self.last_poll_at
+        if silent < self.fallback_after_sec:
+            if self.local_mode:
+                self.local_mode = False
+                self.wd.log("fleet agent: supervisor is polling again, leaving local mode")
+            return
+        if not self.local_mode:
+            self.local_mode = True
+            self.wd.log(f"fleet agent: no poll for {silent:.0f}s, applying local rules until the supervisor returns")
+        reason = self.wd.memory_action(sample["mem"])
+        if reason is None and sample["ok"] is not None and self.wd.record_health(sample["ok"]):
+            reason = "health_check_failed"
+        if reason is None:
+            return
+        self.local_counter += 1
+        self.apply_id = f"local-{self.local_counter}"
+        self.apply_result = None
+        asyncio.ensure_future(self.finish_local(reason, sample["mem"]))
+
+    async def finish_local(self, reason: str, mem: float) -> None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.apply_pool, self.wd.recover, reason, mem)
+        except Exception as e:  # noqa: BLE001
+            self.wd.log(f"fleet agent: local recovery failed: {e}")
+        if reason == "health_check_failed":
+            self.wd.reset_health_failures()
+        self.apply_result = {"ok": True, "profile": self.wd.current_profile().name}
+
+    def start_apply(self, msg: Dict[str, Any], addr: Tuple[str, int]) -> None:
+        apply_id = str(msg.get("id"))
+        if apply_id == self.apply_id:
+            # Retransmitted request: acknowledge again (and repeat the result if finished).
+            self.send({"t": "accepted", "re": msg["seq"]}, addr)
+            if self.apply_result is not None:
+                self.send(dict(self.apply_result, t="done", re=msg["seq"]), addr)
+            return
+        if self.apply_id is not None and self.apply_result is None:
+            self.send({"t": "accepted", "re": msg["seq"], "busy": True}, addr)
+            return
+        self.apply_id = apply_id
+        self.apply_result = None
+        self.send({"t": "accepted", "re": msg["seq"]}, addr)
+        asyncio.ensure_future(self.finish_apply(msg, addr))
+
+    def run_apply(self, profile: Optional[str], reason: str, mem: Optional[float]) -> Dict[str, Any]:
+        names = [p.name for p in self.wd.profiles]
+        if profile is not None and profile not in names:
+            return {"ok": False, "error": f"unknown profile {profile}", "profile": self.wd.current_profile().name}
+        self.wd.next_profile_index = names.index(profile) if profile is not None else None
+        with self.wd.tracer.span("recovery", reason=reason) as root:
+            self.wd.run_recovery(reason, mem, root)
+        self.wd.report_recovery_trace(root)
+        return {"ok": bool(root.attrs.get("ok")), "profile": self.wd.current_profile().name}
+
+    async def finish_apply(self, msg: Dict[str, Any], addr: Tuple[str, int]) -> None:
+        self.wd.log(f"fleet: apply requested by {addr[0]}: profile={msg.get('profile')} reason={msg.get('reason')}")
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.apply_pool, self.run_apply, msg.get("profile"), str(msg.get("reason", "fleet")), msg.get("mem")
+            )
+        except Exception as e:  # noqa: BLE001
+            result = {"ok": False, "error": str(e), "profile": self.wd.current_profile().name}
+        self.apply_result = result
+        self.send(dict(result, t="done", re=msg["seq"]), addr)
+
+    async def serve(self, bind: str, port: int) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=(bind, port))
+        self.wd.log(f"fleet agent listening on {bind}:{port}, profile={self.wd.current_profile().name}")
+        prober = asyncio.create_task(self.probe_task(), name="probe")
+        try:
+            await prober
+        finally:
+            prober.cancel()
+            if self.transport is not None:
+                self.transport.close()
+            self.probe_pool.shutdown(wait=False)
+            self.apply_pool.shutdown(wait=False)
+
+
+@dataclass
+class FleetHost:
+    name: str
+    addr: Tuple[str, int]
+    state: str = "unknown"  # unknown | ok | overloaded | unhealthy | changing | unreachable
+    mem: Optional[float] = None
+    profile: Optional[str] = None
+    health_fail_count: int = 0
+    missed: int = 0
+    last_action_ts: float = 0.0
+    # Last hold/skip message, so a waiting host logs once per reason instead of every poll.
+    note: str = ""
+
+
+class FleetSupervisor(FleetEndpoint):
+    """One asyncio state machine per host, with fleet-wide limits on concurrent downgrades.
+
+    Overloaded hosts step down one profile at a time; at most max_parallel_changes hosts change
+    at once, changes are spaced by stagger_sec, and a host only drops to the lowest profile while
+    at least min_hosts_above_lowest other reachable hosts stay above it (unless memory is critical).
+    """
+
+    def __init__(self, watchdog: Watchdog, fcfg: Dict[str, Any]):
+        super().__init__(watchdog, str(fcfg.get("secret", "")), float(fcfg.get("max_skew_sec", 30)))
+        if not watchdog.profiles:
+            raise ValueError("fleet mode requires config.profiles")
+        self.hosts: List[FleetHost] = []
+        for i, raw in enumerate(fcfg.get("hosts", [])):
+            if "host" not in raw:
+                raise ValueError(f"fleet.hosts[{i}] requires host")
+            addr = (str(raw["host"]), int(raw.get("port", FLEET_PORT)))
+            self.hosts.append(FleetHost(name=str(raw.get("name", f"{addr[0]}:{addr[1]}")), addr=addr))
+        if not self.hosts:
+            raise ValueError("fleet.hosts must not be empty")
+        self.poll_interval_sec = float(fcfg.get("poll_interval_sec", watchdog.interval_sec))
+        # An agent answers its first poll only after its first probe round, so a poll must outlast a probe.
+        probe_timeout = watchdog.health_timeout_sec()
+        self.timeout_sec = float(fcfg.get("timeout_sec", max(2.0, probe_timeout + 1)))
+        if self.timeout_sec <= probe_timeout:
+            raise ValueError(
+                f"fleet.timeout_sec ({self.timeout_sec:g}s) must exceed the health probe timeout ({probe_timeout:g}s)"
+            )
+        self.apply_timeout_sec = float(fcfg.get("apply_timeout_sec", 300))
+        self.unreachable_after = int(fcfg.get("unreachable_after", 3))
+        self.max_parallel_changes = int(fcfg.get("max_parallel_changes", 1))
+        self.stagger_sec = float(fcfg.get("stagger_sec", 10))
+        self.min_hosts_above_lowest = int(fcfg.get("min_hosts_above_lowest", 1))
+        self.critical_percent = float(fcfg.get("critical_percent", min(watchdog.memory_threshold_percent + 8, 99)))
+        self.summary_interval_sec = float(fcfg.get("summary_interval_sec", 60))
+        # Profiles ordered richest first; configured ram_gb when present, else config order.
+        order = list(range(len(watchdog.profiles)))
+        if all(watchdog.profile_ram_gb(p) is not None for p in watchdog.profiles):
+            order.sort(key=lambda i: -(watchdog.profile_ram_gb(watchdog.profiles[i]) or 0.0))
+        self.ladder = [watchdog.profiles[i].name for i in order]
+        self.changing: Set[str] = set()
+        self.last_change_ts = 0.0
+        self.apply_counter = 0
+
+    def step_down(self, profile: Optional[str]) -> Optional[str]:
+        if profile not in self.ladder:
+            return self.ladder[-1]
+        idx = self.ladder.index(profile)
+        return self.ladder[idx + 1] if idx + 1 < len(self.ladder) else None
+
+    def hold_reason(self, host: FleetHost, target: Optional[str]) -> Optional[str]:
+        """Why this change must wait for the rest of the fleet; None when it may start now."""
+        if len(self.changing) >= self.max_parallel_changes:
+            return f"{len(self.changing)} host(s) already changing"
+        since = time.monotonic() - self.last_change_ts
+        if self.last_change_ts and since < self.stagger_sec:
+            return f"last fleet change {since:.0f}s ago"
+        rank = self.ladder.index(host.profile) if host.profile in self.ladder else len(self.ladder)
+        for other in self.hosts:
+            if other is host or other.state != "overloaded" or other.profile not in self.ladder:
+                continue
+            if self.ladder.index(other.profile) < rank:
+                # Level the fleet: hosts on richer profiles step down first.
+                return f"{other.name} on richer profile {other.profile} goes first"
+        if target == self.ladder[-1] and (host.mem or 0.0) < self.critical_percent:
+            above = [
+                h
+                for h in self.hosts
+                if h is not host and h.state not in ("unreachable", "unknown") and h.profile != self.ladder[-1]
+            ]
+            if len(above) < self.min_hosts_above_lowest:
+                return f"would leave fewer than {self.min_hosts_above_lowest} host(s) above {target}"
+        return None
+
+    def set_state(self, host: FleetHost, state: str) -> None:
+        if host.state == state:
+            return
+        self.wd.log(f"fleet: {host.name} {host.state} -> {state}", event="fleet_state", host=host.name, state=state)
+        if state == "unreachable":
+            self.wd.notify("[Watchdog] Fleet host unreachable", f"host={host.name}")
+        elif host.state == "unreachable":
+            self.wd.notify("[Watchdog] Fleet host back", f"host={host.name}; profile={host.profile}")
+        host.state = state
+
+    async def poll(self, host: FleetHost) -> None:
+        report = await self.request({"t": "poll"}, host.addr, "report", self.timeout_sec)
+        if report is None:
+            host.missed += 1
+            if host.missed >= self.unreachable_after:
+                self.set_state(host, "unreachable")
+            return
+        host.missed = 0
+        host.mem = float(report.get("mem", 0.0))
+        host.profile = report.get("profile")
+        if host.name in self.changing:
+            return
+        if report.get("busy"):
+            self.set_state(host, "changing")
+            return
+        if report.get("ok") is False:
+            host.health_fail_count += 1
+        elif report.get("ok"):
+            host.health_fail_count = 0
+
+        if host.mem >= self.wd.memory_threshold_percent:
+            self.set_state(host, "overloaded")
+            await self.act(host, "memory_overload", self.step_down(host.profile))
+        elif host.health_fail_count >= self.wd.consecutive_health_fail_limit:
+            self.set_state(host, "unhealthy")
+            # The agent keeps its local rule for health failures (rotate to the next profile).
+            await self.act(host, "health_failed", None)
+        else:
+            host.note = ""
+            self.set_state(host, "ok")
+
+    def note(self, host: FleetHost, msg: str) -> None:
+        if msg != host.note:
+            host.note = msg
+            self.wd.log(f"fleet: {msg}")
+
+    async def act(self, host: FleetHost, reason: str, target: Optional[str]) -> None:
+        if reason == "memory_overload" and target is None:
+            self.note(host, f"{host.name} already on lowest profile {host.profile}")
+            return
+        if time.time() - host.last_action_ts < self.wd.cooldown_sec:
+            return
+        hold = self.hold_reason(host, target)
+        if hold:
+            self.note(host, f"hold {host.name} -> {target or 'next'} ({reason}): {hold}")
+            return
+        host.note = ""
+        # Reserve the slot before the first await so concurrent host tasks see it.
+        self.changing.add(host.name)
+        self.last_change_ts = time.monotonic()
+        host.last_action_ts = time.time()
+        self.set_state(host, "changing")
+        try:
+            await self.apply(host, reason, target)
+        finally:
+            self.changing.discard(host.name)
+            host.health_fail_count = 0
+
+    async def apply(self, host: FleetHost, reason: str, target: Optional[str]) -> None:
+        self.apply_counter += 1
+        msg = {"t": "apply", "id": f"{self.seq}-{self.apply_counter}", "profile": target, "reason": reason, "mem": host.mem}
+        self.wd.log(f"fleet: {host.name} {host.profile} -> {target or 'next'} ({reason}, memory={host.mem:.1f}%)")
+        start = time.monotonic()
+        done: Optional[Dict[str, Any]] = None
+        # Resend until accepted; the agent dedupes by id, so a lost ack never runs the change twice.
+        for _ in range(3):
+            fut = asyncio.get_running_loop().create_future()
+            seq = self.send(dict(msg), host.addr)
+            self.waiters[(seq, "done")] = fut
+            accepted = await self.wait_reply(seq, "accepted", self.timeout_sec)
+            if accepted is None:
+                self.waiters.pop((seq, "done"), None)
+                continue
+            if accepted.get("busy"):
+                self.waiters.pop((seq, "done"), None)
+                self.wd.log(f"fleet: {host.name} busy with another change")
+                return
+            try:
+                done = await asyncio.wait_for(fut, timeout=self.apply_timeout_sec)
+            except asyncio.TimeoutError:
+                done = None
+            finally:
+                self.waiters.pop((seq, "done"), None)
+            break
+        elapsed = time.monotonic() - start
+        self.wd.telemetry.inc("fleet_changes_total", host=host.name, result="ok" if done and done.get("ok") else "failed")
+        if done is None:
+            self.wd.log(f"fleet: {host.name} change got no result after {elapsed:.0f}s")
+            return
+        host.profile = done.get("profile", host.profile)
+        if done.get("ok"):
+            self.wd.log(f"fleet: {host.name} now on {host.profile} ({elapsed:.1f}s)")
+        else:
+            self.wd.log(f"fleet: {host.name} change failed: {done.get('error', 'recovery failed')}")
+        self.wd.notify(
+            "[Watchdog] Fleet change " + ("completed" if done.get("ok") else "failed"),
+            f"host={host.name}; reason={reason}; to={host.profile}",
+        )
+
+    async def host_task(self, host: FleetHost) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            try:
+                await self.poll(host)
+            except Exception as e:  # noqa: BLE001
+                self.wd.log(f"fleet: {host.name} poll error: {e}")
+            deadline = max(deadline + self.poll_interval_sec, loop.time())
+            await asyncio.sleep(deadline - loop.time())
+
+    async def summary_task(self) -> None:
+        while True:
+            await asyncio.sleep(self.summary_interval_sec)
+            parts = []
+            for h in self.hosts:
+                mem = f"{h.mem:.1f}%" if h.mem is not None else "-"
+                parts.append(f"{h.name}={h.profile or '?'}/{mem}/{h.state}")
+            self.wd.log("fleet: " + " ".join(parts))
+
+    async def main(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=("0.0.0.0", 0))
+        self.wd.log(f"fleet supervisor started: {len(self.hosts)} hosts, ladder={' > '.join(self.ladder)}")
+        tasks = [asyncio.create_task(self.host_task(h), name=f"host:{h.name}") for h in self.hosts]
+        tasks.append(asyncio.create_task(self.summary_task(), name="summary"))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.transport is not None:
+                self.transport.close()
+
+
+class SimulationDone(BaseException):
+    """Raised by SimClock.sleep() once virtual time passes the end of the trace.
+
+    A BaseException, like KeyboardInterrupt: the control loop's `except Exception` handlers (a
+    recovery waiting for readiness, say) must not turn the end of the replay into a failure.
+    """
+
+
+class SimClock:
+    """Virtual time for replays: sleep() returns immediately after advancing `now`."""
+
+    def __init__(self, start_ts: float, end_sec: float):
+        self.start_ts = start_ts
+        self.end_sec = end_sec
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.start_ts + self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += max(seconds, 0.0)
+        if self.now >= self.end_sec:
+            raise SimulationDone()
+
+
+def step_value(series: List[Tuple[float, Any]], t: float, default: Any) -> Any:
+    """Value of a (time, value) series at t, holding each sample until the next one."""
+    lo, hi = 0, len(series)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if series[mid][0] <= t:
+            lo = mid + 1
+        else:
+            hi = mid
+    return series[lo - 1][1] if lo else default
+
+
+@dataclass
+class Trace:
+    """Memory/health samples and recorded profile changes, as offsets in seconds from start_ts."""
+
+    start_ts: float = 0.0
+    memory: List[Tuple[float, float]] = field(default_factory=list)
+    health: List[Tuple[float, bool]] = field(default_factory=list)
+    profiles: List[Tuple[float, str]] = field(default_factory=list)
+    recoveries: int = 0
+    restart_sec: List[float] = field(default_factory=list)
+    ready_sec: List[float] = field(default_factory=list)
+
+    @property
+    def duration(self) -> float:
+        ends = [s[-1][0] for s in (self.memory, self.health) if s]
+        return max(ends) if ends else 0.0
+
+
+TRACE_LINE_RE = re.compile(r"^\[(?P<ts>[^\]]+)\] (?P<msg>.*)$")
+TRACE_PATTERNS = {
+    "memory": re.compile(r"^memory usage=([\d.]+)%"),
+    "health_fail": re.compile(r"^health fail count=\d+"),
+    "switched": re.compile(r"^(?:switched (?:profile|model) -> |profile mode enabled, start profile=)(\S+)"),
+    "recovery": re.compile(r"^recovery start: "),
+    "restart": re.compile(r"^recovery trace: .*\brestart_service=([\d.]+)s"),
+    "ready": re.compile(r"^service ready after ([\d.]+)s"),
+}
+
+
+def parse_trace(path: str) -> Trace:
+    """Read a watchdog.log (text or JSON lines) or a JSONL sample file {"t", "mem", "health"}.
+
+    Health is taken as failing at each "health fail count" line and healthy at every other memory
+    sample, since successful probes are not logged.
+    """
+    events: List[Tuple[float, str, Any]] = []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if "mem" in rec or "health" in rec:
+                    ts = float(rec.get("t", 0))
+                    if rec.get("mem") is not None:
+                        events.append((ts, "memory", float(rec["mem"])))
+                    if rec.get("health") is not None:
+                        events.append((ts, "health", bool(rec["health"])))
+                    continue
+                if "msg" not in rec or "ts" not in rec:
+                    continue
+                ts_text, msg = str(rec["ts"]), str(rec["msg"])
+            else:
+                m = TRACE_LINE_RE.match(line)
+                if not m:
+                    continue
+                ts_text, msg = m.group("ts"), m.group("msg")
+            try:
+                ts = datetime.fromisoformat(ts_text).timestamp()
+            except ValueError:
+                continue
+            for kind, pattern in TRACE_PATTERNS.items():
+                pm = pattern.match(msg)
+                if pm:
+                    events.append((ts, kind, pm.group(1) if pm.groups() else None))
+                    break
+
+    trace = Trace()
+    if not events:
+        return trace
+    # Concatenated or rotated logs may be out of order; the sort is stable for same-second lines.
+    events.sort(key=lambda e: e[0])
+    trace.start_ts = events[0][0]
+    failed_at: Set[float] = {ts for ts, kind, _ in events if kind == "health_fail"}
+    for ts, kind, value in events:
+        t = ts - trace.start_ts
+        if kind == "memory":
+            trace.memory.append((t, float(value)))
+            if ts not in failed_at:
+                trace.health.append((t, True))
+        elif kind == "health":
+            trace.health.append((t, bool(value)))
+        elif kind == "health_fail":
+            trace.health.append((t, False))
+        elif kind == "switched":
+            trace.profiles.append((t, str(value)))
+        elif kind == "recovery":
+            trace.recoveries += 1
+        elif kind == "restart":
+            trace.restart_sec.append(float(value))
+        elif kind == "ready":
+            trace.ready_sec.append(float(value))
+    return trace
+
+
+class TraceMemorySampler(MemorySampler):
+    """Replays recorded memory, shifted by the RAM difference between the simulated and recorded profile."""
+
+    name = "trace"
+
+    def __init__(self, sim: "Simulator"):
+        self.sim = sim
 
-            time.sleep(self.interval_sec)
+    def percent(self) -> float:
+        return self.sim.memory_at(self.sim.clock.monotonic())
+
+    def total_bytes(self) -> int:
+        return int(self.sim.total_gb * 1024 ** 3)
+
+
+class SimulatedWatchdog(Watchdog):
+    """Watchdog that reports recoveries and cooldown skips back to the simulator."""
+
+    sim: "Simulator"
+
+    def recover(self, reason: str, mem_percent: Optional[float] = None) -> None:
+        if self.should_cooldown():
+            self.sim.cooldown_skips += 1
+        super().recover(reason, mem_percent)
+
+    def run_recovery(self, reason: str, mem_percent: Optional[float], root: Span) -> None:
+        start = self.clock.monotonic()
+        restarts = self.sim.command_counts.get("restart", 0)
+        super().run_recovery(reason, mem_percent, root)
+        end = self.clock.monotonic()
+        if self.sim.command_counts.get("restart", 0) > restarts:
+            end = max(end, self.sim.up_at)
+        self.sim.recoveries.append((start, end, reason, bool(root.attrs.get("ok"))))
+        self.sim.active.append((self.clock.monotonic(), self.active_name()))
+
+    def active_name(self) -> str:
+        return self.current_profile().name if self.profiles else self.current_model().name
+
+
+class Simulator:
+    """Replays a Trace through the real control loop (Watchdog.loop) on a virtual clock.
+
+    Commands are answered by command_runner(): health follows the trace (and fails while the
+    simulated service restarts), switch/restart/load take the configured virtual durations.
+    """
+
+    def __init__(
+        self,
+        cfg: Dict[str, Any],
+        trace: Trace,
+        restart_sec: Optional[float] = None,
+        switch_sec: float = 1.0,
+        load_sec: float = 5.0,
+        ready_sec: Optional[float] = None,
+        total_gb: Optional[float] = None,
+        log_file: str = os.devnull,
+    ):
+        self.trace = trace
+        self.restart_sec = restart_sec if restart_sec is not None else median(trace.restart_sec, 20.0)
+        self.ready_sec = ready_sec if ready_sec is not None else median(trace.ready_sec, 0.0)
+        self.switch_sec = switch_sec
+        self.load_sec = load_sec
+        self.total_gb = total_gb or host_memory_bytes() / 1024 ** 3
+        self.clock = SimClock(trace.start_ts, trace.duration)
+        self.command_counts: Dict[str, int] = {}
+        self.up_at = 0.0
+        self.cooldown_skips = 0
+        self.recoveries: List[Tuple[float, float, str, bool]] = []
+
+        sim_cfg = dict(cfg, state_file="", metrics={"enabled": False}, config_reload={"enabled": False})
+        sim_cfg["log_file"] = log_file
+        # max_bytes=0: never try to rotate the log (it may be /dev/null).
+        sim_cfg["logging"] = dict(cfg.get("logging", {}), stdout=False, max_bytes=0, max_age_sec=0)
+        sim_cfg["notification"] = dict(cfg.get("notification", {}), webhook_url=None, queue={"enabled": False})
+        hc = cfg.get("health_check", {})
+        sim_cfg["health_check"] = {"command": ["<trace-health>"], "timeout_sec": hc.get("timeout_sec", 15)}
+        sim_cfg.pop("health_checks", None)
+        sim_cfg["rss_accounting"] = {"enabled": False}
+        for key in ("tracing", "exporter", "proxy", "fleet"):
+            sim_cfg.pop(key, None)
+        self.wd = SimulatedWatchdog(sim_cfg)
+        self.wd.sim = self
+        self.wd.clock = self.clock
+        self.wd.command_runner = self.run_command
+        self.wd.memory_sampler = TraceMemorySampler(self)
+        self.threshold = self.wd.memory_threshold_percent
+        self.active: List[Tuple[float, str]] = [(0.0, self.wd.active_name())]
+        self.ram_by_name: Dict[str, Optional[float]] = {p.name: self.wd.profile_ram_gb(p) for p in self.wd.profiles}
+        for m in self.wd.models:
+            self.ram_by_name.setdefault(m.name, m.effective_ram_gb())
+
+    def ram_of(self, name: str) -> Optional[float]:
+        if name not in self.ram_by_name and name.startswith(AUTO_PROFILE_PREFIX):
+            # Planner-built profiles appear mid-run.
+            for p in self.wd.profiles:
+                if p.name == name:
+                    self.ram_by_name[name] = self.wd.profile_ram_gb(p)
+        return self.ram_by_name.get(name)
+
+    def memory_at(self, t: float, simulated: bool = True) -> float:
+        mem = step_value(self.trace.memory, t, self.trace.memory[0][1] if self.trace.memory else 0.0)
+        if not simulated:
+            return mem
+        recorded = step_value(self.trace.profiles, t, self.active[0][1])
+        sim_ram, rec_ram = self.ram_of(step_value(self.active, t, "")), self.ram_of(recorded)
+        if sim_ram is not None and rec_ram is not None and self.total_gb > 0:
+            mem += (sim_ram - rec_ram) / self.total_gb * 100
+        return min(max(mem, 0.0), 100.0)
+
+    def run_command(self, cmd: List[str], timeout: int, kind: str) -> subprocess.CompletedProcess:
+        self.command_counts[kind] = self.command_counts.get(kind, 0) + 1
+        if kind == "health":
+            now = self.clock.monotonic()
+            ok = now >= self.up_at and step_value(self.trace.health, now, True)
+            return subprocess.CompletedProcess(cmd, 0 if ok else 1, "", "" if ok else "trace: unhealthy")
+        duration = {"switch": self.switch_sec, "restart": self.restart_sec, "load": self.load_sec}.get(kind, 0.0)
+        self.clock.now += min(duration, timeout)
+        if duration > timeout:
+            return subprocess.CompletedProcess(cmd, 124, "", f"timed out after {timeout}s")
+        if kind in ("restart", "emergency_restart"):
+            self.up_at = self.clock.now + self.ready_sec
+        return subprocess.CompletedProcess(cmd, 0, "", "")
+
+    def time_above(self, simulated: bool) -> float:
+        """Seconds with memory at or above the threshold, integrated over every trace/profile change."""
+        points = sorted({t for t, _ in self.trace.memory} | {t for t, _ in self.active} | {t for t, _ in self.trace.profiles})
+        points.append(self.trace.duration)
+        total = 0.0
+        for a, b in zip(points, points[1:]):
+            if b > a and self.memory_at(a, simulated) >= self.threshold:
+                total += b - a
+        return total
+
+    def run(self) -> Dict[str, Any]:
+        wall = time.perf_counter()
+        try:
+            if self.trace.duration > 0:
+                self.wd.loop()
+        except SimulationDone:
+            pass
+        finally:
+            self.wd.close()
+        wall = time.perf_counter() - wall
+        reasons: Dict[str, int] = {}
+        for _, _, reason, _ in self.recoveries:
+            reasons[reason] = reasons.get(reason, 0) + 1
+        per_profile: Dict[str, float] = {}
+        for (t, name), nxt in zip(self.active, self.active[1:] + [(self.trace.duration, "")]):
+            per_profile[name] = per_profile.get(name, 0.0) + max(min(nxt[0], self.trace.duration) - t, 0.0)
+        return {
+            "trace_sec": round(self.trace.duration, 1),
+            "memory_samples": len(self.trace.memory),
+            "wall_sec": round(wall, 3),
+            "speedup": round(self.trace.duration / wall, 1) if wall > 0 else None,
+            "threshold_percent": self.threshold,
+            "cooldown_sec": self.wd.cooldown_sec,
+            "consecutive_health_fail_limit": self.wd.consecutive_health_fail_limit,
+            "recoveries": len(self.recoveries),
+            "recoveries_by_reason": reasons,
+            "failed_recoveries": sum(1 for r in self.recoveries if not r[3]),
+            "cooldown_skips": self.cooldown_skips,
+            "restarts": self.command_counts.get("restart", 0),
+            "downtime_sec": round(sum(end - start for start, end, _, _ in self.recoveries), 1),
+            "overload_sec": round(self.time_above(simulated=True), 1),
+            "recorded_recoveries": self.trace.recoveries,
+            "recorded_overload_sec": round(self.time_above(simulated=False), 1),
+            "time_per_profile_sec": {k: round(v, 1) for k, v in per_profile.items()},
+            "final": self.wd.active_name(),
+            "restart_sec": self.restart_sec,
+            "ready_sec": self.ready_sec,
+        }
+
+
+def median(values: List[float], default: float) -> float:
+    if not values:
+        return default
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def apply_overrides(cfg: Dict[str, Any], overrides: List[str]) -> Dict[str, Any]:
+    """Apply `--set dotted.key=value` overrides to a copy of cfg; values are JSON, else strings."""
+    cfg = json.loads(json.dumps(cfg))
+    for item in overrides:
+        key, sep, raw = item.partition("=")
+        if not sep or not key:
+            raise ValueError(f"--set expects key=value, got {item!r}")
+        try:
+            value: Any = json.loads(raw)
+        except ValueError:
+            value = raw
+        node = cfg
+        parts = key.split(".")
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return cfg
+
+
+def run_simulation(cfg: Dict[str, Any], args: argparse.Namespace) -> int:
+    trace_path = args.trace or cfg.get("log_file", "watchdog.log")
+    try:
+        trace = parse_trace(trace_path)
+        cfg = apply_overrides(cfg, args.set)
+    except (OSError, ValueError) as e:
+        print(f"simulate: {e}", file=sys.stderr)
+        return 2
+    if not trace.memory:
+        print(f"simulate: no memory samples in {trace_path}", file=sys.stderr)
+        return 2
+    result = Simulator(
+        cfg,
+        trace,
+        restart_sec=args.restart_sec,
+        ready_sec=args.ready_sec,
+        total_gb=args.total_gb,
+        log_file=args.sim_log or os.devnull,
+    ).run()
+    result["trace"] = trace_path
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+    print(f"trace: {trace_path} ({result['trace_sec']:.0f}s, {result['memory_samples']} samples)")
+    print(
+        f"config: threshold={result['threshold_percent']:g}% cooldown={result['cooldown_sec']}s "
+        f"health_fail_limit={result['consecutive_health_fail_limit']}"
+    )
+    reasons = ", ".join(f"{k}={v}" for k, v in sorted(result["recoveries_by_reason"].items())) or "-"
+    print(
+        f"recoveries: {result['recoveries']} ({reasons}), failed={result['failed_recoveries']}, "
+        f"cooldown skips={result['cooldown_skips']}, restarts={result['restarts']} "
+        f"(recorded: {result['recorded_recoveries']})"
+    )
+    print(f"downtime: {result['downtime_sec']:.0f}s (restart={result['restart_sec']:g}s ready={result['ready_sec']:g}s)")
+    print(f"time in overload: {result['overload_sec']:.0f}s (recorded: {result['recorded_overload_sec']:.0f}s)")
+    print("time per profile: " + ", ".join(f"{k}={v:.0f}s" for k, v in result["time_per_profile_sec"].items()))
+    print(f"replayed in {result['wall_sec']:.2f}s ({result['speedup']}x real time)")
+    return 0
+
+
+def bench_control_loop(cfg: Dict[str, Any], iterations: int) -> List[Tuple[str, float, str]]:
+    """Per-call cost of the control loop's own code, with commands answered in-process (no fork)."""
+    samples = [(float(i), 40.0) for i in range(iterations + 1)]
+    trace = Trace(start_ts=time.time(), memory=samples, health=[(0.0, True)])
+    bench_cfg = dict(cfg, cooldown_sec=0, interval_sec=1, adaptive_sampling={"enabled": False}, planner={"enabled": False})
+    bench_cfg.setdefault("switch", {"command": ["switch", "{profile}", "{models_spaced}", "{model}"]})
+    sim = Simulator(bench_cfg, trace, restart_sec=0, switch_sec=0, load_sec=0, ready_sec=0)
+    wd = sim.wd
+    real_sampler = create_memory_sampler(cfg.get("memory_sampler", "auto"), cfg.get("cgroup_dir"))
+    values = wd.current_profile().template_values() if wd.profiles else {"model": wd.current_model().name}
+
+    def memory_tick() -> None:
+        wd.memory_action(real_sampler.percent())
+
+    def recover() -> None:
+        wd.recover("health_check_failed")
+
+    ops: List[Tuple[str, Callable[[], Any]]] = [
+        ("memory_usage_percent + memory_action", memory_tick),
+        ("health_ok (in-process runner)", lambda: wd.health_ok(quiet=True)),
+        ("command render (switch)", lambda: wd.command("switch", values)),
+        ("recover (in-process runner)", recover),
+    ]
+    results: List[Tuple[str, float, str]] = []
+    try:
+        for name, fn in ops:
+            fn()
+            timings: List[int] = []
+            for _ in range(iterations):
+                start = time.perf_counter_ns()
+                fn()
+                timings.append(time.perf_counter_ns() - start)
+            timings.sort()
+            results.append((f"{name} mean", sum(timings) / len(timings) / 1e3, "us/call"))
+            results.append((f"{name} p99", timings[min(int(len(timings) * 0.99), len(timings) - 1)] / 1e3, "us/call"))
+        sim.clock.now = 0.0
+        sim.clock.end_sec = float(iterations)
+        start = time.perf_counter()
+        try:
+            wd.loop()
+        except SimulationDone:
+            pass
+        results.append(("loop tick (simulated clock)", (time.perf_counter() - start) / iterations * 1e6, "us/tick"))
+    finally:
+        real_sampler.close()
+        wd.close()
+    return results
+
+
+def compare_bench(results: List[Tuple[str, float, str]], baseline_path: str, tolerance: float) -> List[str]:
+    """Results slower than the saved baseline by more than `tolerance` (a fraction); p99s are too noisy to gate."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    slower: List[str] = []
+    for name, value, unit in results:
+        old = baseline.get(name)
+        if name.endswith(" p99"):
+            continue
+        if old and value > old * (1 + tolerance):
+            slower.append(f"{name}: {value:.2f} {unit} vs {old:.2f} (+{(value / old - 1) * 100:.0f}%)")
+    return slower
+
+
+def bench_health(cfg: Dict[str, Any], iterations: int) -> List[Tuple[str, float, str]]:
+    """Startup cost, per-tick health cost and login-shell overhead, measured against the live service."""
+    bench_cfg = dict(cfg, log_file=os.devnull, state_file="", metrics={"enabled": False})
+    bench_cfg["logging"] = dict(cfg.get("logging", {}), stdout=False)
+    bench_cfg["notification"] = dict(cfg.get("notification", {}), queue={"enabled": False})
+    results: List[Tuple[str, float, str]] = []
+
+    start = time.perf_counter()
+    wd = Watchdog(bench_cfg)
+    results.append(("startup (Watchdog init)", (time.perf_counter() - start) * 1e3, "ms"))
+    try:
+        hc = bench_cfg.get("health_check", {})
+        variants: List[Tuple[str, Optional[str]]] = []
+        if hc.get("command") and not bench_cfg.get("health_checks"):
+            variants.append(("health tick (subprocess)", None))
+        if wd.health_api_url or bench_cfg.get("health_checks"):
+            variants.append(("health tick (api/probes)", wd.health_api_url))
+        for name, api_url in variants:
+            wd.health_api_url = api_url
+            wd.health_ok(quiet=True)
+            start = time.perf_counter()
+            for _ in range(iterations):
+                wd.health_ok(quiet=True)
+            results.append((name, (time.perf_counter() - start) / iterations * 1e3, "ms/tick"))
+
+        for name, cached in (("bash -lc true (login each call)", False), ("bash -lc true (cached login env)", True)):
+            wd.cache_login_env = cached
+            wd.exec_command(["bash", "-lc", "true"], timeout=30, kind="bench")
+            start = time.perf_counter()
+            for _ in range(iterations):
+                wd.exec_command(["bash", "-lc", "true"], timeout=30, kind="bench")
+            results.append((name, (time.perf_counter() - start) / iterations * 1e3, "ms/call"))
+    finally:
+        wd.close()
+    return results
 
 
 def load_config(path: str) -> Dict[str, Any]:
@@ -430,10 +4850,110 @@ def load_config(path: str) -> Dict[str, Any]:
         return json.load(f)
 
 
+def config_lookup(config: Dict[str, Any], dotted: str) -> Any:
+    node: Any = config
+    for key in dotted.split("."):
+        if not isinstance(node, dict):
+            return None
+        node = node.get(key)
+    return node
+
+
+def metrics_capacities(mcfg: Dict[str, Any]) -> Tuple[int, int, int]:
+    return (
+        int(mcfg.get("raw_capacity", 200_000)),
+        int(mcfg.get("minute_capacity", 129_600)),
+        int(mcfg.get("hour_capacity", 17_520)),
+    )
+
+
+def parse_time_arg(value: str, now: float) -> float:
+    """'now', a relative age like '90m' / '12h' / '7d', or an ISO timestamp."""
+    if value == "now":
+        return now
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)([smhdw])", value)
+    if m:
+        unit = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}[m.group(2)]
+        return now - float(m.group(1)) * unit
+    return datetime.fromisoformat(value).timestamp()
+
+
+def print_stats(cfg: Dict[str, Any], args: argparse.Namespace) -> int:
+    mcfg = cfg.get("metrics", {})
+    path = mcfg.get("file", "watchdog.metrics")
+    try:
+        store = MetricsStore(path, metrics_capacities(mcfg), readonly=True)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"metrics not available: {e}", file=sys.stderr)
+        return 2
+    now = time.time()
+    start = parse_time_arg(args.since, now)
+    end = parse_time_arg(args.until, now)
+    threshold = float(cfg.get("memory_threshold_percent", 90))
+    percentiles = tuple(float(p) for p in args.percentiles.split(",") if p)
+    t0 = time.perf_counter()
+    result = store.query(start, end, resolution=args.resolution, percentiles=percentiles, threshold=threshold)
+    result["query_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    store.close()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    def fmt_ts(ts: Optional[float]) -> str:
+        return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else "-"
+
+    print(f"range: {fmt_ts(start)} .. {fmt_ts(end)} ({result['resolution']}, {result['records']} records)")
+    if result["memory_samples"]:
+        pcts = " ".join(f"{k}={v:.2f}%" for k, v in result["memory_percentiles"].items())
+        print(f"memory: avg={result['memory_avg']:.2f}% max={result['memory_max']:.2f}% at {fmt_ts(result['memory_max_ts'])}")
+        print(f"memory percentiles: {pcts}")
+        print(f"above {threshold:g}%: {result['above_threshold_sec']:.0f}s")
+    else:
+        print("memory: no samples")
+    if result["health_latency_max_ms"] is not None:
+        pcts = " ".join(f"{k}={v:.1f}ms" for k, v in result["health_latency_percentiles_ms"].items())
+        print(f"health latency: max={result['health_latency_max_ms']:.1f}ms {pcts}")
+    if result["events"]:
+        print("events: " + ", ".join(f"{k}={v}" for k, v in sorted(result["events"].items())))
+    print(f"query: {result['query_ms']}ms")
+    return 0
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Memory + model watchdog")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="run",
+        choices=["run", "bench", "stats", "agent", "fleet", "simulate"],
+        help="run (default), bench, stats, agent (fleet host), fleet (supervisor) or simulate (replay a trace)",
+    )
     parser.add_argument("-c", "--config", default="config.json", help="config json path")
     parser.add_argument("--dry-run", action="store_true", help="print actions without changing system")
+    parser.add_argument("--iterations", type=int, default=2000, help="bench: samples per backend")
+    parser.add_argument("--since", default="24h", help="stats: range start (e.g. 12h, 7d, ISO time)")
+    parser.add_argument("--until", default="now", help="stats: range end")
+    parser.add_argument("--resolution", choices=["auto", "raw", "1m", "1h"], default="auto", help="stats: data tier")
+    parser.add_argument("--percentiles", default="50,95,99", help="stats: comma separated percentiles")
+    parser.add_argument("--json", action="store_true", help="stats/simulate: print JSON")
+    parser.add_argument("--trace", help="simulate: watchdog.log or JSONL trace to replay (default: config log_file)")
+    parser.add_argument(
+        "--set", action="append", default=[], metavar="KEY=VALUE", help="simulate: override a config key (repeatable)"
+    )
+    parser.add_argument("--restart-sec", type=float, help="simulate: restart duration (default: median from trace, else 20)")
+    parser.add_argument("--ready-sec", type=float, help="simulate: time to ready after restart (default: from trace, else 0)")
+    parser.add_argument("--total-gb", type=float, help="simulate: RAM of the traced host (default: this host)")
+    parser.add_argument("--sim-log", help="simulate: write the simulated watchdog log here")
+    parser.add_argument("--save", help="bench: write results as JSON baseline")
+    parser.add_argument("--baseline", help="bench: compare with a saved baseline, exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="bench: allowed slowdown vs baseline (fraction)")
+    parser.add_argument(
+        "--engine",
+        choices=["sync", "asyncio"],
+        default=None,
+        help="control loop engine (default: config.engine or sync)",
+    )
     args = parser.parse_args()
 
     if not Path(args.config).exists():
@@ -441,8 +4961,73 @@ def main() -> int:
         return 2
 
     cfg = load_config(args.config)
+    if args.command == "stats":
+        return print_stats(cfg, args)
+    if args.command == "simulate":
+        return run_simulation(cfg, args)
+    if args.command == "bench":
+        results: List[Tuple[str, float, str]] = [
+            (f"memory sampler {name}", usec, "us/sample")
+            for name, usec in bench_memory_samplers(cfg.get("memory_sampler", "auto"), args.iterations, cfg.get("cgroup_dir"))
+        ]
+        results += bench_health(cfg, max(args.iterations // 100, 5))
+        results += bench_control_loop(cfg, args.iterations)
+        for name, value, unit in results:
+            print(f"{name}: {value:.2f} {unit}")
+        if args.save:
+            atomic_write_json(args.save, {name: value for name, value, _ in results})
+        if args.baseline:
+            slower = compare_bench(results, args.baseline, args.tolerance)
+            for line in slower:
+                print(f"REGRESSION {line}")
+            return 1 if slower else 0
+        return 0
+
+    if args.command == "fleet":
+        # The supervisor has no local profile of its own to persist.
+        cfg.setdefault("state_file", "")
+
+    # launchd stops the job with SIGTERM; turn it into SystemExit so buffered log lines get flushed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     watchdog = Watchdog(cfg, dry_run=args.dry_run)
-    watchdog.loop()
+    if args.command in ("run", "agent"):
+        watchdog.config_path = args.config
+    exporter: Optional[MetricsExporter] = None
+    ecfg = cfg.get("exporter", {})
+    if ecfg.get("enabled", False):
+        exporter = MetricsExporter(watchdog, ecfg.get("bind", "127.0.0.1"), int(ecfg.get("port", 9464)))
+        exporter.start()
+        watchdog.log(f"metrics exporter listening on {ecfg.get('bind', '127.0.0.1')}:{ecfg.get('port', 9464)}")
+    pcfg = cfg.get("proxy", {})
+    if pcfg.get("enabled", False) and args.command in ("run", "agent"):
+        watchdog.proxy = RequestProxy(watchdog, pcfg)
+        watchdog.proxy.start()
+        watchdog.log(f"request proxy listening on {pcfg.get('bind', '127.0.0.1')}:{pcfg.get('port', 11435)}")
+    engine = args.engine or cfg.get("engine", "sync")
+    fcfg = cfg.get("fleet", {})
+    try:
+        if args.command == "agent":
+            acfg = fcfg.get("agent", {})
+            agent = FleetAgent(
+                watchdog,
+                str(fcfg.get("secret", "")),
+                float(fcfg.get("max_skew_sec", 30)),
+                probe_interval_sec=acfg.get("probe_interval_sec"),
+                fallback_after_sec=float(acfg.get("fallback_after_sec", 30)),
+            )
+            asyncio.run(agent.serve(acfg.get("bind", "0.0.0.0"), int(acfg.get("port", FLEET_PORT))))
+        elif args.command == "fleet":
+            asyncio.run(FleetSupervisor(watchdog, fcfg).main())
+        elif engine == "asyncio":
+            AsyncEngine(watchdog).run()
+        else:
+            watchdog.loop()
+    finally:
+        if exporter is not None:
+            exporter.close()
+        if watchdog.proxy is not None:
+            watchdog.proxy.close()
+        watchdog.close()
     return 0
 
 